@@ -0,0 +1,78 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2023-03-01 00:00:00.000000
+
+Databases created by the old `create_all` at import already have these
+tables, mark them as migrated with `alembic stamp 0001`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("uuid", sa.String()),
+        sa.Column("email", sa.String()),
+        sa.Column("password", sa.String()),
+        sa.Column("is_active", sa.Boolean()),
+        sa.Column("is_admin", sa.Boolean()),
+        sa.Column("token", sa.String(), unique=True, nullable=True),
+        sa.Column("disabled", sa.Boolean()),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_uuid", "users", ["uuid"], unique=True)
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    op.create_table(
+        "expenditures",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("uuid", sa.String()),
+        sa.Column("name", sa.String()),
+        sa.Column("cost", sa.Float()),
+        sa.Column("date", sa.Date()),
+        sa.Column("place", sa.String()),
+        sa.Column("type", sa.Enum("normal", "cyclical", name="expendituretypes")),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id")),
+    )
+    op.create_index("ix_expenditures_id", "expenditures", ["id"])
+    op.create_index("ix_expenditures_uuid", "expenditures", ["uuid"], unique=True)
+
+    op.create_table(
+        "expenditures_day_stats",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("uuid", sa.String()),
+        sa.Column("total_cost", sa.Float()),
+        sa.Column("date", sa.Date()),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id")),
+    )
+    op.create_index("ix_expenditures_day_stats_id", "expenditures_day_stats", ["id"])
+    op.create_index("ix_expenditures_day_stats_uuid", "expenditures_day_stats", ["uuid"], unique=True)
+
+    op.create_table(
+        "limits",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("uuid", sa.String()),
+        sa.Column("year", sa.Integer()),
+        sa.Column("month", sa.Integer()),
+        sa.Column("limit", sa.Float()),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id")),
+    )
+    op.create_index("ix_limits_id", "limits", ["id"])
+    op.create_index("ix_limits_uuid", "limits", ["uuid"], unique=True)
+
+
+def downgrade():
+    op.drop_table("limits")
+    op.drop_table("expenditures_day_stats")
+    op.drop_table("expenditures")
+    op.drop_table("users")
@@ -0,0 +1,34 @@
+"""owner composite indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2023-03-02 00:00:00.000000
+
+Per-user listings filter by owner_id plus date or year/month.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_expenditures_owner_id_date", "expenditures", ["owner_id", "date"])
+    op.create_index("ix_expenditures_day_stats_owner_id_date", "expenditures_day_stats", ["owner_id", "date"])
+
+    # keep the newest limit when a month was stored more than once before the unique index existed
+    op.execute(
+        "DELETE FROM limits WHERE id NOT IN "
+        "(SELECT MAX(id) FROM limits GROUP BY owner_id, year, month)"
+    )
+    op.create_index("ix_limits_owner_id_year_month", "limits", ["owner_id", "year", "month"], unique=True)
+
+
+def downgrade():
+    op.drop_index("ix_limits_owner_id_year_month", table_name="limits")
+    op.drop_index("ix_expenditures_day_stats_owner_id_date", table_name="expenditures_day_stats")
+    op.drop_index("ix_expenditures_owner_id_date", table_name="expenditures")
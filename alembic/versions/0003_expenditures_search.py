@@ -0,0 +1,72 @@
+"""expenditures search
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2023-03-09 00:00:00.000000
+
+Full text search over expenditure name and place: an FTS5 table kept in sync
+by triggers on SQLite, a GIN expression index on PostgreSQL.
+"""
+from alembic import op
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS expenditures_fts USING fts5("
+    "name, place, content='expenditures', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS expenditures_fts_insert AFTER INSERT ON expenditures BEGIN "
+    "INSERT INTO expenditures_fts(rowid, name, place) VALUES (new.id, new.name, new.place); END",
+    "CREATE TRIGGER IF NOT EXISTS expenditures_fts_delete AFTER DELETE ON expenditures BEGIN "
+    "INSERT INTO expenditures_fts(expenditures_fts, rowid, name, place) VALUES ('delete', old.id, old.name, old.place); END",
+    "CREATE TRIGGER IF NOT EXISTS expenditures_fts_update AFTER UPDATE OF name, place ON expenditures BEGIN "
+    "INSERT INTO expenditures_fts(expenditures_fts, rowid, name, place) VALUES ('delete', old.id, old.name, old.place); "
+    "INSERT INTO expenditures_fts(rowid, name, place) VALUES (new.id, new.name, new.place); END",
+    # index the rows stored before the triggers existed
+    "INSERT INTO expenditures_fts(expenditures_fts) VALUES ('rebuild')",
+]
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS expenditures_fts_update",
+    "DROP TRIGGER IF EXISTS expenditures_fts_delete",
+    "DROP TRIGGER IF EXISTS expenditures_fts_insert",
+    "DROP TABLE IF EXISTS expenditures_fts",
+]
+POSTGRESQL_UPGRADE = [
+    "CREATE INDEX IF NOT EXISTS ix_expenditures_search ON expenditures "
+    "USING GIN (to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(place, '')))",
+]
+POSTGRESQL_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_expenditures_search",
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        statements = SQLITE_UPGRADE
+    elif dialect == "postgresql":
+        statements = POSTGRESQL_UPGRADE
+    else:
+        statements = []
+
+    for statement in statements:
+        op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        statements = SQLITE_DOWNGRADE
+    elif dialect == "postgresql":
+        statements = POSTGRESQL_DOWNGRADE
+    else:
+        statements = []
+
+    for statement in statements:
+        op.execute(statement)
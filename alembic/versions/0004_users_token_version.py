@@ -0,0 +1,26 @@
+"""users token version
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2023-03-16 00:00:00.000000
+
+Stateless tokens carry the user's token version, bumping it revokes them.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.add_column(sa.Column("token_version", sa.Integer(), server_default="0", nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("token_version")
@@ -0,0 +1,55 @@
+"""unique day stats
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2023-03-23 00:00:00.000000
+
+Day totals are upserted on (owner_id, date), so a user has one row per day.
+"""
+from alembic import op
+import sqlalchemy as sa
+from uuid import uuid4
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # rows of one day were recalculated to the same total, keep the newest
+    op.execute(
+        "DELETE FROM expenditures_day_stats WHERE id NOT IN "
+        "(SELECT MAX(id) FROM expenditures_day_stats GROUP BY owner_id, date)"
+    )
+    # totals may be wrong after the recalculation capped at 100 expenditures, fix them from the expenditures
+    op.execute(
+        "UPDATE expenditures_day_stats SET total_cost = "
+        "(SELECT COALESCE(SUM(expenditures.cost), 0) FROM expenditures "
+        "WHERE expenditures.owner_id = expenditures_day_stats.owner_id AND expenditures.date = expenditures_day_stats.date)"
+    )
+    # the recalculation never ran on deletes and missed failed background tasks, so days can be left
+    # without expenditures or without a row. Like a rebuild, a row per day with expenditures and no others
+    op.execute(
+        "DELETE FROM expenditures_day_stats WHERE NOT EXISTS (SELECT 1 FROM expenditures "
+        "WHERE expenditures.owner_id = expenditures_day_stats.owner_id AND expenditures.date = expenditures_day_stats.date)"
+    )
+    missing = op.get_bind().execute(sa.text(
+        "SELECT owner_id, date, SUM(cost) AS total_cost FROM expenditures WHERE owner_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM expenditures_day_stats "
+        "WHERE expenditures_day_stats.owner_id = expenditures.owner_id AND expenditures_day_stats.date = expenditures.date) "
+        "GROUP BY owner_id, date"
+    )).all()
+
+    if missing:
+        op.get_bind().execute(
+            sa.text("INSERT INTO expenditures_day_stats (uuid, owner_id, date, total_cost) VALUES (:uuid, :owner_id, :date, :total_cost)"),
+            [{"uuid": str(uuid4()), "owner_id": row.owner_id, "date": row.date, "total_cost": row.total_cost} for row in missing],
+        )
+    op.drop_index("ix_expenditures_day_stats_owner_id_date", table_name="expenditures_day_stats")
+    op.create_index("ix_expenditures_day_stats_owner_id_date", "expenditures_day_stats", ["owner_id", "date"], unique=True)
+
+
+def downgrade():
+    op.drop_index("ix_expenditures_day_stats_owner_id_date", table_name="expenditures_day_stats")
+    op.create_index("ix_expenditures_day_stats_owner_id_date", "expenditures_day_stats", ["owner_id", "date"])
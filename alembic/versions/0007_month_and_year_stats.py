@@ -0,0 +1,64 @@
+"""month and year stats
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2023-04-06 00:00:00.000000
+
+Month and year expenditure totals, maintained together with the day stats.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "expenditures_month_stats",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("year", sa.Integer()),
+        sa.Column("month", sa.Integer()),
+        sa.Column("total_cost", sa.Float()),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id")),
+    )
+    op.create_index("ix_expenditures_month_stats_id", "expenditures_month_stats", ["id"])
+    op.create_index("ix_expenditures_month_stats_owner_id_year_month", "expenditures_month_stats", ["owner_id", "year", "month"], unique=True)
+
+    op.create_table(
+        "expenditures_year_stats",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("year", sa.Integer()),
+        sa.Column("total_cost", sa.Float()),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id")),
+    )
+    op.create_index("ix_expenditures_year_stats_id", "expenditures_year_stats", ["id"])
+    op.create_index("ix_expenditures_year_stats_owner_id_year", "expenditures_year_stats", ["owner_id", "year"], unique=True)
+
+    # backfill from the day stats
+    year = sa.extract("year", sa.column("date"))
+    month = sa.extract("month", sa.column("date"))
+    day_stats = sa.table("expenditures_day_stats", sa.column("owner_id"), sa.column("date"), sa.column("total_cost"))
+    month_stats = sa.table("expenditures_month_stats", sa.column("owner_id"), sa.column("year"), sa.column("month"), sa.column("total_cost"))
+    year_stats = sa.table("expenditures_year_stats", sa.column("owner_id"), sa.column("year"), sa.column("total_cost"))
+
+    op.execute(month_stats.insert().from_select(
+        ["owner_id", "year", "month", "total_cost"],
+        sa.select(day_stats.c.owner_id, year, month, sa.func.sum(day_stats.c.total_cost)).group_by(day_stats.c.owner_id, year, month),
+    ))
+    op.execute(year_stats.insert().from_select(
+        ["owner_id", "year", "total_cost"],
+        sa.select(day_stats.c.owner_id, year, sa.func.sum(day_stats.c.total_cost)).group_by(day_stats.c.owner_id, year),
+    ))
+
+
+def downgrade():
+    op.drop_index("ix_expenditures_year_stats_owner_id_year", table_name="expenditures_year_stats")
+    op.drop_index("ix_expenditures_year_stats_id", table_name="expenditures_year_stats")
+    op.drop_table("expenditures_year_stats")
+    op.drop_index("ix_expenditures_month_stats_owner_id_year_month", table_name="expenditures_month_stats")
+    op.drop_index("ix_expenditures_month_stats_id", table_name="expenditures_month_stats")
+    op.drop_table("expenditures_month_stats")
@@ -0,0 +1,43 @@
+"""expenditure recurrence
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2023-04-13 00:00:00.000000
+
+Recurrence rules of cyclical expenditures, their occurrences are expanded at query time.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    recurrence_units = sa.Enum("day", "week", "month", name="recurrenceunits")
+    recurrence_units.create(op.get_bind(), checkfirst=True)
+
+    with op.batch_alter_table("expenditures") as batch_op:
+        batch_op.add_column(sa.Column("recurrence_unit", recurrence_units, nullable=True))
+        batch_op.add_column(sa.Column("recurrence_interval", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("recurrence_end", sa.Date(), nullable=True))
+        batch_op.add_column(sa.Column("materialized_until", sa.Date(), nullable=True))
+
+    op.create_index("ix_expenditures_owner_id_recurrence", "expenditures", ["owner_id"],
+        sqlite_where=sa.text("recurrence_unit IS NOT NULL"), postgresql_where=sa.text("recurrence_unit IS NOT NULL"))
+
+
+def downgrade():
+    op.drop_index("ix_expenditures_owner_id_recurrence", table_name="expenditures")
+
+    # plain ALTER TABLE ... DROP COLUMN (sqlite 3.35+), a recreated table would lose the search triggers
+    with op.batch_alter_table("expenditures", recreate="never") as batch_op:
+        batch_op.drop_column("materialized_until")
+        batch_op.drop_column("recurrence_end")
+        batch_op.drop_column("recurrence_interval")
+        batch_op.drop_column("recurrence_unit")
+
+    sa.Enum(name="recurrenceunits").drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,26 @@
+"""users data version
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2023-04-20 00:00:00.000000
+
+Bumped on every write of the user's data, the read routes answer conditional GETs from it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.add_column(sa.Column("data_version", sa.Integer(), server_default="0", nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("data_version")
@@ -0,0 +1,65 @@
+"""change sequence and tombstones
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2023-04-27 00:00:00.000000
+
+Expenditures, limits and day stats carry the owner's data version of their last write,
+deletions leave tombstones, the changes since a data version are synced to the clients.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+TABLES = ("expenditures", "limits", "expenditures_day_stats")
+
+
+def upgrade():
+    for table in TABLES:
+        # plain ALTER TABLE ... ADD COLUMN, a recreated expenditures table would lose the search triggers
+        with op.batch_alter_table(table, recreate="never") as batch_op:
+            batch_op.add_column(sa.Column("change_seq", sa.Integer(), server_default="0", nullable=False))
+
+        op.create_index("ix_" + table + "_owner_id_change_seq", table, ["owner_id", "change_seq"])
+
+    # every existing row gets a sequence of its own after its owner's data version, as if written one by one,
+    # so a first sync is paged like any other. The data version moves past them
+    for table in TABLES:
+        op.execute(
+            "UPDATE " + table + " SET change_seq = ranked.change_seq FROM "
+            "(SELECT existing.id, users.data_version + ROW_NUMBER() OVER (PARTITION BY existing.owner_id ORDER BY existing.id) AS change_seq "
+            "FROM " + table + " AS existing JOIN users ON users.id = existing.owner_id) AS ranked "
+            "WHERE " + table + ".id = ranked.id"
+        )
+        op.execute(
+            "UPDATE users SET data_version = data_version + "
+            "(SELECT COUNT(*) FROM " + table + " WHERE " + table + ".owner_id = users.id)"
+        )
+
+    op.create_table(
+        "tombstones",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("entity", sa.String(), nullable=False),
+        sa.Column("uuid", sa.String(), nullable=False),
+        sa.Column("owner_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("change_seq", sa.Integer(), nullable=False),
+    )
+    op.create_index("ix_tombstones_id", "tombstones", ["id"])
+    op.create_index("ix_tombstones_owner_id_change_seq", "tombstones", ["owner_id", "change_seq"])
+
+
+def downgrade():
+    op.drop_index("ix_tombstones_owner_id_change_seq", table_name="tombstones")
+    op.drop_index("ix_tombstones_id", table_name="tombstones")
+    op.drop_table("tombstones")
+
+    for table in reversed(TABLES):
+        op.drop_index("ix_" + table + "_owner_id_change_seq", table_name=table)
+
+        with op.batch_alter_table(table, recreate="never") as batch_op:
+            batch_op.drop_column("change_seq")
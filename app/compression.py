@@ -0,0 +1,139 @@
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# incremental compressors, every chunk is flushed so a streamed response reaches the client chunk by chunk
+class __GZipCompressor:
+    def __init__(self, level: int):
+        # wbits 31, a deflate stream in the gzip format
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush(zlib.Z_FINISH)
+
+class __BrotliCompressor:
+    def __init__(self, quality: int):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+COMPRESSORS = {"gzip": __GZipCompressor}
+if brotli is not None:
+    COMPRESSORS["br"] = __BrotliCompressor
+
+# brotli is preferred over gzip when the client weights both the same
+ENCODINGS = ("br", "gzip")
+
+def get_encoding(accept_encoding: str):
+    accepted = {}
+
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        accepted[name.strip().lower()] = quality
+
+    qualities = {encoding: accepted.get(encoding, accepted.get("*", 0)) for encoding in ENCODINGS if encoding in COMPRESSORS}
+
+    # the client's highest weight wins, the order of ENCODINGS only breaks ties
+    encoding = max(qualities, key=qualities.get, default=None)
+    if encoding is None or qualities[encoding] <= 0:
+        return None
+
+    return encoding
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 500, media_types: list = None, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.media_types = set(media_types or [])
+        self.levels = {"gzip": gzip_level, "br": brotli_quality}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        encoding = get_encoding(Headers(scope=scope).get("accept-encoding", "")) if scope["type"] == "http" else None
+
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+class CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.originalSend = send
+        self.startMessage = None
+        self.compressor = None
+        self.started = False
+
+    def __is_compressible(self, headers: Headers) -> bool:
+        mediaType = headers.get("content-type", "").split(";")[0].strip().lower()
+
+        return "content-encoding" not in headers and mediaType in self.middleware.media_types
+
+    async def send(self, message: Message):
+        if message["type"] == "http.response.start":
+            # the headers are sent with the first body, once it is known if the body is compressed
+            self.startMessage = message
+            return
+
+        if message["type"] != "http.response.body":
+            await self.originalSend(message)
+            return
+
+        body = message.get("body", b"")
+        moreBody = message.get("more_body", False)
+
+        if not self.started:
+            self.started = True
+            headers = MutableHeaders(raw=self.startMessage["headers"])
+
+            # a small body is not worth compressing, a stream of unknown length is compressed whatever its size.
+            # The http middlewares resend whole bodies in chunks, their size is kept in the content-length header
+            size = int(headers["content-length"]) if "content-length" in headers else None
+            if size is None and not moreBody:
+                size = len(body)
+
+            if self.__is_compressible(headers) and (size is None or size >= self.middleware.minimum_size):
+                self.compressor = COMPRESSORS[self.encoding](self.middleware.levels[self.encoding])
+
+                headers["Content-Encoding"] = self.encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+                if not moreBody:
+                    body = self.compressor.compress(body) + self.compressor.finish()
+                    headers["Content-Length"] = str(len(body))
+                    self.compressor = None
+
+            await self.originalSend(self.startMessage)
+
+        if self.compressor is not None:
+            body = self.compressor.compress(body)
+
+            if not moreBody:
+                body += self.compressor.finish()
+
+        await self.originalSend({**message, "body": body})
@@ -1,10 +1,70 @@
 from pydantic import BaseSettings
+from typing import List, Union
+from functools import lru_cache
 
 class Settings(BaseSettings):
     app_name: str = "Home Budget API"
     secret_key: str
     algorithm: str
     access_token_expire_minutes: int = 5
+    # verify tokens by signature and token version instead of the token stored on the user
+    stateless_tokens: bool = False
+    # bcrypt cost and the size of the pool hashing and verifying passwords
+    password_hash_rounds: int = 12
+    password_hash_workers: int = 2
+
+    # database
+    database_url: str = "sqlite:///./sql_app.db"
+    # derived from database_url (aiosqlite / asyncpg driver) when not set
+    async_database_url: Union[str, None] = None
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_timeout: int = 30
+    database_pool_recycle: int = 1800
+    database_pool_pre_ping: bool = True
+
+    # sqlite tuning profile, applied on every new connection
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_mmap_size: int = 268435456
+    sqlite_cache_size: int = -64000
+    sqlite_busy_timeout: int = 5000
+
+    # approximate listing totals served to admins
+    count_cache_ttl_seconds: int = 60
+    count_cache_size: int = 1024
+
+    # durable job queue, job_workers threads are started with the app
+    job_workers: int = 2
+    job_poll_interval_seconds: float = 1.0
+    job_max_attempts: int = 5
+    job_retry_backoff_seconds: int = 5
+    job_lease_seconds: int = 300
+
+    # token -> user snapshot cache used to authenticate requests
+    token_cache_ttl_seconds: int = 300
+    token_cache_size: int = 10000
+
+    # rows fetched from the server side cursor and written per chunk of an export
+    export_batch_size: int = 1000
+
+    # operations accepted by one POST /expenditures/batch request
+    expenditure_batch_max_operations: int = 500
+
+    # rows validated and inserted per chunk of an import
+    import_batch_size: int = 2000
+
+    # gzip / brotli (when the brotli package is installed) compression of the responses of these media types,
+    # bodies under compression_minimum_size bytes are sent as they are, streamed bodies are always compressed
+    compression_minimum_size: int = 500
+    compression_media_types: List[str] = ["application/json", "application/x-ndjson", "text/csv"]
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 4
 
     class Config:
-        env_file = ".env"
\ No newline at end of file
+        env_file = ".env"
+
+
+@lru_cache()
+def get_settings():
+    return Settings()
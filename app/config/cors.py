@@ -15,4 +15,9 @@ allow_headers = [
     "Accept-Language",
     "Content-Language",
     "Content-Type",
+    "If-None-Match",
+]
+
+expose_headers = [
+    "ETag",
 ]
\ No newline at end of file
@@ -1,9 +1,8 @@
 from fastapi.security import OAuth2PasswordBearer
 import os
-from functools import lru_cache
 
-from .database import SessionLocal
-from .config import config
+from .database import SessionLocal, AsyncSessionLocal
+from .config.config import get_settings
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -22,6 +21,9 @@ def get_db():
         db.close()
 
 
-@lru_cache()
-def get_settings():
-    return config.Settings()
\ No newline at end of file
+# the writes and the auth routes (bcrypt on its own pool) run on the async session, so they do not block the event loop.
+# The listings and stats stay on the sync session, fastapi runs them on its threadpool, where their
+# python side work (serialization, grouping) does not hold the event loop either
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
\ No newline at end of file
@@ -2,6 +2,7 @@ from fastapi import HTTPException, status
 
 # 400
 used_email_error = HTTPException(status_code=400, detail="Email already registered")
+invalid_cursor_error = HTTPException(status_code=400, detail="Invalid pagination cursor")
 
 # 401
 unauth_error = HTTPException(
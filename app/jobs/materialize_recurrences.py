@@ -0,0 +1,35 @@
+import argparse
+from datetime import date
+
+from ..database import SessionLocal
+from ..services import recurrence_service, user_service
+
+# stores the occurrences of the recurrence rules due until a day (today by default) as expenditures,
+# e.g. run daily, so the occurrences expanded at query time stay few
+# python -m app.jobs.materialize_recurrences [--user UUID] [--until YYYY-MM-DD]
+def main():
+    parser = argparse.ArgumentParser(description="Store the occurrences of the recurring expenditures as expenditures.")
+    parser.add_argument("--user", help="uuid of the user, all users when not given")
+    parser.add_argument("--until", type=date.fromisoformat, help="last day to materialize, today when not given")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        user_id = None
+
+        if args.user:
+            user = user_service.get_user(db, uuid=args.user)
+
+            if user is None:
+                parser.error("user not found")
+
+            user_id = user.id
+
+        materialized = recurrence_service.materialize_occurrences(db, user_id=user_id, until=args.until)
+
+        print("Materialized " + str(materialized) + " occurrences")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import argparse
+from datetime import date
+
+from ..database import SessionLocal
+from ..services import expenditures_day_stat_service, user_service
+
+# rebuilds expenditures_day_stats from the expenditures, e.g. after an import or a bug
+# python -m app.jobs.rebuild_day_stats [--user UUID] [--date-from YYYY-MM-DD] [--date-to YYYY-MM-DD]
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild expenditures day stats from the expenditures.")
+    parser.add_argument("--user", help="uuid of the user to rebuild, all users when not given")
+    parser.add_argument("--date-from", type=date.fromisoformat, help="first day to rebuild")
+    parser.add_argument("--date-to", type=date.fromisoformat, help="last day to rebuild")
+    parser.add_argument("--chunk-size", type=int, default=100, help="users rebuilt per transaction")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        user_id = None
+
+        if args.user:
+            user = user_service.get_user(db, uuid=args.user)
+
+            if user is None:
+                parser.error("user not found")
+
+            user_id = user.id
+
+        rebuilt = expenditures_day_stat_service.rebuild_expenditures_day_stats(db, user_id=user_id, date_from=args.date_from, date_to=args.date_to, chunk_size=args.chunk_size)
+
+        print("Rebuilt " + str(rebuilt) + " day stats")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
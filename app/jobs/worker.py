@@ -0,0 +1,90 @@
+from datetime import date
+import logging
+import threading
+
+from ..database import SessionLocal
+from ..dependencies import get_settings
+from ..services import expenditures_day_stat_service, job_service, recurrence_service
+
+logger = logging.getLogger(__name__)
+
+# job kinds
+REBUILD_DAY_STATS = "rebuild_day_stats"
+MATERIALIZE_RECURRENCES = "materialize_recurrences"
+
+def __rebuild_day_stats(db, job):
+    payload = job_service.get_job_payload(job)
+    date_from = date.fromisoformat(payload["date_from"]) if payload.get("date_from") else None
+    date_to = date.fromisoformat(payload["date_to"]) if payload.get("date_to") else None
+
+    expenditures_day_stat_service.rebuild_expenditures_day_stats(db, user_id=job.owner_id, date_from=date_from, date_to=date_to)
+
+def __materialize_recurrences(db, job):
+    payload = job_service.get_job_payload(job)
+    until = date.fromisoformat(payload["until"]) if payload.get("until") else None
+
+    recurrence_service.materialize_occurrences(db, user_id=job.owner_id, until=until)
+
+JOB_HANDLERS = {
+    REBUILD_DAY_STATS: __rebuild_day_stats,
+    MATERIALIZE_RECURRENCES: __materialize_recurrences,
+}
+
+def run_pending_jobs(db, limit: int = None) -> int:
+    processed = 0
+
+    while limit is None or processed < limit:
+        job = job_service.claim_job(db)
+
+        if job is None:
+            break
+
+        try:
+            JOB_HANDLERS[job.kind](db, job)
+        except Exception as error:
+            db.rollback()
+            logger.exception("Job %s (%s) failed", job.uuid, job.kind)
+            job_service.fail_job(db, job, error=repr(error))
+        else:
+            job_service.complete_job(db, job)
+
+        processed += 1
+
+    return processed
+
+# local worker pool, every worker uses its own sessions
+__stop_workers = threading.Event()
+__workers = []
+
+def __work():
+    while not __stop_workers.is_set():
+        db = SessionLocal()
+        try:
+            processed = run_pending_jobs(db, limit=1)
+        except Exception:
+            logger.exception("Job worker failed")
+            processed = 0
+        finally:
+            db.close()
+
+        if not processed:
+            __stop_workers.wait(get_settings().job_poll_interval_seconds)
+
+def start_workers(count: int = None):
+    if count is None:
+        count = get_settings().job_workers
+
+    __stop_workers.clear()
+
+    for index in range(count - len(__workers)):
+        worker = threading.Thread(target=__work, name="job-worker-" + str(index), daemon=True)
+        worker.start()
+        __workers.append(worker)
+
+def stop_workers():
+    __stop_workers.set()
+
+    for worker in __workers:
+        worker.join()
+
+    __workers.clear()
@@ -7,14 +7,26 @@ from .database import SessionLocal, engine
 from .schemas import expenditure_schemas, user_schemas, user_token_schemas
 from .models import expenditure_model, limits_model, user_model
 from .routers import auth
-from .routers.v0 import expenditure_day_stats, users, expenditures, limits
-from .dependencies import get_db
+from .routers.v0 import changes, expenditure_day_stats, users, expenditures, limits
+from .dependencies import get_db, get_settings
 from .services import auth_service
 from .config import cors
+from .jobs import worker
+from .responses import FastJSONResponse
+from .compression import CompressionMiddleware
 
-user_model.Base.metadata.create_all(bind=engine)
+# the schema is managed by alembic migrations, see README
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
+
+# jobs
+@app.on_event("startup")
+def start_job_workers():
+    worker.start_workers()
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    worker.stop_workers()
 
 # middleware
 @app.middleware("http")
@@ -25,12 +37,32 @@ async def add_process_time_header(request: Request, call_next):
     response.headers["X-Process-Time"] = str(process_time)
     return response
 
+# conditional GETs, the read routes leave the etag of the user's data version on the request state
+@app.middleware("http")
+async def add_etag_header(request: Request, call_next):
+    response = await call_next(request)
+    etag = getattr(request.state, "etag", None)
+    if etag is not None and response.status_code == 200:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=cors.origins,
     allow_credentials=True,
     allow_methods=cors.allow_methods,
     allow_headers=cors.allow_headers,
+    expose_headers=cors.expose_headers,
+)
+
+# outermost, compresses every response, streamed exports and imports included
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=get_settings().compression_minimum_size,
+    media_types=get_settings().compression_media_types,
+    gzip_level=get_settings().compression_gzip_level,
+    brotli_quality=get_settings().compression_brotli_quality,
 )
 
 # app
@@ -60,4 +92,8 @@ app.include_router(
 app.include_router(
     limits.router,
     prefix="/v0",
+)
+app.include_router(
+    changes.router,
+    prefix="/v0",
 )
\ No newline at end of file
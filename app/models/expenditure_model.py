@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Date, Float, Enum
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Date, Float, Enum, Index, DDL, event, text
 from sqlalchemy.orm import relationship
 from enum import Enum as py_enum
 
@@ -9,8 +9,20 @@ class ExpenditureTypes(str, py_enum):
     normal = "normal"
     cyclical = "cyclical"
 
+class RecurrenceUnits(str, py_enum):
+    day = "day"
+    week = "week"
+    month = "month"
+
 class ExpenditureModel(Base):
     __tablename__ = "expenditures"
+    __table_args__ = (
+        Index("ix_expenditures_owner_id_date", "owner_id", "date"),
+        # recurrence rules of a user, the occurrences are expanded from them at query time
+        Index("ix_expenditures_owner_id_recurrence", "owner_id",
+            sqlite_where=text("recurrence_unit IS NOT NULL"), postgresql_where=text("recurrence_unit IS NOT NULL")),
+        Index("ix_expenditures_owner_id_change_seq", "owner_id", "change_seq"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     uuid = Column(String, unique=True, index=True)
@@ -20,5 +32,46 @@ class ExpenditureModel(Base):
     place = Column(String)
     type = Column(Enum(ExpenditureTypes), default=ExpenditureTypes.normal)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # a cyclical expenditure with a recurrence rule repeats every recurrence_interval units from its date,
+    # until recurrence_end when set. The row itself is the first occurrence, occurrences up to
+    # materialized_until are stored as rows of their own
+    recurrence_unit = Column(Enum(RecurrenceUnits), nullable=True)
+    recurrence_interval = Column(Integer, nullable=True)
+    recurrence_end = Column(Date, nullable=True)
+    materialized_until = Column(Date, nullable=True)
+    # the owner's data version of the last write of the row, the changes since a version are synced
+    change_seq = Column(Integer, default=0, server_default="0", nullable=False)
+
+    owner = relationship("UserModel", back_populates="expenditures")
+
+    @property
+    def recurrence(self):
+        if self.recurrence_unit is None:
+            return None
+
+        return {"unit": self.recurrence_unit, "interval": self.recurrence_interval, "end_date": self.recurrence_end}
+
+# full text search over name and place
+# sqlite: external content FTS5 table kept in sync by triggers
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS expenditures_fts USING fts5("
+    "name, place, content='expenditures', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS expenditures_fts_insert AFTER INSERT ON expenditures BEGIN "
+    "INSERT INTO expenditures_fts(rowid, name, place) VALUES (new.id, new.name, new.place); END",
+    "CREATE TRIGGER IF NOT EXISTS expenditures_fts_delete AFTER DELETE ON expenditures BEGIN "
+    "INSERT INTO expenditures_fts(expenditures_fts, rowid, name, place) VALUES ('delete', old.id, old.name, old.place); END",
+    "CREATE TRIGGER IF NOT EXISTS expenditures_fts_update AFTER UPDATE OF name, place ON expenditures BEGIN "
+    "INSERT INTO expenditures_fts(expenditures_fts, rowid, name, place) VALUES ('delete', old.id, old.name, old.place); "
+    "INSERT INTO expenditures_fts(rowid, name, place) VALUES (new.id, new.name, new.place); END",
+]
+# postgresql: GIN expression index, maintained by the database itself
+POSTGRESQL_SEARCH_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_expenditures_search ON expenditures "
+    "USING GIN (to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(place, '')))",
+]
 
-    owner = relationship("UserModel", back_populates="expenditures")
\ No newline at end of file
+for statement in SQLITE_SEARCH_DDL:
+    event.listen(ExpenditureModel.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+for statement in POSTGRESQL_SEARCH_DDL:
+    event.listen(ExpenditureModel.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+event.listen(ExpenditureModel.__table__, "before_drop", DDL("DROP TABLE IF EXISTS expenditures_fts").execute_if(dialect="sqlite"))
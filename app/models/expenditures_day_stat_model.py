@@ -1,15 +1,22 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Date, Float
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Date, Float, Index
 from sqlalchemy.orm import relationship
 
 from ..database import Base
 
 class ExpendituresDayStat(Base):
     __tablename__ = "expenditures_day_stats"
+    __table_args__ = (
+        # one row per user and day, day totals are upserted on this key
+        Index("ix_expenditures_day_stats_owner_id_date", "owner_id", "date", unique=True),
+        Index("ix_expenditures_day_stats_owner_id_change_seq", "owner_id", "change_seq"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     uuid = Column(String, unique=True, index=True)
     total_cost = Column(Float)
     date = Column(Date)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # the owner's data version of the last write of the row
+    change_seq = Column(Integer, default=0, server_default="0", nullable=False)
 
     owner = relationship("UserModel", back_populates="expenditures_day_stats")
\ No newline at end of file
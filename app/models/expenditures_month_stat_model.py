@@ -0,0 +1,15 @@
+from sqlalchemy import Column, ForeignKey, Integer, Float, Index
+
+from ..database import Base
+
+class ExpendituresMonthStat(Base):
+    __tablename__ = "expenditures_month_stats"
+    __table_args__ = (
+        Index("ix_expenditures_month_stats_owner_id_year_month", "owner_id", "year", "month", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    year = Column(Integer)
+    month = Column(Integer)
+    total_cost = Column(Float)
+    owner_id = Column(Integer, ForeignKey("users.id"))
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, ForeignKey, Integer, Float, Index
+
+from ..database import Base
+
+class ExpendituresYearStat(Base):
+    __tablename__ = "expenditures_year_stats"
+    __table_args__ = (
+        Index("ix_expenditures_year_stats_owner_id_year", "owner_id", "year", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    year = Column(Integer)
+    total_cost = Column(Float)
+    owner_id = Column(Integer, ForeignKey("users.id"))
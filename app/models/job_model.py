@@ -0,0 +1,35 @@
+from sqlalchemy import Column, Integer, String, Date, DateTime, Enum, Index, text
+from enum import Enum as py_enum
+from datetime import datetime
+
+from ..database import Base
+
+class JobStatus(str, py_enum):
+    pending = "pending"
+    running = "running"
+    # failed job_max_attempts times, kept for inspection
+    dead = "dead"
+
+class JobModel(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # at most one pending job per kind, user and day, new jobs for the same day coalesce into it
+        Index("ix_jobs_pending_kind_owner_id_date", "kind", "owner_id", "date", unique=True,
+            sqlite_where=text("status = 'pending'"), postgresql_where=text("status = 'pending'")),
+        Index("ix_jobs_status_run_at", "status", "run_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    uuid = Column(String, unique=True, index=True)
+    kind = Column(String, nullable=False)
+    owner_id = Column(Integer, nullable=True)
+    date = Column(Date, nullable=True)
+    # json encoded arguments of the job
+    payload = Column(String, nullable=True)
+    status = Column(Enum(JobStatus), default=JobStatus.pending, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    run_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # a running job whose lease passed is taken over by another worker
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Date, Float, Enum
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Date, Float, Enum, Index
 from sqlalchemy.orm import relationship
 from enum import Enum as py_enum
 
@@ -7,6 +7,10 @@ from ..database import Base
 
 class LimitModel(Base):
     __tablename__ = "limits"
+    __table_args__ = (
+        Index("ix_limits_owner_id_year_month", "owner_id", "year", "month", unique=True),
+        Index("ix_limits_owner_id_change_seq", "owner_id", "change_seq"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     uuid = Column(String, unique=True, index=True)
@@ -14,5 +18,7 @@ class LimitModel(Base):
     month = Column(Integer)
     limit = Column(Float)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # the owner's data version of the last write of the row
+    change_seq = Column(Integer, default=0, server_default="0", nullable=False)
 
     owner = relationship("UserModel", back_populates="limits")
\ No newline at end of file
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, ForeignKey, Integer, String, Index
+from enum import Enum as py_enum
+
+from ..database import Base
+
+class TombstoneEntities(str, py_enum):
+    expenditure = "expenditure"
+    limit = "limit"
+    expenditures_day_stat = "expenditures_day_stat"
+
+# a deleted expenditure, limit or day stat, kept so the deletion can be synced
+class TombstoneModel(Base):
+    __tablename__ = "tombstones"
+    __table_args__ = (
+        Index("ix_tombstones_owner_id_change_seq", "owner_id", "change_seq"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    entity = Column(String, nullable=False)
+    uuid = Column(String, nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id"))
+    # the owner's data version of the deletion
+    change_seq = Column(Integer, nullable=False)
@@ -15,6 +15,10 @@ class UserModel(Base):
     is_admin = Column(Boolean, default=False)
     token = Column(String, unique=True, default=None, nullable=True)
     disabled = Column(Boolean, default=False)
+    # bumped on logout and password change, revokes stateless tokens
+    token_version = Column(Integer, default=0, server_default="0", nullable=False)
+    # bumped on every write of the user's expenditures, limits and day stats, the etags of the read routes
+    data_version = Column(Integer, default=0, server_default="0", nullable=False)
 
     expenditures = relationship("ExpenditureModel", back_populates="owner")
     expenditures_day_stats = relationship("ExpendituresDayStat", back_populates="owner")
@@ -0,0 +1,47 @@
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# app wide response class, orjson encodes dates, enums and uuids natively
+class FastJSONResponse(JSONResponse):
+    @staticmethod
+    def __default(value):
+        if isinstance(value, BaseModel):
+            return value.dict()
+
+        raise TypeError
+
+    def render(self, content) -> bytes:
+        if orjson is None:
+            return super().render(jsonable_encoder(content))
+
+        return orjson.dumps(content, default=self.__default, option=orjson.OPT_NON_STR_KEYS)
+
+# trusted responses, the fields of the schema are read from data the services built themselves
+# (ORM objects, rows, dicts or models) without validating and encoding them a second time
+def __get_trusted_value(value, field):
+    if value is None or not (isinstance(field.type_, type) and issubclass(field.type_, BaseModel)):
+        return value
+
+    if field.shape == SHAPE_SINGLETON:
+        return get_trusted_content(field.type_, value)
+
+    return [get_trusted_content(field.type_, item) for item in value]
+
+def get_trusted_content(schema, item) -> dict:
+    content = {}
+
+    for name, field in schema.__fields__.items():
+        value = item.get(name, field.default) if isinstance(item, dict) else getattr(item, name, field.default)
+        content[name] = __get_trusted_value(value, field)
+
+    return content
+
+def get_trusted_response(schema, status_code: int = 200, **values) -> FastJSONResponse:
+    return FastJSONResponse(get_trusted_content(schema, values), status_code=status_code)
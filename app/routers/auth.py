@@ -1,10 +1,11 @@
 from fastapi import Depends, status, APIRouter
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import OAuth2PasswordRequestForm
 
 from ..services import user_service
 from ..schemas import success_schemas, user_schemas, user_token_schemas
-from ..dependencies import get_db, oauth2_scheme
+from ..dependencies import get_db, get_async_db
 from ..services import auth_service
 from ..exceptions import http_exceptions
 
@@ -19,17 +20,20 @@ router = APIRouter(
 
 
 @router.post("/login", response_model=user_token_schemas.TokenData, tags=["auth"])
-def login(form_data: OAuth2PasswordRequestForm = Depends(),  db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(),  db: AsyncSession = Depends(get_async_db)):
     # in request form username will be a email
-    userDB = user_service.get_user_by_email(db, email=form_data.username)
+    userDB = await user_service.get_user_by_email_async(db, email=form_data.username)
 
     if not userDB:
         raise http_exceptions.unauth_error
-        
-    if not auth_service.authenticate_user(db=db, user=userDB, password=form_data.password):
+
+    # the connection goes back to the pool while bcrypt runs, the loaded user stays usable (expire_on_commit is off)
+    await db.commit()
+
+    if not await auth_service.authenticate_user_async(user=userDB, password=form_data.password):
         raise http_exceptions.unauth_error
 
-    token = auth_service.generate_user_token(db, user=userDB)
+    token = await auth_service.generate_user_token_async(db, user=userDB)
 
     return {
         "access_token": token, 
@@ -45,15 +49,17 @@ def logout(user = Depends(auth_service.get_current_active_user), db: Session = D
     }
 
 @router.post("/register", response_model=success_schemas.SuccessResponseSchema, status_code=status.HTTP_201_CREATED, tags=["auth"])
-def register(user_data: user_schemas.UserRegister, db: Session = Depends(get_db)):
-    db_user = user_service.get_user_by_email(db, email=user_data.email)
+async def register(user_data: user_schemas.UserRegister, db: AsyncSession = Depends(get_async_db)):
+    db_user = await user_service.get_user_by_email_async(db, email=user_data.email)
 
     if db_user:
         raise http_exceptions.used_email_error
 
-    user_data.is_active = False
-    user_data.disabled = True
-    user_service.create_user(db=db, user=user_data)
+    # the connection goes back to the pool while bcrypt runs
+    await db.commit()
+
+    hashed_password = await auth_service.get_hashed_password_async(user_data.password)
+    await user_service.create_user_async(db=db, user=user_data, hashed_password=hashed_password)
 
     if user_service.send_verification_email(user_data.email):
         return {
@@ -72,16 +78,21 @@ def change_password(email: str, db: Session = Depends(get_db)):
         raise http_exceptions.server_error
 
 @router.post("/change-password", response_model=success_schemas.SuccessResponseSchema, status_code=200, tags=["auth"])
-def change_password(user: user_schemas.UserResetPassword, db: Session = Depends(get_db)):
-    userDB = user_service.get_user_by_email(db, email=user.email)
+async def change_password(user: user_schemas.UserResetPassword, db: AsyncSession = Depends(get_async_db)):
+    userDB = await user_service.get_user_by_email_async(db, email=user.email)
 
     if not userDB:
         raise http_exceptions.unauth_error
 
-    if not auth_service.authenticate_user(db=db, user=userDB, password=user.password):
+    # the connection goes back to the pool while bcrypt runs, the loaded user stays usable (expire_on_commit is off)
+    await db.commit()
+
+    if not await auth_service.authenticate_user_async(user=userDB, password=user.password):
         raise http_exceptions.unauth_error
 
-    if user_service.change_user_password(db=db, user=userDB, new_password=user.new_password):
+    hashed_password = await auth_service.get_hashed_password_async(user.new_password)
+
+    if await user_service.change_user_password_async(db=db, user=userDB, new_password=user.new_password, hashed_password=hashed_password):
         return {
             "message": "Password has been successfully changed."
         }
@@ -0,0 +1,27 @@
+from fastapi import Depends, status, APIRouter
+from sqlalchemy.orm import Session
+from uuid import UUID
+
+from ...services import auth_service, sync_service, version_service
+from ...schemas import change_schemas
+from ...responses import get_trusted_response
+from ...dependencies import get_db
+from ...exceptions import http_exceptions
+
+router = APIRouter(
+    responses={
+        403: {"description": "Permissions denied"},
+        404: {"description": "Resource not found"},
+        500: {"description": "Server error"}
+    },
+)
+
+# delta sync, the rows written and deleted since the `since` cursor, everything without it
+@router.get("/users/{user_uuid}/changes", response_model=change_schemas.Changes, dependencies=[Depends(version_service.check_path_user_version)], status_code=status.HTTP_200_OK, tags=["changes"])
+def index_user_changes(user_uuid: UUID, userPath = Depends(auth_service.get_path_user), since: int = None, limit: int = 1000, db: Session = Depends(get_db)):
+    if limit < 1:
+        raise http_exceptions.validation_error
+
+    changes = sync_service.get_changes(db, user_id=userPath.id, since=since, limit=limit)
+
+    return get_trusted_response(change_schemas.Changes, **changes)
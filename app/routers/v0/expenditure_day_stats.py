@@ -1,13 +1,16 @@
-from fastapi import Depends, status, APIRouter
+from fastapi import Depends, status, APIRouter, Response
 from sqlalchemy.orm import Session
 from uuid import UUID  
-from datetime import date
+from datetime import date, datetime
+from typing import Union
 import math
 
-from ...services import auth_service, expenditures_day_stat_service, user_service
+from ...services import auth_service, budget_service, expenditures_day_stat_service, job_service, pagination_service, user_service, version_service
+from ...jobs import worker
 from ...schemas import expenditures_day_stat_schemas
 
-from ...dependencies import get_db, get_settings, oauth2_scheme
+from ...responses import get_trusted_response
+from ...dependencies import get_db
 from ...exceptions import http_exceptions
 
 router = APIRouter(
@@ -18,53 +21,75 @@ router = APIRouter(
     },
 )
 
-@router.get("/users/{user_uuid}/expenditures-day-stats/", response_model=expenditures_day_stat_schemas.Pagination, status_code=status.HTTP_200_OK, tags=["expenditures-day-stats"])
-def index_expenditures_day_stats(user_uuid: UUID, token: str = Depends(oauth2_scheme), page: int = 1, limit: int = 100, date_from: date = None, date_to: date = None, group_by: str = None, db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
-    userPath = user_service.get_user(db, uuid=str(user_uuid))
-    
-    if userPath is None:
-        raise http_exceptions.user_not_found_error
-    if loggedUser is None:
-        raise http_exceptions.user_not_found_error
-    if not loggedUser.id == userPath.id:
-        raise http_exceptions.permission_denied_error
+@router.get("/users/{user_uuid}/expenditures-day-stats/", response_model=Union[expenditures_day_stat_schemas.PeriodPagination, expenditures_day_stat_schemas.Pagination], dependencies=[Depends(version_service.check_path_owner_version)], status_code=status.HTTP_200_OK, tags=["expenditures-day-stats"])
+def index_expenditures_day_stats(user_uuid: UUID, userPath = Depends(auth_service.get_path_owner), page: int = 1, limit: int = 100, date_from: date = None, date_to: date = None, group_by: str = None, cursor: str = None, db: Session = Depends(get_db)):
+    if group_by:
+        if group_by not in expenditures_day_stat_service.PERIODS:
+            raise http_exceptions.validation_error
 
-    expendiures_day_stats = expenditures_day_stat_service.get_expenditures_day_stats(db=db, user_id=userPath.id, page=page, limit=limit, search=None, date_from=date_from, date_to=date_to, group_by=group_by)
-    
-    amount = expenditures_day_stat_service.get_expenditure_day_stats_amount(db,user_id=userPath.id)
-    last_page = math.ceil(amount/limit)
+        periods, amount = expenditures_day_stat_service.get_expenditures_period_stats(db=db, user_id=userPath.id, group_by=group_by, page=page, limit=limit, date_from=date_from, date_to=date_to)
+
+        return get_trusted_response(expenditures_day_stat_schemas.PeriodPagination, data=periods, group_by=group_by, page=page, last_page=math.ceil(amount/limit), limit=limit)
 
-    return expenditures_day_stat_schemas.Pagination(data=expendiures_day_stats, page=page, last_page=last_page, limit=limit)
+    if cursor is not None:
+        expendiures_day_stats = expenditures_day_stat_service.get_expenditures_day_stats(db=db, user_id=userPath.id, page=page, limit=limit, search=None, date_from=date_from, date_to=date_to, cursor=cursor)
+        next_cursor = pagination_service.get_next_cursor(expendiures_day_stats, limit, "date", "id")
 
-@router.get("/expenditures-day-stats/{uuid}", response_model=expenditures_day_stat_schemas.ExpendituresDayStat, status_code=status.HTTP_200_OK, tags=["expenditures-day-stats"])
-def show_expenditure_day_stat(uuid: UUID, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
+        return get_trusted_response(expenditures_day_stat_schemas.Pagination, data=expendiures_day_stats, page=None, last_page=None, limit=limit, next_cursor=next_cursor)
+
+    expendiures_day_stats, amount = expenditures_day_stat_service.get_expenditures_day_stats_page(db=db, user_id=userPath.id, page=page, limit=limit, date_from=date_from, date_to=date_to)
+    last_page = math.ceil(amount/limit)
 
-    if loggedUser is None:
-        raise http_exceptions.unauth_error
+    return get_trusted_response(expenditures_day_stat_schemas.Pagination, data=expendiures_day_stats, page=page, last_page=last_page, limit=limit)
 
+@router.get("/expenditures-day-stats/{uuid}", response_model=expenditures_day_stat_schemas.ExpendituresDayStat, dependencies=[Depends(version_service.check_user_version)], status_code=status.HTTP_200_OK, tags=["expenditures-day-stats"])
+def show_expenditure_day_stat(uuid: UUID, loggedUser = Depends(auth_service.get_current_active_user), db: Session = Depends(get_db)):
     expenditure = expenditures_day_stat_service.get_expenditure_day_stat(db, uuid=str(uuid))
 
     if expenditure is None:
         raise http_exceptions.expenditure_not_found
-    if expenditure.owner_id is not loggedUser.id:
+    if expenditure.owner_id != loggedUser.id:
         raise http_exceptions.permission_denied_error
 
     return expenditure
 
-@router.get("/users/{user_uuid}/expenditures-day-stats/month-limit", response_model=expenditures_day_stat_schemas.ExpendituresLimitBase, status_code=status.HTTP_200_OK, tags=["expenditures-day-stats"])
-def show_expenditures_month_limit(user_uuid: UUID, token: str = Depends(oauth2_scheme), year: int = None, db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
-    userPath = user_service.get_user(db, uuid=str(user_uuid))
-    
-    if userPath is None:
-        raise http_exceptions.user_not_found_error
-    if loggedUser is None:
-        raise http_exceptions.user_not_found_error
-    if not loggedUser.id == userPath.id:
-        raise http_exceptions.permission_denied_error
+@router.get("/users/{user_uuid}/expenditures-day-stats/month-limit", response_model=expenditures_day_stat_schemas.ExpendituresLimitBase, dependencies=[Depends(version_service.check_path_owner_version)], status_code=status.HTTP_200_OK, tags=["expenditures-day-stats"])
+def show_expenditures_month_limit(user_uuid: UUID, userPath = Depends(auth_service.get_path_owner), year: int = None, db: Session = Depends(get_db)):
+    limit_data = expenditures_day_stat_service.get_month_limit_data(db=db, year=year, user_id=userPath.id)
+
+    return limit_data
+
+@router.get("/users/{user_uuid}/expenditures-day-stats/budget-summary", response_model=expenditures_day_stat_schemas.BudgetSummary, dependencies=[Depends(version_service.check_path_owner_version)], status_code=status.HTTP_200_OK, tags=["expenditures-day-stats"])
+def show_budget_summary(user_uuid: UUID, userPath = Depends(auth_service.get_path_owner), years: str = None, db: Session = Depends(get_db)):
+    if years is None:
+        year_from = year_to = datetime.now().year
+    else:
+        year_from, year_to = budget_service.parse_years(years)
+
+    summary = budget_service.get_budget_summary(db, user_id=userPath.id, year_from=year_from, year_to=year_to)
+
+    return expenditures_day_stat_schemas.BudgetSummary(data=summary)
+
+@router.post("/expenditures-day-stats/rebuild", response_model=expenditures_day_stat_schemas.RebuildResult, status_code=status.HTTP_200_OK, tags=["expenditures-day-stats"])
+def rebuild_expenditures_day_stats(response: Response, user_uuid: UUID = None, date_from: date = None, date_to: date = None, background: bool = False, loggedUser = Depends(auth_service.get_admin_user), db: Session = Depends(get_db)):
+    user_id = None
+
+    if user_uuid is not None:
+        userDb = user_service.get_user(db, uuid=str(user_uuid))
+
+        if userDb is None:
+            raise http_exceptions.user_not_found_error
+
+        user_id = userDb.id
+
+    if background:
+        job = job_service.enqueue_job(db, worker.REBUILD_DAY_STATS, owner_id=user_id, payload={"date_from": date_from, "date_to": date_to})
+        db.commit()
+
+        response.status_code = status.HTTP_202_ACCEPTED
+
+        return expenditures_day_stat_schemas.RebuildResult(job=job)
 
-    limit_data = expenditures_day_stat_service.get_month_limit_data(db=db, year=year, user_id=loggedUser.id)
+    rebuilt = expenditures_day_stat_service.rebuild_expenditures_day_stats(db, user_id=user_id, date_from=date_from, date_to=date_to)
 
-    return limit_data
\ No newline at end of file
+    return expenditures_day_stat_schemas.RebuildResult(rebuilt=rebuilt)
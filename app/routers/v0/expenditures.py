@@ -1,14 +1,16 @@
-from fastapi import Depends, status, APIRouter, BackgroundTasks
+from fastapi import Depends, status, APIRouter, UploadFile
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID  
 from datetime import date
 import math
 
-from ...services import auth_service, exposure_service, user_service
+from ...services import auth_service, export_service, exposure_service, fieldset_service, import_service, pagination_service, version_service
 from ...schemas import expenditure_schemas
-from ...dependencies import get_db, get_settings, oauth2_scheme
+from ...responses import FastJSONResponse, get_trusted_response
+from ...dependencies import get_db, get_async_db, get_settings
 from ...exceptions import http_exceptions
-from ...jobs import expenditure_jobs
 from ...models import expenditure_model
 
 router = APIRouter(
@@ -22,99 +24,173 @@ router = APIRouter(
 # expenditures
 @router.post("/expenditures/", response_model=expenditure_schemas.Expenditure, status_code=status.HTTP_201_CREATED, tags=["expenditures"])
 async def store_expenditure(
-     background_task: BackgroundTasks, expenditure: expenditure_schemas.ExpenditureCreate, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
+     expenditure: expenditure_schemas.ExpenditureCreate, db_user = Depends(auth_service.get_current_active_user_async), db: AsyncSession = Depends(get_async_db)
 ):
-    db_user = auth_service.decode_token(db=db, token=token)
+    if expenditure.type not in expenditure_model.ExpenditureTypes._value2member_map_:
+        raise http_exceptions.validation_error
+    if not exposure_service.is_valid_recurrence(expenditure):
+        raise http_exceptions.validation_error
 
-    if db_user is None:
-        raise http_exceptions.user_not_found_error
+    # the day stat is updated in the same transaction
+    createdExpenditure = await exposure_service.create_expenditure_async(db=db, expenditure=expenditure, user_id=db_user.id)
 
-    if expenditure.type not in expenditure_model.ExpenditureTypes._value2member_map_:
+    return createdExpenditure
+
+@router.post("/expenditures/batch", response_model=expenditure_schemas.BatchResult, status_code=status.HTTP_200_OK, tags=["expenditures"])
+def batch_expenditures(batch: expenditure_schemas.Batch, loggedUser = Depends(auth_service.get_current_active_user), db: Session = Depends(get_db)):
+    operations = batch.operations
+
+    if not operations or len(operations) > get_settings().expenditure_batch_max_operations:
         raise http_exceptions.validation_error
 
-    createdExpenditure = exposure_service.create_expenditure(db=db, expenditure=expenditure, user_id=db_user.id)
+    uuids = []
+    for operation in operations:
+        if (operation.op == expenditure_schemas.BatchOperationTypes.create) != (operation.uuid is None):
+            raise http_exceptions.validation_error
+        if (operation.op == expenditure_schemas.BatchOperationTypes.delete) != (operation.expenditure is None):
+            raise http_exceptions.validation_error
+        if operation.expenditure is not None and not exposure_service.is_valid_recurrence(operation.expenditure):
+            raise http_exceptions.validation_error
 
-    background_task.add_task(expenditure_jobs.recalculateDayExpenditures, db=db, user_id=db_user.id, expenditure=createdExpenditure)
+        if operation.uuid is not None:
+            uuids.append(str(operation.uuid))
 
-    return createdExpenditure
+    # an expenditure can be changed by one operation of the batch
+    if len(uuids) != len(set(uuids)):
+        raise http_exceptions.validation_error
 
-@router.put("/expenditures/{uuid}", status_code=status.HTTP_204_NO_CONTENT, tags=["expenditures"])
-def put_expenditure(uuid: UUID, expenditure: expenditure_schemas.ExpenditureCreate, background_task: BackgroundTasks, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
+    # every operation is checked before any of them is applied
+    expendituresDb = exposure_service.get_expenditures_by_uuids(db, uuids)
+    for uuid in uuids:
+        if uuid not in expendituresDb:
+            raise http_exceptions.expenditure_not_found
+        if expendituresDb[uuid].owner_id != loggedUser.id:
+            raise http_exceptions.permission_denied_error
+
+    results = exposure_service.apply_expenditures_batch(db, operations=operations, expendituresDb=expendituresDb, user_id=loggedUser.id)
+
+    return expenditure_schemas.BatchResult(data=results)
 
+@router.put("/expenditures/{uuid}", status_code=status.HTTP_204_NO_CONTENT, tags=["expenditures"])
+def put_expenditure(uuid: UUID, expenditure: expenditure_schemas.ExpenditureCreate, loggedUser = Depends(auth_service.get_current_active_user), db: Session = Depends(get_db)):
     expenditureDB = exposure_service.get_expenditure(db, uuid=str(uuid), user_id=loggedUser.id)
     if expenditureDB is None:
         raise http_exceptions.expenditure_not_found
-    if expenditureDB.owner_id is not loggedUser.id:
+    if expenditureDB.owner_id != loggedUser.id:
         raise http_exceptions.permission_denied_error
         
     if expenditure.type not in expenditure_model.ExpenditureTypes._value2member_map_:
         raise http_exceptions.validation_error
+    if not exposure_service.is_valid_recurrence(expenditure):
+        raise http_exceptions.validation_error
 
     expenditure = exposure_service.update_expenditure(db, expenditureDb=expenditureDB, expenditure=expenditure)
 
-    background_task.add_task(expenditure_jobs.recalculateDayExpenditures, db=db, user_id=loggedUser.id, expenditure=expenditure)
-
     return None
 
+def __get_pagination(expenditures: list, fields: list = None, **pagination):
+    # a sparse fieldset is returned as it was selected, without response model validation
+    if fields:
+        content = {"data": fieldset_service.get_sparse_data(expenditures, fields), "page": None, "last_page": None, "limit": None, "next_cursor": None}
+        content.update(pagination)
+
+        return FastJSONResponse(content)
+
+    return get_trusted_response(expenditure_schemas.Pagination, data=expenditures, **pagination)
+
 @router.get("/expenditures/", response_model=expenditure_schemas.Pagination, status_code=status.HTTP_200_OK, tags=["expenditures"])
-def index_expenditures(token: str = Depends(oauth2_scheme), page: int = 1, limit: int = 100, search: str = None, date_from: date = None, date_to: date = None, db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
+def index_expenditures(loggedUser = Depends(auth_service.get_admin_user), page: int = 1, limit: int = 100, search: str = None, date_from: date = None, date_to: date = None, cursor: str = None, approximate_total: bool = False, fields: str = None, db: Session = Depends(get_db)):
+    if fields is not None:
+        fields = fieldset_service.parse_fields(fields, exposure_service.EXPENDITURE_FIELDS)
 
-    if loggedUser.is_admin:
-        expendiures = exposure_service.get_expenditures(db, page=page, limit=limit, search=search, date_from=date_from, date_to=date_to)
+    if cursor is not None:
+        expendiures = exposure_service.get_expenditures(db, page=page, limit=limit, search=search, date_from=date_from, date_to=date_to, cursor=cursor, fields=fields)
+        next_cursor = pagination_service.get_next_cursor(expendiures, limit, "date", "id")
+
+        return __get_pagination(expendiures, fields, page=None, last_page=None, limit=limit, next_cursor=next_cursor)
+
+    if approximate_total:
+        expendiures = exposure_service.get_expenditures(db, page=page, limit=limit, search=search, date_from=date_from, date_to=date_to, fields=fields)
+        amount = pagination_service.get_cached_total(("expenditures", search, date_from, date_to), lambda: exposure_service.get_expenditure_amount(db, search=search, date_from=date_from, date_to=date_to))
     else:
-        raise http_exceptions.permission_denied_error
+        expendiures, amount = exposure_service.get_expenditures_page(db, page=page, limit=limit, search=search, date_from=date_from, date_to=date_to, fields=fields)
 
-    amount = exposure_service.get_expenditure_amount(db,user_id=None)
     last_page = math.ceil(amount/limit)
 
-    return expenditure_schemas.Pagination(data=expendiures, page=page, last_page=last_page, limit=limit)
+    return __get_pagination(expendiures, fields, page=page, last_page=last_page, limit=limit)
 
-@router.get("/users/{user_uuid}/expenditures/", response_model=expenditure_schemas.Pagination, status_code=status.HTTP_200_OK, tags=["expenditures"])
-def index_user_expenditures(user_uuid: UUID, token: str = Depends(oauth2_scheme), page: int = 1, limit: int = 100, search: str = None, date_from: date = None, date_to: date = None, db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
-    userPath = user_service.get_user(db, uuid=str(user_uuid))
-    
-    if userPath is None:
-            raise http_exceptions.user_not_found_error
+@router.get("/users/{user_uuid}/expenditures/", response_model=expenditure_schemas.Pagination, dependencies=[Depends(version_service.check_path_user_version)], status_code=status.HTTP_200_OK, tags=["expenditures"])
+def index_user_expenditures(user_uuid: UUID, userPath = Depends(auth_service.get_path_user), page: int = 1, limit: int = 100, search: str = None, date_from: date = None, date_to: date = None, cursor: str = None, expand: bool = False, fields: str = None, db: Session = Depends(get_db)):
+    if fields is not None:
+        fields = fieldset_service.parse_fields(fields, exposure_service.EXPANDED_EXPENDITURE_FIELDS if expand else exposure_service.EXPENDITURE_FIELDS)
 
-    if loggedUser.is_admin:
-        expendiures = exposure_service.get_expenditures(db, page=page, limit=limit, search=search, date_from=date_from, date_to=date_to, user_id=userPath.id)
-        amount = exposure_service.get_expenditure_amount(db,user_id=userPath.id)
-    else:
-        if not loggedUser.id == userPath.id:
-            raise http_exceptions.permission_denied_error
+    # with expand the occurrences of the recurrence rules are listed too, in (date, id) order
+    if expand and cursor is not None:
+        expendiures, next_cursor = exposure_service.get_expanded_expenditures(db, limit=limit, search=search, date_from=date_from, date_to=date_to, user_id=userPath.id, cursor=cursor, fields=fields)
+
+        return __get_pagination(expendiures, fields, page=None, last_page=None, limit=limit, next_cursor=next_cursor)
+
+    if expand:
+        expendiures, amount = exposure_service.get_expanded_expenditures_page(db, page=page, limit=limit, search=search, date_from=date_from, date_to=date_to, user_id=userPath.id, fields=fields)
+
+        return __get_pagination(expendiures, fields, page=page, last_page=math.ceil(amount/limit), limit=limit)
+
+    if cursor is not None:
+        expendiures = exposure_service.get_expenditures(db, page=page, limit=limit, search=search, date_from=date_from, date_to=date_to, user_id=userPath.id, cursor=cursor, fields=fields)
+        next_cursor = pagination_service.get_next_cursor(expendiures, limit, "date", "id")
 
-        expendiures = exposure_service.get_expenditures(db, page=page, limit=limit, search=search, date_from=date_from, date_to=date_to, user_id=loggedUser.id)
-        amount = exposure_service.get_expenditure_amount(db,user_id=loggedUser.id)
+        return __get_pagination(expendiures, fields, page=None, last_page=None, limit=limit, next_cursor=next_cursor)
 
+    expendiures, amount = exposure_service.get_expenditures_page(db, page=page, limit=limit, search=search, date_from=date_from, date_to=date_to, user_id=userPath.id, fields=fields)
     last_page = math.ceil(amount/limit)
 
-    return expenditure_schemas.Pagination(data=expendiures, page=page, last_page=last_page, limit=limit)
+    return __get_pagination(expendiures, fields, page=page, last_page=last_page, limit=limit)
 
-@router.get("/expenditures/{uuid}", response_model=expenditure_schemas.Expenditure, status_code=status.HTTP_200_OK, tags=["expenditures"])
-def show_expenditure(uuid: UUID, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
+@router.get("/users/{user_uuid}/expenditures/export", response_class=StreamingResponse, dependencies=[Depends(version_service.check_path_user_version)], status_code=status.HTTP_200_OK, tags=["expenditures"])
+def export_user_expenditures(user_uuid: UUID, userPath = Depends(auth_service.get_path_user), format: str = "csv", date_from: date = None, date_to: date = None, db: Session = Depends(get_db)):
+    if format not in export_service.EXPORT_MEDIA_TYPES:
+        raise http_exceptions.validation_error
+
+    # the rows are read and written batch by batch while the response is sent
+    content = export_service.iter_expenditures(db, format=format, user_id=userPath.id, date_from=date_from, date_to=date_to)
+
+    return StreamingResponse(
+        content,
+        media_type=export_service.EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": 'attachment; filename="expenditures.' + format + '"'},
+    )
 
+@router.post("/users/{user_uuid}/expenditures/import", response_class=StreamingResponse, status_code=status.HTTP_200_OK, tags=["expenditures"])
+def import_user_expenditures(user_uuid: UUID, file: UploadFile, userPath = Depends(auth_service.get_path_owner), format: str = None, db: Session = Depends(get_db)):
+    if format is None:
+        format = "ofx" if (file.filename or "").lower().endswith((".ofx", ".qfx")) else "csv"
+
+    if format not in import_service.IMPORT_FORMATS:
+        raise http_exceptions.validation_error
+
+    # the upload is parsed and imported chunk by chunk while the progress is sent
+    progress = import_service.import_expenditures(db, file=file.file, format=format, user_id=userPath.id)
+
+    return StreamingResponse(progress, media_type="application/x-ndjson")
+
+@router.get("/expenditures/{uuid}", response_model=expenditure_schemas.Expenditure, dependencies=[Depends(version_service.check_user_version)], status_code=status.HTTP_200_OK, tags=["expenditures"])
+def show_expenditure(uuid: UUID, loggedUser = Depends(auth_service.get_current_active_user), db: Session = Depends(get_db)):
     expenditure = exposure_service.get_expenditure(db, uuid=str(uuid), user_id=loggedUser.id)
 
     if expenditure is None:
         raise http_exceptions.expenditure_not_found
-    if expenditure.owner_id is not loggedUser.id:
+    if expenditure.owner_id != loggedUser.id:
         raise http_exceptions.permission_denied_error
 
     return expenditure
 
 @router.delete("/expenditures/{uuid}", status_code=status.HTTP_204_NO_CONTENT, tags=["expenditures"])
-def delete_expenditure(uuid: UUID, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
-
+def delete_expenditure(uuid: UUID, loggedUser = Depends(auth_service.get_current_active_user), db: Session = Depends(get_db)):
     expenditureDB = exposure_service.get_expenditure(db, uuid=str(uuid), user_id=loggedUser.id)
 
     if expenditureDB is None:
         raise http_exceptions.expenditure_not_found
-    if expenditureDB.owner_id is not loggedUser.id:
+    if expenditureDB.owner_id != loggedUser.id:
         raise http_exceptions.permission_denied_error
 
     exposure_service.delete_expenditre(db, str(uuid))
@@ -1,12 +1,14 @@
 from fastapi import Depends, status, APIRouter, BackgroundTasks
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID  
 from datetime import date
 import math
 
-from ...services import auth_service, limit_service, user_service
+from ...services import auth_service, limit_service, pagination_service, version_service
 from ...schemas import limit_schemas
-from ...dependencies import get_db, get_settings, oauth2_scheme
+from ...responses import get_trusted_response
+from ...dependencies import get_db, get_async_db
 from ...exceptions import http_exceptions
 from ...models import limits_model
 
@@ -20,28 +22,21 @@ router = APIRouter(
 
 # limits
 @router.post("/limits/", response_model=limit_schemas.Limit, status_code=status.HTTP_201_CREATED, tags=["limits"])
-async def store_limit(limit: limit_schemas.LimitCreate, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    db_user = auth_service.decode_token(db=db, token=token)
-
-    if db_user is None:
-        raise http_exceptions.user_not_found_error
-
-    limitDB = limit_service.get_limit_by_month_and_year(db=db, month=limit.month, year=limit.year, user_id=db_user.id)
+async def store_limit(limit: limit_schemas.LimitCreate, db_user = Depends(auth_service.get_current_active_user_async), db: AsyncSession = Depends(get_async_db)):
+    limitDB = await limit_service.get_limit_by_month_and_year_async(db=db, month=limit.month, year=limit.year, user_id=db_user.id)
     if limitDB:
-        createdLimit = limit_service.update_limit(db, limitDb=limitDB, limit=limit)
+        createdLimit = await limit_service.update_limit_async(db, limitDb=limitDB, limit=limit)
     else:
-        createdLimit = limit_service.create_limit(db=db, limit=limit, user_id=db_user.id)
+        createdLimit = await limit_service.create_limit_async(db=db, limit=limit, user_id=db_user.id)
 
     return createdLimit
 
 @router.put("/limits/{uuid}", status_code=status.HTTP_204_NO_CONTENT, tags=["limits"])
-def put_limit(uuid: UUID, limit: limit_schemas.LimitCreate, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
-
+def put_limit(uuid: UUID, limit: limit_schemas.LimitCreate, loggedUser = Depends(auth_service.get_current_active_user), db: Session = Depends(get_db)):
     limitDB = limit_service.get_limit_by_uuid(db, uuid=str(uuid), user_id=loggedUser.id)
     if limitDB is None:
         raise http_exceptions.limit_not_found
-    if limitDB.owner_id is not loggedUser.id:
+    if limitDB.owner_id != loggedUser.id:
         raise http_exceptions.permission_denied_error
 
     limitDB2 = limit_service.get_limit_by_month_and_year(db=db, month=limit.month, year=limit.year, user_id=loggedUser.id)
@@ -57,63 +52,54 @@ def put_limit(uuid: UUID, limit: limit_schemas.LimitCreate, token: str = Depends
     return None
 
 @router.get("/limits/", response_model=limit_schemas.Pagination, status_code=status.HTTP_200_OK, tags=["limits"])
-def index_limit(token: str = Depends(oauth2_scheme), page: int = 1, limit: int = 100, search: str = None, year: date = None, db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
+def index_limit(loggedUser = Depends(auth_service.get_admin_user), page: int = 1, limit: int = 100, search: str = None, year: date = None, cursor: str = None, approximate_total: bool = False, db: Session = Depends(get_db)):
+    if cursor is not None:
+        limits = limit_service.get_limits(db, page=page, limit=limit, search=search, year=year, cursor=cursor)
+        next_cursor = pagination_service.get_next_cursor(limits, limit, "year", "month", "id")
 
-    if loggedUser.is_admin:
+        return get_trusted_response(limit_schemas.Pagination, data=limits, page=None, last_page=None, limit=limit, next_cursor=next_cursor)
+
+    if approximate_total:
         limits = limit_service.get_limits(db, page=page, limit=limit, search=search, year=year)
+        amount = pagination_service.get_cached_total(("limits", year), lambda: limit_service.get_limits_amount(db, year=year))
     else:
-        raise http_exceptions.permission_denied_error
+        limits, amount = limit_service.get_limits_page(db, page=page, limit=limit, search=search, year=year)
 
-    amount = limit_service.get_limits_amount(db,user_id=None)
     last_page = math.ceil(amount/limit)
 
-    return limit_schemas.Pagination(data=limits, page=page, last_page=last_page, limit=limit)
+    return get_trusted_response(limit_schemas.Pagination, data=limits, page=page, last_page=last_page, limit=limit)
 
-@router.get("/users/{user_uuid}/limits/", response_model=limit_schemas.Pagination, status_code=status.HTTP_200_OK, tags=["limits"])
-def index_user_limits(user_uuid: UUID, token: str = Depends(oauth2_scheme), page: int = 1, limit: int = 100, search: str = None, year: date = None, db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
-    userPath = user_service.get_user(db, uuid=str(user_uuid))
-    
-    if userPath is None:
-            raise http_exceptions.user_not_found_error
+@router.get("/users/{user_uuid}/limits/", response_model=limit_schemas.Pagination, dependencies=[Depends(version_service.check_path_user_version)], status_code=status.HTTP_200_OK, tags=["limits"])
+def index_user_limits(user_uuid: UUID, userPath = Depends(auth_service.get_path_user), page: int = 1, limit: int = 100, search: str = None, year: date = None, cursor: str = None, db: Session = Depends(get_db)):
+    if cursor is not None:
+        limits = limit_service.get_limits(db, page=page, limit=limit, search=search, year=year, user_id=userPath.id, cursor=cursor)
+        next_cursor = pagination_service.get_next_cursor(limits, limit, "year", "month", "id")
 
-    if loggedUser.is_admin:
-        limits = limit_service.get_limits(db, page=page, limit=limit, search=search, year=year, user_id=userPath.id)
-        amount = limit_service.get_limits_amount(db,user_id=userPath.id)
-    else:
-        if not loggedUser.id == userPath.id:
-            raise http_exceptions.permission_denied_error
-
-        limits = limit_service.get_limits(db, page=page, limit=limit, search=search, year=year, user_id=loggedUser.id)
-        amount = limit_service.get_limits_amount(db,user_id=loggedUser.id)
+        return get_trusted_response(limit_schemas.Pagination, data=limits, page=None, last_page=None, limit=limit, next_cursor=next_cursor)
 
+    limits, amount = limit_service.get_limits_page(db, page=page, limit=limit, search=search, year=year, user_id=userPath.id)
     last_page = math.ceil(amount/limit)
 
-    return limit_schemas.Pagination(data=limits, page=page, last_page=last_page, limit=limit)
-
-@router.get("/limits/{uuid}", response_model=limit_schemas.Limit, status_code=status.HTTP_200_OK, tags=["limits"])
-def show_limit(uuid: UUID, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
+    return get_trusted_response(limit_schemas.Pagination, data=limits, page=page, last_page=last_page, limit=limit)
 
+@router.get("/limits/{uuid}", response_model=limit_schemas.Limit, dependencies=[Depends(version_service.check_user_version)], status_code=status.HTTP_200_OK, tags=["limits"])
+def show_limit(uuid: UUID, loggedUser = Depends(auth_service.get_current_active_user), db: Session = Depends(get_db)):
     limit = limit_service.get_limit_by_uuid(db, uuid=str(uuid), user_id=loggedUser.id)
 
     if limit is None:
         raise http_exceptions.expenditure_not_found
-    if limit.owner_id is not loggedUser.id:
+    if limit.owner_id != loggedUser.id:
         raise http_exceptions.permission_denied_error
 
     return limit
 
 @router.delete("/limits/{uuid}", status_code=status.HTTP_204_NO_CONTENT, tags=["limits"])
-def delete_limit(uuid: UUID, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
-
+def delete_limit(uuid: UUID, loggedUser = Depends(auth_service.get_current_active_user), db: Session = Depends(get_db)):
     limitDB = limit_service.get_limit_by_uuid(db, uuid=str(uuid), user_id=loggedUser.id)
 
     if limitDB is None:
         raise http_exceptions.expenditure_not_found
-    if limitDB.owner_id is not loggedUser.id:
+    if limitDB.owner_id != loggedUser.id:
         raise http_exceptions.permission_denied_error
 
     limit_service.delete_limit(db, str(uuid))
@@ -1,12 +1,14 @@
 from fastapi import Depends, status, APIRouter
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID 
 import math
 
-from ...services import auth_service, user_service
+from ...services import auth_service, pagination_service, user_service
 from ...schemas import user_schemas
 
-from ...dependencies import get_db, oauth2_scheme
+from ...responses import get_trusted_response
+from ...dependencies import get_db, get_async_db
 from ...exceptions import http_exceptions
 
 router = APIRouter(
@@ -20,36 +22,42 @@ router = APIRouter(
 
 # users
 @router.post("/", response_model=user_schemas.User, status_code=status.HTTP_201_CREATED, tags=["users"])
-def create_user(user: user_schemas.UserCreate, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
+async def create_user(user: user_schemas.UserCreate, loggedUser = Depends(auth_service.get_admin_user_async), db: AsyncSession = Depends(get_async_db)):
+    db_user = await user_service.get_user_by_email_async(db, email=user.email)
 
-    if loggedUser.is_admin:
-        db_user = user_service.get_user_by_email(db, email=user.email)
+    if db_user:
+        raise http_exceptions.used_email_error
 
-        if db_user:
-            raise http_exceptions.used_email_error
-        return user_service.create_user(db=db, user=user)
-    else:
-        raise http_exceptions.permission_denied_error
+    hashed_password = await auth_service.get_hashed_password_async(user.password)
+
+    return await user_service.create_user_async(db=db, user=user, hashed_password=hashed_password)
 
 
 @router.get("/", response_model=user_schemas.Pagination, status_code=status.HTTP_200_OK, tags=["users"])
-def index_users(token: str = Depends(oauth2_scheme), page: int = 1, limit: int = 100, search:str = None, db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
+def index_users(loggedUser = Depends(auth_service.get_admin_user), page: int = 1, limit: int = 100, search:str = None, cursor: str = None, approximate_total: bool = False, db: Session = Depends(get_db)):
+    if cursor is not None:
+        users = user_service.get_users(db, page=page, limit=limit, search=search, cursor=cursor)
+        next_cursor = pagination_service.get_next_cursor(users, limit, "email", "id")
+
+        return get_trusted_response(user_schemas.Pagination, data=users, page=None, last_page=None, limit=limit, next_cursor=next_cursor)
 
-    if loggedUser.is_admin:
+    if approximate_total:
         users = user_service.get_users(db, page=page, limit=limit, search=search)
+        amount = pagination_service.get_cached_total(("users", search), lambda: user_service.get_users_amount(db, search=search))
     else:
-        raise http_exceptions.permission_denied_error
-        
-    amount = user_service.get_users_amount(db)
+        users, amount = user_service.get_users_page(db, page=page, limit=limit, search=search)
+
     last_page = math.ceil(amount/limit)
 
-    return user_schemas.Pagination(data=users, page=page, last_page=last_page, limit=limit)
+    return get_trusted_response(user_schemas.Pagination, data=users, page=page, last_page=last_page, limit=limit)
 
 
 @router.get("/{user_uuid}", response_model=user_schemas.User, status_code=status.HTTP_200_OK, tags=["users"])
-def show_user(user_uuid: UUID, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def show_user(user_uuid: UUID, loggedUser = Depends(auth_service.get_current_active_user), db: Session = Depends(get_db)):
+    # the full user (with the token) is only shown to the user itself and to admins
+    if not loggedUser.is_admin and loggedUser.uuid != str(user_uuid):
+        raise http_exceptions.permission_denied_error
+
     db_user = user_service.get_user(db, uuid=str(user_uuid))
 
     if db_user is None:
@@ -58,17 +66,12 @@ def show_user(user_uuid: UUID, token: str = Depends(oauth2_scheme), db: Session
     return db_user
 
 @router.delete("/{user_uuid}", status_code=status.HTTP_204_NO_CONTENT, tags=["users"])
-def delete_user(user_uuid: UUID, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    loggedUser = auth_service.decode_token(db=db, token=token)
-
-    if loggedUser.is_admin:
-        db_user = user_service.get_user(db, uuid=str(user_uuid))
+def delete_user(user_uuid: UUID, loggedUser = Depends(auth_service.get_admin_user), db: Session = Depends(get_db)):
+    db_user = user_service.get_user(db, uuid=str(user_uuid))
 
-        if db_user is None:
-            raise http_exceptions.user_not_found_error
+    if db_user is None:
+        raise http_exceptions.user_not_found_error
 
-        user_service.delete_user(db, uuid=db_user.uuid)
+    user_service.delete_user(db, uuid=db_user.uuid)
 
-        return None
-    else:
-        raise http_exceptions.permission_denied_error
\ No newline at end of file
+    return None
\ No newline at end of file
@@ -0,0 +1,48 @@
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from ..models.tombstone_model import TombstoneEntities
+from .expenditure_schemas import Expenditure
+from .expenditures_day_stat_schemas import ExpendituresDayStat
+from .limit_schemas import Limit
+
+class Tombstone(BaseModel):
+    entity: TombstoneEntities = Field(
+        title="The entity of the deleted row",
+        description="The entity of the deleted row: expenditure, limit or expenditures_day_stat.",
+        example=TombstoneEntities.expenditure,
+    )
+    uuid: str = Field(
+        title="The uuid of the deleted row",
+        description="The uuid of the deleted row.",
+    )
+
+    class Config:
+        orm_mode = True
+
+class Changes(BaseModel):
+    expenditures: List[Expenditure] = Field(
+        title="The changed expenditures",
+        description="The expenditures created or updated since the cursor, recurrence rules are not expanded.",
+    )
+    limits: List[Limit] = Field(
+        title="The changed limits",
+        description="The limits created or updated since the cursor.",
+    )
+    expenditures_day_stats: List[ExpendituresDayStat] = Field(
+        title="The changed expenditure day stats",
+        description="The day stats created or updated since the cursor.",
+    )
+    deleted: List[Tombstone] = Field(
+        title="The deleted rows",
+        description="The expenditures, limits and day stats deleted since the cursor. Empty without a cursor.",
+    )
+    next_cursor: int = Field(
+        title="The cursor of the next sync",
+        description="The data version to pass as `since` to get the changes made after this response.",
+    )
+    has_more: bool = Field(
+        title="The more changes flag",
+        description="Set when the changes did not fit in the limit, the next page is read with next_cursor right away.",
+    )
@@ -1,10 +1,35 @@
-from typing import List
+from typing import List, Union
+from enum import Enum
 
 from pydantic import BaseModel, Field
 from uuid import UUID
 from datetime import date as date_type
 
-from ..models.expenditure_model import ExpenditureTypes
+from ..models.expenditure_model import ExpenditureTypes, RecurrenceUnits
+
+class Recurrence(BaseModel):
+    unit: RecurrenceUnits = Field(
+        title="The unit of the recurrence",
+        description="The unit of the recurrence: day, week or month.",
+        example=RecurrenceUnits.month,
+    )
+    interval: int = Field(
+        default=1,
+        title="The interval of the recurrence",
+        description="The expenditure repeats every interval units from its date.",
+        ge=1,
+        le=1000,
+        example=1,
+    )
+    end_date: Union[date_type, None] = Field(
+        default=None,
+        title="The end date of the recurrence",
+        description="The last day the expenditure can repeat on. Empty when it repeats without end.",
+        example="2023-12-31",
+    )
+
+    class Config:
+        orm_mode = True
 
 class ExpenditureBase(BaseModel):
     name: str = Field(
@@ -39,6 +64,11 @@ class ExpenditureBase(BaseModel):
         max_length=300,
         example="Rome",
     )
+    recurrence: Union[Recurrence, None] = Field(
+        default=None,
+        title="The recurrence of the expenditure",
+        description="The recurrence rule of a cyclical expenditure, the expenditure itself is the first occurrence. Empty for one-off expenditures.",
+    )
 
 
 class ExpenditureCreate(ExpenditureBase):
@@ -46,6 +76,11 @@ class ExpenditureCreate(ExpenditureBase):
 
 class Expenditure(ExpenditureBase):
     uuid: str
+    occurrence: bool = Field(
+        default=False,
+        title="The expanded occurrence flag",
+        description="Set on the occurrences expanded from a recurrence rule, their uuid is the uuid of the rule.",
+    )
 
     class Config:
         orm_mode = True
@@ -55,15 +90,64 @@ class Pagination(BaseModel):
         title="The expenditure data",
         description="The expenditure data.",
     )
-    page: int = Field(
+    page: Union[int, None] = Field(
         title="The total pages amount",
-        description="The total pages amount.",
+        description="The total pages amount. Empty in cursor mode.",
     )
-    last_page: int = Field(
+    last_page: Union[int, None] = Field(
         title="The last page number",
-        description="The last page number of pagination.",
+        description="The last page number of pagination. Empty in cursor mode.",
     )
     limit: int = Field(
         title="The limit of displaying data",
         description="The limit of displaying data.",
-    )
\ No newline at end of file
+    )
+    next_cursor: Union[str, None] = Field(
+        default=None,
+        title="The cursor of the next page",
+        description="The opaque cursor to pass as `cursor` to get the next page, set only in cursor mode. Empty when there is no next page.",
+    )
+
+class BatchOperationTypes(str, Enum):
+    create = "create"
+    update = "update"
+    delete = "delete"
+
+class BatchOperation(BaseModel):
+    op: BatchOperationTypes = Field(
+        title="The operation",
+        description="The operation: create, update or delete.",
+        example=BatchOperationTypes.create,
+    )
+    uuid: Union[UUID, None] = Field(
+        default=None,
+        title="The uuid of the expenditure",
+        description="The uuid of the updated or deleted expenditure. Empty for create.",
+    )
+    expenditure: Union[ExpenditureCreate, None] = Field(
+        default=None,
+        title="The expenditure",
+        description="The created expenditure or the new values of the updated one. Empty for delete.",
+    )
+
+class Batch(BaseModel):
+    operations: List[BatchOperation] = Field(
+        title="The operations",
+        description="The operations, validated together and applied in one transaction.",
+    )
+
+class BatchOperationResult(BaseModel):
+    op: BatchOperationTypes = Field(
+        title="The operation",
+        description="The operation.",
+    )
+    uuid: str = Field(
+        title="The uuid of the expenditure",
+        description="The uuid of the created, updated or deleted expenditure.",
+    )
+
+class BatchResult(BaseModel):
+    data: List[BatchOperationResult] = Field(
+        title="The operation results",
+        description="The operation results, in the order of the operations.",
+    )
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Union
 
 from pydantic import BaseModel, Field
 from datetime import date as date_type
@@ -30,6 +30,50 @@ class Pagination(BaseModel):
         title="The expenditure stats data",
         description="The expenditure stats data.",
     )
+    page: Union[int, None] = Field(
+        title="The total pages amount",
+        description="The total pages amount. Empty in cursor mode.",
+    )
+    last_page: Union[int, None] = Field(
+        title="The last page number",
+        description="The last page number of pagination. Empty in cursor mode.",
+    )
+    limit: int = Field(
+        title="The limit of displaying data",
+        description="The limit of displaying data.",
+    )
+    next_cursor: Union[str, None] = Field(
+        default=None,
+        title="The cursor of the next page",
+        description="The opaque cursor to pass as `cursor` to get the next page, set only in cursor mode. Empty when there is no next page.",
+    )
+
+class ExpendituresPeriodStat(BaseModel):
+    period: str = Field(
+        title="The period",
+        description="The period label, `2023-01-15` for a day, `2023-W02` for an ISO week, `2023-01` for a month, `2023-Q1` for a quarter and `2023` for a year.",
+        example="2023-01"
+    )
+    date: date_type = Field(
+        title="The first day of the period",
+        description="The first day of the period, monday for ISO weeks.",
+        example="2023-01-01"
+    )
+    total_cost: float = Field(
+        title="The total expenditures cost",
+        description="The total expenditures cost in the period.",
+        example=1410
+    )
+
+class PeriodPagination(BaseModel):
+    data: List[ExpendituresPeriodStat] = Field(
+        title="The expenditure stats per period",
+        description="The expenditure stats per period.",
+    )
+    group_by: str = Field(
+        title="The period",
+        description="The period the stats are grouped by: day, week, month, quarter or year.",
+    )
     page: int = Field(
         title="The total pages amount",
         description="The total pages amount.",
@@ -43,6 +87,19 @@ class Pagination(BaseModel):
         description="The limit of displaying data.",
     )
 
+class RebuildResult(BaseModel):
+    rebuilt: Union[int, None] = Field(
+        default=None,
+        title="The rebuilt day stats amount",
+        description="The amount of day stats written by the rebuild. Empty when the rebuild runs in background.",
+        example=365
+    )
+    job: Union[str, None] = Field(
+        default=None,
+        title="The rebuild job uuid",
+        description="The uuid of the queued rebuild job, set only when the rebuild runs in background.",
+    )
+
 class ExpendituresLimitBase(BaseModel):
     total_cost: float = Field(
         title="The total expenditures cost in whole month",
@@ -70,4 +127,49 @@ class ExpendituresLimitBase(BaseModel):
             "1":456.00,
             "limit": 500.00
         }]
-    )
\ No newline at end of file
+    )
+class BudgetSummaryBase(BaseModel):
+    total_cost: float = Field(
+        title="The total expenditures cost",
+        description="The total expenditures cost in the period.",
+        example=456.00
+    )
+    limit: float = Field(
+        title="The limit",
+        description="The limit for the period, 0 when no limit is set.",
+        example=500.00
+    )
+    remaining: float = Field(
+        title="The remaining amount",
+        description="The limit minus the total expenditures cost, negative when the limit is exceeded.",
+        example=44.00
+    )
+    utilisation: Union[float, None] = Field(
+        title="The limit utilisation",
+        description="The total expenditures cost divided by the limit. Empty when no limit is set.",
+        example=0.912
+    )
+
+class BudgetSummaryMonth(BudgetSummaryBase):
+    month: int = Field(
+        title="The month",
+        description="The month.",
+        example=1
+    )
+
+class BudgetSummaryYear(BudgetSummaryBase):
+    year: int = Field(
+        title="The year",
+        description="The year.",
+        example=2023
+    )
+    months: List[BudgetSummaryMonth] = Field(
+        title="The months",
+        description="The months of the year with expenditures or a limit.",
+    )
+
+class BudgetSummary(BaseModel):
+    data: List[BudgetSummaryYear] = Field(
+        title="The budget summary per year",
+        description="The budget summary of every year in the range, years without expenditures and limits have no months.",
+    )
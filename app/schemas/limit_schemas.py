@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Union
 
 from pydantic import BaseModel, Field
 
@@ -37,15 +37,20 @@ class Pagination(BaseModel):
         title="The limits data",
         description="The limits data.",
     )
-    page: int = Field(
+    page: Union[int, None] = Field(
         title="The total pages amount",
-        description="The total pages amount.",
+        description="The total pages amount. Empty in cursor mode.",
     )
-    last_page: int = Field(
+    last_page: Union[int, None] = Field(
         title="The last page number",
-        description="The last page number of pagination.",
+        description="The last page number of pagination. Empty in cursor mode.",
     )
     limit: int = Field(
         title="The limit of displaying data",
         description="The limit of displaying data.",
+    )
+    next_cursor: Union[str, None] = Field(
+        default=None,
+        title="The cursor of the next page",
+        description="The opaque cursor to pass as `cursor` to get the next page, set only in cursor mode. Empty when there is no next page.",
     )
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Union
 from pydantic import BaseModel, Field
 
 from .expenditure_schemas import Expenditure
@@ -28,23 +28,40 @@ class UserPublicWithExpenditures(UserPublic):
     expenditures: List[Expenditure] = []
 
 class User(UserPublic):
-    token: str
+    token: Union[str, None] = None
     is_admin: bool
 
+class UserSnapshot(BaseModel):
+    id: int
+    uuid: str
+    email: str
+    is_admin: Union[bool, None] = False
+    is_active: Union[bool, None] = True
+    disabled: Union[bool, None] = False
+    token_version: int = 0
+
+    class Config:
+        orm_mode = True
+
 class Pagination(BaseModel):
     data: List[UserPublic] = Field(
         title="The users data",
         description="The users data.",
     )
-    page: int = Field(
+    page: Union[int, None] = Field(
         title="The total pages amount",
-        description="The total pages amount.",
+        description="The total pages amount. Empty in cursor mode.",
     )
-    last_page: int = Field(
+    last_page: Union[int, None] = Field(
         title="The last page number",
-        description="The last page number of pagination.",
+        description="The last page number of pagination. Empty in cursor mode.",
     )
     limit: int = Field(
         title="The limit of displaying data",
         description="The limit of displaying data.",
+    )
+    next_cursor: Union[str, None] = Field(
+        default=None,
+        title="The cursor of the next page",
+        description="The opaque cursor to pass as `cursor` to get the next page, set only in cursor mode. Empty when there is no next page.",
     )
\ No newline at end of file
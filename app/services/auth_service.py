@@ -1,15 +1,24 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Union
 from passlib.context import CryptContext
-from jose import jwt
+from jose import jwt, JWTError
 from datetime import datetime, timedelta
 from fastapi import Depends
+from uuid import UUID
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 
 from ..models import user_model
-from . import user_service
-from ..dependencies import oauth2_scheme, get_db, get_settings
+from . import user_service, token_cache_service
+from ..dependencies import oauth2_scheme, get_db, get_async_db, get_settings
+from ..exceptions import http_exceptions
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=get_settings().password_hash_rounds)
+
+# bcrypt takes a few hundred ms of cpu per call, async routes run it on this bounded pool
+# so a burst of logins queues here instead of taking every thread of the general threadpool
+__password_executor = ThreadPoolExecutor(max_workers=get_settings().password_hash_workers, thread_name_prefix="password-hash")
 
 # auth   
 def __hash_password(password: str):
@@ -35,13 +44,56 @@ def __verify_password(password: str, hashed_password: str):
 def get_hashed_password(password: str):
     return __hash_password(password=password)
 
-def decode_token(db: Session, token: str):
+async def get_hashed_password_async(password: str):
+    return await asyncio.get_running_loop().run_in_executor(__password_executor, __hash_password, password)
+
+async def verify_password_async(password: str, hashed_password: str):
+    return await asyncio.get_running_loop().run_in_executor(__password_executor, __verify_password, password, hashed_password)
+
+def __decode_stateless_token(db: Session, token: str, payload: Union[dict, None] = None):
+    if payload is None:
+        try:
+            payload = jwt.decode(token, get_settings().secret_key, algorithms=[get_settings().algorithm])
+        except JWTError:
+            return None
+
+    user_id = payload.get("uid")
+    version = payload.get("ver")
+
+    if user_id is None or version is None:
+        return None
+
+    # the version check is served from the cache, logout and password change invalidate it
+    user = token_cache_service.get_user(user_id)
+
+    if user is None:
+        userDb = user_service.get_user_by_id(db=db, id=user_id)
+
+        if not userDb:
+            return None
+
+        user = token_cache_service.set_user(user_id, userDb)
+
+    if user.token_version != version:
+        return None
+
+    return user
+
+def decode_token(db: Session, token: str, payload: Union[dict, None] = None):
+    if get_settings().stateless_tokens:
+        return __decode_stateless_token(db=db, token=token, payload=payload)
+
+    user = token_cache_service.get_user(token)
+
+    if user is not None:
+        return user
+
     user = user_service.get_user_by_token(db=db,token=token)
 
     if not user:
         return None
     
-    return user
+    return token_cache_service.set_user(token, user, token_cache_service.get_token_expire(token))
 
 def check_is_user_active(user: user_model.UserModel):
     if user.is_active:
@@ -63,26 +115,80 @@ def authenticate_user(db: Session, user: user_model.UserModel, password: str):
     
     return user
 
+async def authenticate_user_async(user: user_model.UserModel, password: str):
+    if not user:
+        return False
+    if not await verify_password_async(password=password, hashed_password=user.password):
+        return False
+
+    return user
+
 def generate_user_token(db: Session, user: user_model.UserModel):
     access_token_expires = timedelta(minutes=get_settings().access_token_expire_minutes)
 
     token = __create_access_token(
-        data = {"sub": user.email}, expires_delta=access_token_expires
+        data = {"sub": user.email, "uid": user.id, "ver": user.token_version}, expires_delta=access_token_expires
     )
 
+    # stateless tokens are verified by signature and version, nothing to store
+    if get_settings().stateless_tokens:
+        return token
+
     db.query(user_model.UserModel).filter(user_model.UserModel.id == user.id).update({"token": token})
     db.commit()
     db.refresh(user)
 
+    token_cache_service.invalidate_user(user.id)
+
     return token
 
-async def get_current_active_user(token: str = Depends(oauth2_scheme)):
-# async def get_current_active_user(request: Request = Depends(Request), token: str = Depends(oauth2_scheme)):
-    db = next(get_db())
+async def generate_user_token_async(db: AsyncSession, user: user_model.UserModel):
+    return await db.run_sync(generate_user_token, user)
+
+# request dependencies
+# the logged user is resolved once per request on the request's session, fastapi caches it
+# for every dependency below and for the route itself
+def get_current_active_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     user = user_service.get_current_user(db=db, token=token)
     
     return user
 
+async def get_current_active_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(user_service.get_current_user, token)
+
+def get_admin_user(loggedUser = Depends(get_current_active_user)):
+    if not loggedUser.is_admin:
+        raise http_exceptions.permission_denied_error
+
+    return loggedUser
+
+async def get_admin_user_async(loggedUser = Depends(get_current_active_user_async)):
+    return get_admin_user(loggedUser)
+
+# the user of the user_uuid path, accessible for the user itself and for admins
+def get_path_user(user_uuid: UUID, loggedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    if loggedUser.uuid == str(user_uuid):
+        return loggedUser
+
+    userPath = user_service.get_user(db, uuid=str(user_uuid))
+
+    if userPath is None:
+        raise http_exceptions.user_not_found_error
+    if not loggedUser.is_admin:
+        raise http_exceptions.permission_denied_error
+
+    return userPath
+
+# the user of the user_uuid path, accessible only for the user itself
+def get_path_owner(user_uuid: UUID, loggedUser = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    if loggedUser.uuid == str(user_uuid):
+        return loggedUser
+
+    if user_service.get_user(db, uuid=str(user_uuid)) is None:
+        raise http_exceptions.user_not_found_error
+
+    raise http_exceptions.permission_denied_error
+
 # def get_user_from_request(request: Request = Depends(Request)):
 #     if request.user is not None:
 #         return request.user
@@ -0,0 +1,93 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import cast, extract, func, literal, select, union_all, Float, Integer
+from datetime import date
+
+from ..models import expenditures_month_stat_model, limits_model
+from ..exceptions import http_exceptions
+from . import recurrence_service
+
+month_model = expenditures_month_stat_model.ExpendituresMonthStat
+limit_model = limits_model.LimitModel
+
+MAX_YEARS = 100
+
+# `2023` or an inclusive range `2021-2023`
+def parse_years(years: str) -> tuple:
+    try:
+        parts = [int(part) for part in years.split("-")]
+    except (AttributeError, ValueError):
+        raise http_exceptions.validation_error
+
+    if len(parts) == 1:
+        parts.append(parts[0])
+
+    if len(parts) != 2 or parts[0] > parts[1] or parts[1] - parts[0] >= MAX_YEARS:
+        raise http_exceptions.validation_error
+
+    return parts[0], parts[1]
+
+def __get_utilisation(total_cost: float, limit: float):
+    if not limit:
+        return None
+
+    return round(total_cost / limit, 4)
+
+def __get_summary_row(total_cost: float, limit: float) -> dict:
+    return {
+        "total_cost": round(total_cost, 2),
+        "limit": round(limit, 2),
+        "remaining": round(limit - total_cost, 2),
+        "utilisation": __get_utilisation(total_cost, limit),
+    }
+
+def get_budget_summary(db: Session, user_id: int, year_from: int, year_to: int = None) -> list:
+    if year_to is None:
+        year_to = year_from
+
+    # the month rollup, the limits and the occurrences are put side by side and summed per month by the database,
+    # so every month with a spend or a limit comes back in one round trip
+    spent = select(
+        month_model.year.label("year"),
+        month_model.month.label("month"),
+        month_model.total_cost.label("total_cost"),
+        literal(0.0, Float).label("month_limit"),
+        literal(1, Integer).label("has_cost"),
+    ).where(month_model.owner_id == user_id).where(month_model.year.between(year_from, year_to))
+
+    limits = select(
+        limit_model.year,
+        limit_model.month,
+        literal(0.0, Float),
+        limit_model.limit,
+        literal(0, Integer),
+    ).where(limit_model.owner_id == user_id).where(limit_model.year.between(year_from, year_to))
+
+    # the occurrences of the recurrence rules in the range are spent too, up to its end like in the period stats
+    # and the expanded listing, so the upcoming occurrences of the current year count against its limits
+    occurrences = recurrence_service.get_user_occurrences(db, user_id, date_from=date(year_from, 1, 1), date_to=date(year_to, 12, 31)).subquery()
+    expanded = select(
+        cast(extract("year", occurrences.c.date), Integer),
+        cast(extract("month", occurrences.c.date), Integer),
+        occurrences.c.cost,
+        literal(0.0, Float),
+        literal(1, Integer),
+    )
+
+    months = union_all(spent, limits, expanded).subquery()
+    query = select(
+        months.c.year,
+        months.c.month,
+        func.sum(months.c.total_cost).label("total_cost"),
+        func.sum(months.c.month_limit).label("month_limit"),
+        func.max(months.c.has_cost).label("has_cost"),
+    ).group_by(months.c.year, months.c.month).order_by(months.c.year, months.c.month)
+
+    summary = {year: {"year": year, "total_cost": 0, "limit": 0, "months": []} for year in range(year_from, year_to + 1)}
+
+    for row in db.execute(query):
+        year = summary[row.year]
+        year["total_cost"] += row.total_cost
+        year["limit"] += row.month_limit
+        year["months"].append({"month": row.month, "has_cost": bool(row.has_cost), **__get_summary_row(row.total_cost, row.month_limit)})
+
+    return [{"year": year["year"], "months": year["months"], **__get_summary_row(year["total_cost"], year["limit"])} for year in summary.values()]
@@ -1,21 +1,26 @@
 from sqlalchemy.orm import Session
 from uuid import uuid4
 from datetime import date, datetime
-from sqlalchemy import func
+import calendar
+from sqlalchemy import func, cast, exists, extract, insert, select, delete, tuple_, union_all, Date, Integer, String
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-from ..models import expenditures_day_stat_model
+from ..models import expenditure_model, expenditures_day_stat_model, expenditures_month_stat_model, expenditures_year_stat_model, tombstone_model, user_model
 from ..schemas import expenditures_day_stat_schemas
-from . import limit_service
+from . import budget_service, pagination_service, recurrence_service, sync_service, version_service
 
 model = expenditures_day_stat_model.ExpendituresDayStat
+month_model = expenditures_month_stat_model.ExpendituresMonthStat
+year_model = expenditures_year_stat_model.ExpendituresYearStat
 
-def get_expenditures_day_stats(db: Session, user_id: int = None, page: int = 0, limit: int = 100, search: str = None, date_from: date = None, date_to: date = None, group_by: str = None):
+def get_expenditures_day_stats(db: Session, user_id: int = None, page: int = 0, limit: int = 100, search: str = None, date_from: date = None, date_to: date = None, group_by: str = None, cursor: str = None):
     if group_by:
-        query = db.query(expenditures_day_stat_model.ExpendituresDayStat.date, func.sum(expenditures_day_stat_model.ExpendituresDayStat.total_cost).label('total_cost')).filter(expenditures_day_stat_model.ExpendituresDayStat.owner_id== user_id)
-    else:
-        query = db.query(expenditures_day_stat_model.ExpendituresDayStat).filter(expenditures_day_stat_model.ExpendituresDayStat.owner_id== user_id)
+        return get_expenditures_period_stats(db, user_id=user_id, group_by=group_by, page=page, limit=limit, date_from=date_from, date_to=date_to)[0]
+
+    query = db.query(expenditures_day_stat_model.ExpendituresDayStat).filter(expenditures_day_stat_model.ExpendituresDayStat.owner_id== user_id)
 
-    query = query.order_by(expenditures_day_stat_model.ExpendituresDayStat.date)
+    query = query.order_by(expenditures_day_stat_model.ExpendituresDayStat.date, expenditures_day_stat_model.ExpendituresDayStat.id)
 
     if user_id:
         query = query.filter(expenditures_day_stat_model.ExpendituresDayStat.owner_id == user_id)
@@ -29,36 +34,188 @@ def get_expenditures_day_stats(db: Session, user_id: int = None, page: int = 0,
     if date_to:
         query = query.filter(expenditures_day_stat_model.ExpendituresDayStat.date <= date_to)
 
-    if group_by:
+    if cursor is not None:
+        after = pagination_service.decode_cursor(cursor, date.fromisoformat, int)
+        query = pagination_service.apply_keyset(query, [expenditures_day_stat_model.ExpendituresDayStat.date, expenditures_day_stat_model.ExpendituresDayStat.id], after)
+
+        return query.limit(limit).all()
+
+    return query.offset((page-1) * limit).limit(limit).all()
+
+# period stats
+PERIODS = ("day", "week", "month", "quarter", "year")
+
+def __week_start(db: Session, column):
+    # monday of the iso week, sqlite has no iso week format before 3.46
+    if db.get_bind().dialect.name == "sqlite":
+        daysSinceMonday = (cast(func.strftime("%w", column), Integer) + 6) % 7
+
+        return func.date(column, "-" + cast(daysSinceMonday, String) + " days")
+
+    return cast(func.date_trunc("week", column), Date)
+
+def __get_period_source(db: Session, user_id: int, group_by: str, date_from: date = None, date_to: date = None):
+    # the stored stats and the occurrences of the recurrence rules, which are not stored, summed together.
+    # Whole years are read from the year rollup (one row a year), whole months and quarters from the month
+    # rollup (at most 12 rows a year), days, weeks and ranges starting or ending mid-month from the day stats
+    occurrences = recurrence_service.get_user_occurrences(db, user_id, date_from=date_from, date_to=date_to).subquery()
+
+    if group_by == "year" and __is_whole_years(date_from, date_to):
+        stored = select(year_model.year, year_model.total_cost).where(year_model.owner_id == user_id)
+
+        if date_from:
+            stored = stored.where(year_model.year >= date_from.year)
+        if date_to:
+            stored = stored.where(year_model.year <= date_to.year)
+
+        expanded = select(cast(extract("year", occurrences.c.date), Integer), occurrences.c.cost)
+        source = union_all(stored, expanded).subquery()
+
+        return source, source.c.year, None
+
+    if group_by in ("month", "quarter", "year") and __is_whole_months(date_from, date_to):
+        stored = select(month_model.year, month_model.month, month_model.total_cost).where(month_model.owner_id == user_id)
+
+        if date_from:
+            stored = stored.where(tuple_(month_model.year, month_model.month) >= tuple_(date_from.year, date_from.month))
+        if date_to:
+            stored = stored.where(tuple_(month_model.year, month_model.month) <= tuple_(date_to.year, date_to.month))
+
+        expanded = select(cast(extract("year", occurrences.c.date), Integer), cast(extract("month", occurrences.c.date), Integer), occurrences.c.cost)
+        source = union_all(stored, expanded).subquery()
+
+        return source, source.c.year, source.c.month
+
+    stored = select(model.date, model.total_cost).where(model.owner_id == user_id)
+
+    if date_from:
+        stored = stored.where(model.date >= date_from)
+    if date_to:
+        stored = stored.where(model.date <= date_to)
+
+    source = union_all(stored, select(occurrences.c.date, occurrences.c.cost)).subquery()
+
+    return source, cast(extract("year", source.c.date), Integer), cast(extract("month", source.c.date), Integer)
+
+def __get_period_buckets(db: Session, group_by: str, source, year, month) -> list:
+    if group_by == "day":
+        return [source.c.date]
+
+    if group_by == "week":
+        return [__week_start(db, source.c.date)]
+
+    if group_by == "month":
+        return [year, month]
+
+    if group_by == "quarter":
+        return [year, (month - 1) // 3 + 1]
+
+    return [year]
+
+def __get_period(group_by: str, keys) -> tuple:
+    if group_by in ("day", "week"):
+        start = keys[0] if isinstance(keys[0], date) else date.fromisoformat(keys[0])
+
         if group_by == "day":
-            query = query.group_by(expenditures_day_stat_model.ExpendituresDayStat.date)
-        elif group_by == "month" or group_by == "year":
-            query = query.group_by(expenditures_day_stat_model.ExpendituresDayStat.date)
-            result = query.order_by(expenditures_day_stat_model.ExpendituresDayStat.date).all()
+            return start.isoformat(), start
 
-            grouped_expenditures = {}
-            for day in result:
-                year = grouped_expenditures.get(day.date.year)
+        isoYear, isoWeek, _ = start.isocalendar()
 
-                if not year:
-                    year = grouped_expenditures[day.date.year] = {}
+        return str(isoYear) + "-W" + str(isoWeek).zfill(2), start
 
-                el = year.get(day.date.month)
-                if not el:
-                    year[day.date.month] = day.total_cost
-                else:
-                    year[day.date.month] += day.total_cost
+    year = int(keys[0])
 
+    if group_by == "month":
+        return str(year) + "-" + str(int(keys[1])).zfill(2), date(year, int(keys[1]), 1)
 
-            return grouped_expenditures
+    if group_by == "quarter":
+        return str(year) + "-Q" + str(int(keys[1])), date(year, (int(keys[1]) - 1) * 3 + 1, 1)
 
-    return query.offset((page-1) * limit).limit(limit).all()
+    return str(year), date(year, 1, 1)
+
+def get_expenditures_period_stats(db: Session, user_id: int, group_by: str, page: int = 1, limit: int = 100, date_from: date = None, date_to: date = None) -> tuple:
+    if isinstance(date_from, str):
+        date_from = date.fromisoformat(date_from)
+    if isinstance(date_to, str):
+        date_to = date.fromisoformat(date_to)
+
+    source, year, month = __get_period_source(db, user_id, group_by, date_from=date_from, date_to=date_to)
+    keys = __get_period_buckets(db, group_by, source, year, month)
+    keys = [key.label("key_" + str(index)) for index, key in enumerate(keys)]
+
+    # only the aggregated rows leave the database, the window count is the amount of periods
+    query = select(*keys, func.sum(source.c.total_cost).label("total_cost"), func.count().over().label("total_count"))
+    query = query.group_by(*keys).order_by(*keys).offset((max(page, 1) - 1) * limit).limit(limit)
+    rows = db.execute(query).all()
+
+    periods = []
+    for row in rows:
+        period, start = __get_period(group_by, row[:len(keys)])
+        periods.append({"period": period, "date": start, "total_cost": row.total_cost})
+
+    if rows:
+        return periods, rows[0].total_count
+
+    if page <= 1:
+        return periods, 0
+
+    # past the last page there is no row to carry the window count
+    return periods, db.execute(select(func.count()).select_from(query.order_by(None).limit(None).offset(None).subquery())).scalar()
+
+def __is_whole_months(date_from: date = None, date_to: date = None) -> bool:
+    if isinstance(date_from, str):
+        date_from = date.fromisoformat(date_from)
+    if isinstance(date_to, str):
+        date_to = date.fromisoformat(date_to)
+
+    if date_from and date_from.day != 1:
+        return False
+
+    return not date_to or date_to.day == calendar.monthrange(date_to.year, date_to.month)[1]
+
+def __is_whole_years(date_from: date = None, date_to: date = None) -> bool:
+    return (not date_from or (date_from.month, date_from.day) == (1, 1)) and (not date_to or (date_to.month, date_to.day) == (12, 31))
+
+# month totals from the expenditures_month_stats rollup, {year: {month: total_cost}}
+def get_month_costs(db: Session, user_id: int, date_from: date = None, date_to: date = None) -> dict:
+    if isinstance(date_from, str):
+        date_from = date.fromisoformat(date_from)
+    if isinstance(date_to, str):
+        date_to = date.fromisoformat(date_to)
+
+    query = db.query(month_model.year, month_model.month, month_model.total_cost).filter(month_model.owner_id == user_id)
+
+    if date_from:
+        query = query.filter(tuple_(month_model.year, month_model.month) >= tuple_(date_from.year, date_from.month))
+
+    if date_to:
+        query = query.filter(tuple_(month_model.year, month_model.month) <= tuple_(date_to.year, date_to.month))
+
+    grouped_expenditures = {}
+    for row in query.order_by(month_model.year, month_model.month).all():
+        grouped_expenditures.setdefault(row.year, {})[row.month] = row.total_cost
+
+    return grouped_expenditures
+
+def get_expenditures_day_stats_page(db: Session, user_id: int, page: int = 1, limit: int = 100, date_from: date = None, date_to: date = None):
+    query = db.query(expenditures_day_stat_model.ExpendituresDayStat).filter(expenditures_day_stat_model.ExpendituresDayStat.owner_id == user_id)
+
+    if date_from:
+        query = query.filter(expenditures_day_stat_model.ExpendituresDayStat.date >= date_from)
+
+    if date_to:
+        query = query.filter(expenditures_day_stat_model.ExpendituresDayStat.date <= date_to)
+
+    query = query.order_by(expenditures_day_stat_model.ExpendituresDayStat.date, expenditures_day_stat_model.ExpendituresDayStat.id)
+
+    return pagination_service.get_page_with_total(query, page=page, limit=limit)
 
 def get_expenditure_day_stat(db: Session, uuid: str):
     return db.query(expenditures_day_stat_model.ExpendituresDayStat).filter(expenditures_day_stat_model.ExpendituresDayStat.uuid == uuid).first()
 
 def update_expenditure_day_stat(db: Session, expenditureDayStatDb: expenditures_day_stat_model.ExpendituresDayStat, expenditureDayStat: expenditures_day_stat_schemas.ExpendituresDayStat) -> bool:
-    db.query(expenditures_day_stat_model.ExpendituresDayStat).filter(expenditures_day_stat_model.ExpendituresDayStat.id == expenditureDayStatDb.id).update(expenditureDayStat.dict())
+    versions = version_service.bump_data_versions(db, [expenditureDayStatDb.owner_id])
+    db.query(expenditures_day_stat_model.ExpendituresDayStat).filter(expenditures_day_stat_model.ExpendituresDayStat.id == expenditureDayStatDb.id).update({**expenditureDayStat.dict(), "change_seq": versions[expenditureDayStatDb.owner_id]})
     db.commit()
     db.refresh(expenditureDayStatDb)
 
@@ -66,8 +223,9 @@ def update_expenditure_day_stat(db: Session, expenditureDayStatDb: expenditures_
 
 def create_expenditure_day_stat(db: Session, expenditureDayStat: expenditures_day_stat_schemas.ExpendituresDayStat, user_id: int):
     uuid = str(uuid4())
+    versions = version_service.bump_data_versions(db, [user_id])
 
-    db_expenditure = expenditures_day_stat_model.ExpendituresDayStat(**expenditureDayStat.dict(), owner_id=user_id, uuid=uuid)
+    db_expenditure = expenditures_day_stat_model.ExpendituresDayStat(**expenditureDayStat.dict(), owner_id=user_id, uuid=uuid, change_seq=versions[user_id])
 
     db.add(db_expenditure)
     db.commit()
@@ -81,11 +239,178 @@ def remove_expenditure_day_stat(db: Session, uuid: str) -> bool:
     if expenditure == None:
         return None
 
+    versions = version_service.bump_data_versions(db, [expenditure.owner_id])
+
     db.delete(expenditure)
+    sync_service.add_tombstones(db, tombstone_model.TombstoneEntities.expenditures_day_stat, [{"uuid": expenditure.uuid, "owner_id": expenditure.owner_id, "change_seq": versions[expenditure.owner_id]}])
     db.commit()
 
     return uuid
 
+# day, month and year totals
+# `values` are set on a new row only, `changes` on a new and on an updated row
+def __set_total_cost(db: Session, stat_model, keys: dict, total, values: dict = None, changes: dict = None):
+    values = values or {}
+    changes = changes or {}
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite_insert if dialect == "sqlite" else postgresql_insert
+        statement = insert(stat_model).values(**keys, **values, **changes, total_cost=total)
+        # the unique key makes concurrent writers of one period update one row instead of creating two
+        statement = statement.on_conflict_do_update(
+            index_elements=[getattr(stat_model, key) for key in keys],
+            set_={"total_cost": statement.excluded.total_cost, **{key: statement.excluded[key] for key in changes}},
+        )
+
+        db.execute(statement)
+    else:
+        updated = db.query(stat_model).filter_by(**keys).update({"total_cost": total, **changes}, synchronize_session=False)
+
+        if not updated:
+            db.add(stat_model(**keys, **values, **changes, total_cost=total))
+            db.flush()
+
+def __has_expenditures(db: Session, user_id: int, date_from: date, date_to: date) -> bool:
+    return db.query(exists().where(expenditure_model.ExpenditureModel.owner_id == user_id)\
+        .where(expenditure_model.ExpenditureModel.date >= date_from).where(expenditure_model.ExpenditureModel.date <= date_to)).scalar()
+
+def __remove_period(db: Session, stat_model, keys: dict, entity: str = None):
+    query = db.query(stat_model).filter_by(**keys)
+
+    # synced entities leave a tombstone
+    if entity is not None:
+        sync_service.add_tombstones_from_select(db, entity, query.with_entities(stat_model.uuid, stat_model.owner_id, version_service.get_change_seq(stat_model.owner_id)))
+
+    query.delete(synchronize_session=False)
+
+# called by the expenditure writes before they commit, so the day, month and year totals
+# change in the same transaction as the expenditure. The totals are summed again, from the expenditures
+# of the day, the days of the month and the months of the year (indexed, at most 31 and 12 rows),
+# so float rounding errors never add up across writes. The writes bump the owner's data version first,
+# which serializes them, and the day stat is stamped with it
+def update_day_totals(db: Session, user_id: int, day: date):
+    expenditure = expenditure_model.ExpenditureModel
+    firstDay = day.replace(day=1)
+    lastDay = day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+    dayTotal = select(func.sum(expenditure.cost)).where(expenditure.owner_id == user_id).where(expenditure.date == day).scalar_subquery()
+    monthTotal = select(func.sum(model.total_cost)).where(model.owner_id == user_id).where(model.date >= firstDay).where(model.date <= lastDay).scalar_subquery()
+    yearTotal = select(func.sum(month_model.total_cost)).where(month_model.owner_id == user_id).where(month_model.year == day.year).scalar_subquery()
+
+    periods = [
+        (model, {"owner_id": user_id, "date": day}, dayTotal, day, day, {"uuid": str(uuid4())}, {"change_seq": version_service.get_change_seq(user_id)}, tombstone_model.TombstoneEntities.expenditures_day_stat),
+        (month_model, {"owner_id": user_id, "year": day.year, "month": day.month}, monthTotal, firstDay, lastDay, None, None, None),
+        (year_model, {"owner_id": user_id, "year": day.year}, yearTotal, date(day.year, 1, 1), date(day.year, 12, 31), None, None, None),
+    ]
+
+    # a period without expenditures has no stat row, like before any expenditure was added.
+    # The month and the year of a day with expenditures have expenditures too
+    hasExpenditures = False
+    for stat_model, keys, total, date_from, date_to, values, changes, entity in periods:
+        hasExpenditures = hasExpenditures or __has_expenditures(db, user_id, date_from, date_to)
+
+        if hasExpenditures:
+            __set_total_cost(db, stat_model, keys, total, values=values, changes=changes)
+        else:
+            __remove_period(db, stat_model, keys, entity=entity)
+
+# bulk rebuild
+def __uuid_expression(dialect: str):
+    if dialect == "postgresql":
+        return func.gen_random_uuid().cast(String)
+
+    # sqlite: a random (version 4) uuid, every group gets its own random blobs
+    def random_hex(size: int):
+        return func.lower(func.hex(func.randomblob(size)))
+
+    return random_hex(4) + "-" + random_hex(2) + "-4" + func.substr(random_hex(2), 2) + "-" \
+        + func.substr("89ab", 1 + func.abs(func.random()) % 4, 1) + func.substr(random_hex(2), 2) + "-" + random_hex(6)
+
+def __rebuild_owners(db: Session, owner_ids: list, date_from: date = None, date_to: date = None) -> int:
+    expenditure = expenditure_model.ExpenditureModel
+    dialect = db.get_bind().dialect.name
+    versions = version_service.bump_data_versions(db, owner_ids)
+
+    deleteStatement = delete(model).where(model.owner_id.in_(owner_ids))
+    # the rebuilt day stats get new uuids, the old ones leave tombstones
+    deleted = select(model.uuid, model.owner_id, version_service.get_change_seq(model.owner_id)).where(model.owner_id.in_(owner_ids))
+    totals = select(expenditure.owner_id, expenditure.date, func.sum(expenditure.cost)).where(expenditure.owner_id.in_(owner_ids))
+
+    if date_from:
+        deleteStatement = deleteStatement.where(model.date >= date_from)
+        deleted = deleted.where(model.date >= date_from)
+        totals = totals.where(expenditure.date >= date_from)
+
+    if date_to:
+        deleteStatement = deleteStatement.where(model.date <= date_to)
+        deleted = deleted.where(model.date <= date_to)
+        totals = totals.where(expenditure.date <= date_to)
+
+    totals = totals.group_by(expenditure.owner_id, expenditure.date)
+
+    sync_service.add_tombstones_from_select(db, tombstone_model.TombstoneEntities.expenditures_day_stat, deleted)
+    db.execute(deleteStatement)
+
+    if dialect in ("sqlite", "postgresql"):
+        # INSERT ... SELECT owner_id, date, SUM(cost) ... GROUP BY, computed by the database in one statement
+        totals = totals.add_columns(__uuid_expression(dialect), version_service.get_change_seq(expenditure.owner_id))
+        result = db.execute(insert(model).from_select([model.owner_id, model.date, model.total_cost, model.uuid, model.change_seq], totals))
+        inserted = result.rowcount
+    else:
+        rows = [{"owner_id": row[0], "date": row[1], "total_cost": row[2], "uuid": str(uuid4()), "change_seq": versions[row[0]]} for row in db.execute(totals)]
+
+        if rows:
+            db.execute(insert(model), rows)
+
+        inserted = len(rows)
+
+    __rebuild_owners_rollups(db, owner_ids)
+
+    db.commit()
+
+    return inserted
+
+def __rebuild_owners_rollups(db: Session, owner_ids: list):
+    # months and years are summed from the rebuilt days, whole periods so partial date ranges stay correct
+    year = extract("year", model.date)
+    month = extract("month", model.date)
+
+    db.execute(delete(month_model).where(month_model.owner_id.in_(owner_ids)))
+    db.execute(insert(month_model).from_select(
+        [month_model.owner_id, month_model.year, month_model.month, month_model.total_cost],
+        select(model.owner_id, year, month, func.sum(model.total_cost)).where(model.owner_id.in_(owner_ids)).group_by(model.owner_id, year, month),
+    ))
+
+    db.execute(delete(year_model).where(year_model.owner_id.in_(owner_ids)))
+    db.execute(insert(year_model).from_select(
+        [year_model.owner_id, year_model.year, year_model.total_cost],
+        select(model.owner_id, year, func.sum(model.total_cost)).where(model.owner_id.in_(owner_ids)).group_by(model.owner_id, year),
+    ))
+
+def rebuild_expenditures_day_stats(db: Session, user_id: int = None, date_from: date = None, date_to: date = None, chunk_size: int = 100) -> int:
+    # every chunk of users is rebuilt and committed in its own short transaction,
+    # so the writer lock is never held for the whole rebuild
+    if user_id is not None:
+        return __rebuild_owners(db, [user_id], date_from=date_from, date_to=date_to)
+
+    rebuilt = 0
+    lastId = None
+
+    while True:
+        query = select(user_model.UserModel.id).order_by(user_model.UserModel.id).limit(chunk_size)
+
+        if lastId is not None:
+            query = query.where(user_model.UserModel.id > lastId)
+
+        owner_ids = db.execute(query).scalars().all()
+
+        if not owner_ids:
+            return rebuilt
+
+        rebuilt += __rebuild_owners(db, owner_ids, date_from=date_from, date_to=date_to)
+        lastId = owner_ids[-1]
+
 def get_expenditure_day_stats_amount(db: Session, user_id: int = None) -> int:
     return db.query(expenditures_day_stat_model.ExpendituresDayStat.date, func.sum(expenditures_day_stat_model.ExpendituresDayStat.total_cost)\
         .label('total_cost')).filter(expenditures_day_stat_model.ExpendituresDayStat.owner_id== user_id).with_entities(func.count()).scalar()
@@ -94,35 +419,14 @@ def get_month_limit_data(db: Session, year: int = None, user_id: int = None):
     if year is None:
         year = datetime.now().year
 
-    date_from = str(year).zfill(4) + "-" + str(1).zfill(2) + "-01"
-    date_to = str(year).zfill(4) + "-" + str(12).zfill(2) + "-31"
-    expendiures_day_stats = get_expenditures_day_stats(db=db, user_id=user_id, page=1, limit=100, date_from=date_from, date_to=date_to, group_by="month")
-
-    month_list_limit = []
-    total_cost = 0
-    total_limit = 0
-    if year in expendiures_day_stats:
-        limitsDb = limit_service.get_limits(db=db, year=year, user_id=user_id)
-
-        for month in expendiures_day_stats[year]:
-            total_cost += expendiures_day_stats[year][month]
-            limit = 0
-
-            for limitDb in limitsDb:
-                if month == limitDb.month:
-                    limit = limitDb.limit
-
-            month_list_limit.append({
-                month: round(expendiures_day_stats[year][month], 2),
-                "limit": limit
-            })
+    summary = budget_service.get_budget_summary(db, user_id=user_id, year_from=year)[0]
 
-        for limitDb in limitsDb:
-            total_limit += limitDb.limit
+    # the months with expenditures, the total limit counts every limit of the year once the year has expenditures
+    month_list_limit = [{month["month"]: month["total_cost"], "limit": month["limit"]} for month in summary["months"] if month["has_cost"]]
 
     return {
         "year": year,
-        "total_cost": round(total_cost, 2),
-        "total_limit": round(total_limit, 2),
+        "total_cost": summary["total_cost"],
+        "total_limit": summary["limit"] if month_list_limit else 0,
         "month_costs": month_list_limit
     }
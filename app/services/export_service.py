@@ -0,0 +1,57 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import select
+from datetime import date
+from typing import Iterator
+import csv
+import io
+import json
+
+from ..models import expenditure_model
+from ..dependencies import get_settings
+
+EXPORT_COLUMNS = ("uuid", "date", "name", "place", "cost", "type")
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+def __iter_expenditure_batches(db: Session, user_id: int, date_from: date = None, date_to: date = None) -> Iterator[list]:
+    expenditure = expenditure_model.ExpenditureModel
+    query = select(*[getattr(expenditure, column) for column in EXPORT_COLUMNS]).where(expenditure.owner_id == user_id)
+
+    if date_from:
+        query = query.where(expenditure.date >= date_from)
+
+    if date_to:
+        query = query.where(expenditure.date <= date_to)
+
+    # plain rows from a server side cursor, only one batch is held in memory at a time
+    batchSize = get_settings().export_batch_size
+    result = db.execute(query.order_by(expenditure.date, expenditure.id).execution_options(yield_per=batchSize))
+
+    for rows in result.partitions():
+        yield [[value.value if isinstance(value, expenditure_model.ExpenditureTypes) else value for value in row] for row in rows]
+
+def iter_expenditures_csv(db: Session, user_id: int, date_from: date = None, date_to: date = None) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+
+    for rows in __iter_expenditure_batches(db, user_id, date_from=date_from, date_to=date_to):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+
+        yield buffer.getvalue()
+
+def iter_expenditures_ndjson(db: Session, user_id: int, date_from: date = None, date_to: date = None) -> Iterator[str]:
+    for rows in __iter_expenditure_batches(db, user_id, date_from=date_from, date_to=date_to):
+        yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str) + "\n" for row in rows)
+
+def iter_expenditures(db: Session, format: str, user_id: int, date_from: date = None, date_to: date = None) -> Iterator[str]:
+    if format == "ndjson":
+        return iter_expenditures_ndjson(db, user_id, date_from=date_from, date_to=date_to)
+
+    return iter_expenditures_csv(db, user_id, date_from=date_from, date_to=date_to)
@@ -1,20 +1,40 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import or_
 from uuid import uuid4
 from datetime import date
-from sqlalchemy import func
+from sqlalchemy import func, insert, update, delete, literal, union_all
 
-from ..models import expenditure_model
+from ..models import expenditure_model, tombstone_model
 from ..schemas import expenditure_schemas
+from . import expenditures_day_stat_service, pagination_service, recurrence_service, search_service, sync_service, version_service
 
 #expenditures
-def get_expenditures(db: Session, page: int = 1, limit: int = 100, search: str = None, date_from: date = None, date_to: date = None, user_id: int = None):
-    query = db.query(expenditure_model.ExpenditureModel)
+def get_expenditure_values(expenditure: expenditure_schemas.ExpenditureCreate, materialized_until: date = None) -> dict:
+    # the recurrence rule is stored in the recurrence_* columns, the expenditure itself is its first occurrence
+    values = expenditure.dict(exclude={"recurrence"})
+    recurrence = expenditure.recurrence
+
+    values["recurrence_unit"] = recurrence.unit if recurrence else None
+    values["recurrence_interval"] = recurrence.interval if recurrence else None
+    values["recurrence_end"] = recurrence.end_date if recurrence else None
+    values["materialized_until"] = max(materialized_until or expenditure.date, expenditure.date) if recurrence else None
+
+    return values
+
+def is_valid_recurrence(expenditure: expenditure_schemas.ExpenditureCreate) -> bool:
+    recurrence = expenditure.recurrence
 
-    query = query.order_by(expenditure_model.ExpenditureModel.date)
+    if recurrence is None:
+        return True
 
-    if search:
-        query = query.filter(or_(expenditure_model.ExpenditureModel.name.contains(search), expenditure_model.ExpenditureModel.place.contains(search)))
+    # only cyclical expenditures repeat, and not before they start
+    return expenditure.type == expenditure_model.ExpenditureTypes.cyclical and (recurrence.end_date is None or recurrence.end_date >= expenditure.date)
+
+def __get_expenditures_query(db: Session, search: str = None, date_from: date = None, date_to: date = None, user_id: int = None):
+    query = db.query(expenditure_model.ExpenditureModel)
+
+    query, rank = search_service.apply_expenditure_search(query, search)
 
     if date_from:
         query = query.filter(expenditure_model.ExpenditureModel.date >= date_from)
@@ -25,14 +45,107 @@ def get_expenditures(db: Session, page: int = 1, limit: int = 100, search: str =
     if user_id:
         query = query.filter(expenditure_model.ExpenditureModel.owner_id == user_id)
 
+    return query, rank
+
+# sparse fieldsets, plain column rows instead of ORM objects
+EXPENDITURE_FIELDS = ("uuid", "name", "type", "cost", "date", "place")
+EXPANDED_EXPENDITURE_FIELDS = EXPENDITURE_FIELDS + ("occurrence",)
+
+def __with_fields(query, fields: list):
+    model = expenditure_model.ExpenditureModel
+    # the (date, id) sort key is selected for the cursor
+    columns = [getattr(model, field) for field in fields] + [model.id]
+
+    if "date" not in fields:
+        columns.append(model.date)
+
+    return query.with_entities(*columns)
+
+# expanded listing, the stored expenditures and the occurrences of the recurrence rules
+def __get_expanded_query(db: Session, search: str = None, date_from: date = None, date_to: date = None, user_id: int = None):
+    model = expenditure_model.ExpenditureModel
+
+    query, rank = __get_expenditures_query(db, search=search, date_from=date_from, date_to=date_to, user_id=user_id)
+    # the rules are selected by the search and the user, their occurrences by the dates
+    rules = __get_expenditures_query(db, search=search, user_id=user_id)[0]
+
+    stored = query.with_entities(model.id, model.uuid, model.name, model.cost, model.date, model.place, model.type, model.owner_id,
+        model.recurrence_unit, model.recurrence_interval, model.recurrence_end, literal(False).label("occurrence")).order_by(None)
+    occurrences = recurrence_service.get_occurrences(db, rules, date_from=date_from, date_to=date_to)
+
+    # an occurrence never falls on the date of its rule, so (date, id) stays unique
+    expenditures = union_all(stored.statement, occurrences).subquery()
+
+    return db.query(expenditures).order_by(expenditures.c.date, expenditures.c.id), expenditures
+
+def __get_expanded_expenditures(rows, fields: list = None) -> list:
+    if fields:
+        return rows
+
+    expenditures = []
+
+    for row in rows:
+        values = dict(row._mapping)
+        values["recurrence"] = {"unit": row.recurrence_unit, "interval": row.recurrence_interval, "end_date": row.recurrence_end} if row.recurrence_unit else None
+
+        expenditures.append(expenditure_schemas.Expenditure(**values))
+
+    return expenditures
+
+def get_expanded_expenditures(db: Session, limit: int = 100, search: str = None, date_from: date = None, date_to: date = None, user_id: int = None, cursor: str = None, fields: list = None) -> tuple:
+    query, expenditures = __get_expanded_query(db, search=search, date_from=date_from, date_to=date_to, user_id=user_id)
+
+    after = pagination_service.decode_cursor(cursor, date.fromisoformat, int)
+    rows = pagination_service.apply_keyset(query, [expenditures.c.date, expenditures.c.id], after).limit(limit).all()
+
+    # the cursor is taken from the rows, the response has no ids
+    return __get_expanded_expenditures(rows, fields=fields), pagination_service.get_next_cursor(rows, limit, "date", "id")
+
+def get_expanded_expenditures_page(db: Session, page: int = 1, limit: int = 100, search: str = None, date_from: date = None, date_to: date = None, user_id: int = None, fields: list = None):
+    query, expenditures = __get_expanded_query(db, search=search, date_from=date_from, date_to=date_to, user_id=user_id)
+    rows, amount = pagination_service.get_page_with_total(query, page=page, limit=limit, as_rows=True)
+
+    return __get_expanded_expenditures(rows, fields=fields), amount
+
+def get_expenditures(db: Session, page: int = 1, limit: int = 100, search: str = None, date_from: date = None, date_to: date = None, user_id: int = None, cursor: str = None, fields: list = None):
+    query, rank = __get_expenditures_query(db, search=search, date_from=date_from, date_to=date_to, user_id=user_id)
+
+    if fields:
+        query = __with_fields(query, fields)
+
+    if cursor is not None:
+        # keyset pagination needs a stable (date, id) order, search results are not ranked in cursor mode
+        query = query.order_by(expenditure_model.ExpenditureModel.date, expenditure_model.ExpenditureModel.id)
+        after = pagination_service.decode_cursor(cursor, date.fromisoformat, int)
+        query = pagination_service.apply_keyset(query, [expenditure_model.ExpenditureModel.date, expenditure_model.ExpenditureModel.id], after)
+
+        return query.limit(limit).all()
+
+    if rank is not None:
+        query = query.order_by(rank)
+
+    query = query.order_by(expenditure_model.ExpenditureModel.date, expenditure_model.ExpenditureModel.id)
+
     return query.offset((page - 1) * limit).limit(limit).all()
 
+def get_expenditures_page(db: Session, page: int = 1, limit: int = 100, search: str = None, date_from: date = None, date_to: date = None, user_id: int = None, fields: list = None):
+    query, rank = __get_expenditures_query(db, search=search, date_from=date_from, date_to=date_to, user_id=user_id)
+
+    if fields:
+        query = __with_fields(query, fields)
+
+    if rank is not None:
+        query = query.order_by(rank)
+
+    query = query.order_by(expenditure_model.ExpenditureModel.date, expenditure_model.ExpenditureModel.id)
+
+    return pagination_service.get_page_with_total(query, page=page, limit=limit, as_rows=bool(fields))
+
 # do śmietnika
 def get_expenditures_filter_by_owner_id(db: Session, user_id: int, skip: int = 0, limit: int = 100, search: str = None, date_from: date = None, date_to: date = None):
     query = db.query(expenditure_model.ExpenditureModel).filter(expenditure_model.ExpenditureModel.owner_id== user_id)
 
-    if search:
-        query = query.filter(or_(expenditure_model.ExpenditureModel.name.contains(search), expenditure_model.ExpenditureModel.place.contains(search)))
+    query, rank = search_service.apply_expenditure_search(query, search)
 
     if date_from:
         query = query.filter(expenditure_model.ExpenditureModel.date >= date_from)
@@ -47,7 +160,19 @@ def get_expenditure(db: Session, uuid: str, user_id: int):# -> expenditureModel.
     return db.query(expenditure_model.ExpenditureModel).filter(expenditure_model.ExpenditureModel.uuid == uuid).first()
 
 def update_expenditure(db: Session, expenditureDb: expenditure_model.ExpenditureModel, expenditure: expenditure_schemas.ExpenditureCreate) -> bool:
-    db.query(expenditure_model.ExpenditureModel).filter(expenditure_model.ExpenditureModel.id == expenditureDb.id).update(expenditure.dict())
+    oldDate, oldCost = expenditureDb.date, expenditureDb.cost
+    versions = version_service.bump_data_versions(db, [expenditureDb.owner_id])
+
+    values = get_expenditure_values(expenditure, materialized_until=expenditureDb.materialized_until)
+    values["change_seq"] = versions[expenditureDb.owner_id]
+    db.query(expenditure_model.ExpenditureModel).filter(expenditure_model.ExpenditureModel.id == expenditureDb.id).update(values)
+
+    expenditures_day_stat_service.update_day_totals(db, user_id=expenditureDb.owner_id, day=expenditure.date)
+
+    if oldDate != expenditure.date:
+        # moved to another day
+        expenditures_day_stat_service.update_day_totals(db, user_id=expenditureDb.owner_id, day=oldDate)
+
     db.commit()
     db.refresh(expenditureDb)
 
@@ -55,10 +180,15 @@ def update_expenditure(db: Session, expenditureDb: expenditure_model.Expenditure
 
 def create_expenditure(db: Session, expenditure: expenditure_schemas.ExpenditureCreate, user_id: int):
     uuid = str(uuid4())
+    versions = version_service.bump_data_versions(db, [user_id])
 
-    db_expenditure = expenditure_model.ExpenditureModel(**expenditure.dict(), owner_id=user_id, uuid=uuid)
+    db_expenditure = expenditure_model.ExpenditureModel(**get_expenditure_values(expenditure), owner_id=user_id, uuid=uuid, change_seq=versions[user_id])
 
     db.add(db_expenditure)
+    db.flush()
+
+    expenditures_day_stat_service.update_day_totals(db, user_id=user_id, day=db_expenditure.date)
+
     db.commit()
     db.refresh(db_expenditure)
 
@@ -70,15 +200,79 @@ def delete_expenditre(db: Session, uuid: str) -> bool:
     if expenditure == None:
         return None
 
+    versions = version_service.bump_data_versions(db, [expenditure.owner_id])
+
     db.delete(expenditure)
+    db.flush()
+
+    expenditures_day_stat_service.update_day_totals(db, user_id=expenditure.owner_id, day=expenditure.date)
+    sync_service.add_tombstones(db, tombstone_model.TombstoneEntities.expenditure, [{"uuid": expenditure.uuid, "owner_id": expenditure.owner_id, "change_seq": versions[expenditure.owner_id]}])
+
     db.commit()
 
     return uuid
 
-def get_expenditure_amount(db: Session, user_id: int = None) -> int:
-    query = db.query(expenditure_model.ExpenditureModel)
+# batch
+def get_expenditures_by_uuids(db: Session, uuids: list) -> dict:
+    if not uuids:
+        return {}
+
+    expenditures = db.query(expenditure_model.ExpenditureModel).filter(expenditure_model.ExpenditureModel.uuid.in_(uuids)).all()
+
+    return {expenditure.uuid: expenditure for expenditure in expenditures}
+
+def apply_expenditures_batch(db: Session, operations: list, expendituresDb: dict, user_id: int) -> list:
+    # one executemany per operation type and one commit, the totals of every changed
+    # (owner, date) are updated once, in the same transaction
+    creates, updates, deletes, tombstones = [], [], [], []
+    days = set()
+    results = []
+    versions = version_service.bump_data_versions(db, [user_id, *[expenditureDb.owner_id for expenditureDb in expendituresDb.values()]])
+
+    for operation in operations:
+        if operation.op == expenditure_schemas.BatchOperationTypes.create:
+            uuid = str(uuid4())
+            creates.append({**get_expenditure_values(operation.expenditure), "owner_id": user_id, "uuid": uuid, "change_seq": versions[user_id]})
+            days.add((user_id, operation.expenditure.date))
+        else:
+            uuid = str(operation.uuid)
+            expenditureDb = expendituresDb[uuid]
+            days.add((expenditureDb.owner_id, expenditureDb.date))
+
+            if operation.op == expenditure_schemas.BatchOperationTypes.update:
+                updates.append({**get_expenditure_values(operation.expenditure, materialized_until=expenditureDb.materialized_until), "id": expenditureDb.id, "change_seq": versions[expenditureDb.owner_id]})
+                days.add((expenditureDb.owner_id, operation.expenditure.date))
+            else:
+                deletes.append(expenditureDb.id)
+                tombstones.append({"uuid": uuid, "owner_id": expenditureDb.owner_id, "change_seq": versions[expenditureDb.owner_id]})
+
+        results.append({"op": operation.op, "uuid": uuid})
+
+    if creates:
+        db.execute(insert(expenditure_model.ExpenditureModel), creates)
+    if updates:
+        db.execute(update(expenditure_model.ExpenditureModel), updates)
+    if deletes:
+        db.execute(delete(expenditure_model.ExpenditureModel).where(expenditure_model.ExpenditureModel.id.in_(deletes)).execution_options(synchronize_session=False))
+        sync_service.add_tombstones(db, tombstone_model.TombstoneEntities.expenditure, tombstones)
+
+    for owner_id, day in sorted(days):
+        expenditures_day_stat_service.update_day_totals(db, user_id=owner_id, day=day)
+
+    db.commit()
+
+    return results
+
+def get_expenditure_amount(db: Session, user_id: int = None, search: str = None, date_from: date = None, date_to: date = None) -> int:
+    query, rank = __get_expenditures_query(db, search=search, date_from=date_from, date_to=date_to)
 
     if user_id is not None:
         query = query.filter(expenditure_model.ExpenditureModel.owner_id == user_id) 
 
-    return query.with_entities(func.count()).scalar()
\ No newline at end of file
+    return query.with_entities(func.count()).scalar()
+
+# async
+# the async variants run the functions above on the AsyncSession's underlying connection,
+# so `async def` routes do not block the event loop while waiting on the database
+async def create_expenditure_async(db: AsyncSession, expenditure: expenditure_schemas.ExpenditureCreate, user_id: int):
+    return await db.run_sync(create_expenditure, expenditure, user_id)
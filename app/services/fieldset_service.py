@@ -0,0 +1,26 @@
+from datetime import date
+from enum import Enum
+
+from ..exceptions import http_exceptions
+
+# sparse fieldsets, `fields=uuid,date,cost` selects only these columns
+def parse_fields(fields: str, allowed: tuple) -> list:
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+
+    if not names or any(name not in allowed for name in names):
+        raise http_exceptions.validation_error
+
+    return list(dict.fromkeys(names))
+
+def __encode(value):
+    if isinstance(value, date):
+        return value.isoformat()
+
+    if isinstance(value, Enum):
+        return value.value
+
+    return value
+
+def get_sparse_data(rows: list, fields: list) -> list:
+    # the rows are serialized straight from the selected columns, without a response model
+    return [{field: __encode(row._mapping[field]) for field in fields} for row in rows]
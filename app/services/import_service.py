@@ -0,0 +1,126 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import insert
+from pydantic import ValidationError
+from uuid import uuid4
+from datetime import datetime
+from typing import Iterator, IO
+import csv
+import io
+import json
+import re
+
+from ..models import expenditure_model
+from ..schemas import expenditure_schemas
+from ..dependencies import get_settings
+from . import expenditures_day_stat_service, exposure_service, version_service
+
+IMPORT_FORMATS = ("csv", "ofx")
+
+# parsers, both yield (row number, raw row) and read the file line by line
+def iter_csv_rows(lines: Iterator[str]) -> Iterator[tuple]:
+    # the columns of the export, uuid is ignored and type defaults to normal
+    for rowNumber, row in enumerate(csv.DictReader(lines), start=2):
+        yield rowNumber, {
+            "name": row.get("name"),
+            "cost": row.get("cost"),
+            "date": row.get("date"),
+            "place": row.get("place"),
+            "type": row.get("type") or expenditure_model.ExpenditureTypes.normal,
+        }
+
+OFX_TAG = re.compile(r"<(/?[A-Z0-9.]+)>([^<\r\n]*)")
+
+def __get_ofx_row(transaction: dict) -> dict:
+    posted = transaction.get("DTPOSTED", "")[:8]
+    name = transaction.get("NAME") or transaction.get("MEMO")
+
+    return {
+        "name": name,
+        # debits are negative amounts
+        "cost": transaction.get("TRNAMT", "").replace(",", ".").lstrip("-") or None,
+        "date": datetime.strptime(posted, "%Y%m%d").date() if posted.isdigit() and len(posted) == 8 else posted,
+        "place": transaction.get("MEMO") or name,
+        "type": expenditure_model.ExpenditureTypes.normal,
+    }
+
+def __is_ofx_credit(transaction: dict) -> bool:
+    amount = transaction.get("TRNAMT", "")
+
+    return transaction.get("TRNTYPE") == "CREDIT" or bool(amount) and not amount.startswith("-")
+
+def iter_ofx_rows(lines: Iterator[str]) -> Iterator[tuple]:
+    # SGML (1.x) and XML (2.x) statements, transactions are <STMTTRN> aggregates
+    transaction = None
+    rowNumber = 0
+
+    for lineNumber, line in enumerate(lines, start=1):
+        for tag, value in OFX_TAG.findall(line):
+            if tag == "STMTTRN":
+                transaction = {}
+                rowNumber = lineNumber
+            elif tag == "/STMTTRN" and transaction is not None:
+                # incomes are not expenditures
+                if not __is_ofx_credit(transaction):
+                    yield rowNumber, __get_ofx_row(transaction)
+                transaction = None
+            elif transaction is not None and not tag.startswith("/"):
+                transaction[tag] = value.strip()
+
+def __iter_chunks(rows: Iterator[tuple], size: int) -> Iterator[list]:
+    chunk = []
+
+    for row in rows:
+        chunk.append(row)
+
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+def __get_errors(error: ValidationError) -> list:
+    return [{"field": ".".join(str(location) for location in detail["loc"]), "message": detail["msg"]} for detail in error.errors()]
+
+def import_expenditures(db: Session, file: IO[bytes], format: str, user_id: int) -> Iterator[str]:
+    lines = io.TextIOWrapper(file, encoding="utf-8-sig", errors="replace", newline="")
+    rows = iter_ofx_rows(lines) if format == "ofx" else iter_csv_rows(lines)
+
+    summary = {"rows": 0, "imported": 0, "failed": 0}
+    dateFrom = dateTo = None
+
+    # each chunk is validated, inserted with one executemany and committed, the progress
+    # and the invalid rows of the chunk are reported as one ndjson line
+    try:
+        for chunk in __iter_chunks(rows, get_settings().import_batch_size):
+            expenditures = []
+            errors = []
+
+            for rowNumber, row in chunk:
+                try:
+                    expenditure = expenditure_schemas.ExpenditureCreate.parse_obj(row)
+                except ValidationError as error:
+                    errors.append({"row": rowNumber, "errors": __get_errors(error)})
+                    continue
+
+                expenditures.append({**exposure_service.get_expenditure_values(expenditure), "owner_id": user_id, "uuid": str(uuid4())})
+                dateFrom = min(dateFrom or expenditure.date, expenditure.date)
+                dateTo = max(dateTo or expenditure.date, expenditure.date)
+
+            if expenditures:
+                changeSeq = version_service.bump_data_versions(db, [user_id])[user_id]
+                db.execute(insert(expenditure_model.ExpenditureModel), [{**expenditure, "change_seq": changeSeq} for expenditure in expenditures])
+                db.commit()
+
+            summary["rows"] += len(chunk)
+            summary["imported"] += len(expenditures)
+            summary["failed"] += len(errors)
+
+            yield json.dumps({**summary, "errors": errors}) + "\n"
+    finally:
+        # the day stats of the imported range are rebuilt once, also when the import stopped half way
+        if dateFrom is not None:
+            db.rollback()
+            expenditures_day_stat_service.rebuild_expenditures_day_stats(db, user_id=user_id, date_from=dateFrom, date_to=dateTo)
+
+    yield json.dumps({**summary, "done": True}) + "\n"
@@ -0,0 +1,133 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import date, datetime, timedelta
+from uuid import uuid4
+import json
+
+from ..models import job_model
+from ..dependencies import get_settings
+
+model = job_model.JobModel
+
+# durable jobs
+# enqueue_job does not commit, the job is stored in the transaction of the write that needs it
+def enqueue_job(db: Session, kind: str, owner_id: int = None, day: date = None, payload: dict = None) -> str:
+    uuid = str(uuid4())
+    values = {
+        "uuid": uuid,
+        "kind": kind,
+        "owner_id": owner_id,
+        "date": day,
+        "payload": json.dumps(payload, default=str) if payload is not None else None,
+        "status": job_model.JobStatus.pending,
+        "attempts": 0,
+        "run_at": datetime.utcnow(),
+        "created_at": datetime.utcnow(),
+    }
+    dialect = db.get_bind().dialect.name
+
+    if owner_id is not None and day is not None and dialect in ("sqlite", "postgresql"):
+        insert = sqlite_insert if dialect == "sqlite" else postgresql_insert
+        # a pending job for the same kind, user and day already covers this one
+        statement = insert(model).values(**values).on_conflict_do_nothing(
+            index_elements=[model.kind, model.owner_id, model.date],
+            index_where=model.status == job_model.JobStatus.pending,
+        )
+
+        db.execute(statement)
+    else:
+        db.add(model(**values))
+        db.flush()
+
+    return uuid
+
+def get_job(db: Session, uuid: str):
+    return db.query(model).filter(model.uuid == uuid).first()
+
+def get_job_payload(job: job_model.JobModel) -> dict:
+    if not job.payload:
+        return {}
+
+    return json.loads(job.payload)
+
+# a worker losing the claim of a job to another one tries the next job, up to this many times, before it sleeps
+CLAIM_RETRIES = 3
+
+def claim_job(db: Session):
+    now = datetime.utcnow()
+    lostClaims = 0
+
+    while lostClaims <= CLAIM_RETRIES:
+        job = db.query(model).filter(or_(
+            and_(model.status == job_model.JobStatus.pending, model.run_at <= now),
+            and_(model.status == job_model.JobStatus.running, model.locked_until < now),
+        )).order_by(model.run_at, model.id).first()
+
+        if job is None:
+            return None
+
+        # only one worker wins the update, the others see the changed status or attempts
+        claimedJob = db.query(model).filter(model.id == job.id).filter(model.status == job.status).filter(model.attempts == job.attempts)
+
+        # a job outliving its lease on its last attempt is dead lettered instead of being run again,
+        # its worker may still be running it
+        if job.status == job_model.JobStatus.running and job.attempts >= get_settings().job_max_attempts:
+            claimedJob.update({"status": job_model.JobStatus.dead, "locked_until": None, "last_error": "Lease expired"}, synchronize_session=False)
+            db.commit()
+
+            continue
+
+        claimed = claimedJob.update({
+            "status": job_model.JobStatus.running,
+            "attempts": job.attempts + 1,
+            "locked_until": now + timedelta(seconds=get_settings().job_lease_seconds),
+        }, synchronize_session=False)
+        db.commit()
+
+        if claimed:
+            db.refresh(job)
+
+            return job
+
+        lostClaims += 1
+
+    return None
+
+# the attempt that claimed the job, a worker whose lease expired and was reclaimed changes nothing
+def __get_claimed_job_query(db: Session, job: job_model.JobModel):
+    return db.query(model).filter(model.id == job.id).filter(model.status == job_model.JobStatus.running).filter(model.attempts == job.attempts)
+
+def complete_job(db: Session, job: job_model.JobModel):
+    __get_claimed_job_query(db, job).delete(synchronize_session=False)
+    db.commit()
+
+def fail_job(db: Session, job: job_model.JobModel, error: str):
+    query = __get_claimed_job_query(db, job)
+
+    if job.attempts >= get_settings().job_max_attempts:
+        query.update({"status": job_model.JobStatus.dead, "locked_until": None, "last_error": error}, synchronize_session=False)
+        db.commit()
+
+        return
+
+    coalesced = job.owner_id is not None and job.date is not None and db.query(model.id)\
+        .filter(model.kind == job.kind).filter(model.owner_id == job.owner_id).filter(model.date == job.date)\
+        .filter(model.status == job_model.JobStatus.pending).first() is not None
+
+    if coalesced:
+        # a newer pending job for the same day will redo the work
+        query.delete(synchronize_session=False)
+    else:
+        # exponential backoff: backoff, 2 * backoff, 4 * backoff, ...
+        delay = get_settings().job_retry_backoff_seconds * 2 ** (job.attempts - 1)
+
+        query.update({
+            "status": job_model.JobStatus.pending,
+            "run_at": datetime.utcnow() + timedelta(seconds=delay),
+            "locked_until": None,
+            "last_error": error,
+        }, synchronize_session=False)
+
+    db.commit()
@@ -1,26 +1,42 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import or_
 from uuid import uuid4
 from datetime import date
 from sqlalchemy import func
 
-from ..models import limits_model
+from ..models import limits_model, tombstone_model
 from ..schemas import limit_schemas
+from . import pagination_service, sync_service, version_service
 
 #expenditures
-def get_limits(db: Session, page: int = 1, limit: int = 100, search: str = None, year: int = None, user_id: int = None):
+def __get_limits_query(db: Session, year: int = None, user_id: int = None):
     query = db.query(limits_model.LimitModel)
 
-    query = query.order_by(limits_model.LimitModel.year).order_by(limits_model.LimitModel.month)
-
     if year:
         query = query.filter(limits_model.LimitModel.year == year)
 
     if user_id:
         query = query.filter(limits_model.LimitModel.owner_id == user_id)
 
+    return query.order_by(limits_model.LimitModel.year).order_by(limits_model.LimitModel.month).order_by(limits_model.LimitModel.id)
+
+def get_limits(db: Session, page: int = 1, limit: int = 100, search: str = None, year: int = None, user_id: int = None, cursor: str = None):
+    query = __get_limits_query(db, year=year, user_id=user_id)
+
+    if cursor is not None:
+        after = pagination_service.decode_cursor(cursor, int, int, int)
+        query = pagination_service.apply_keyset(query, [limits_model.LimitModel.year, limits_model.LimitModel.month, limits_model.LimitModel.id], after)
+
+        return query.limit(limit).all()
+
     return query.offset((page - 1) * limit).limit(limit).all()
 
+def get_limits_page(db: Session, page: int = 1, limit: int = 100, search: str = None, year: int = None, user_id: int = None):
+    query = __get_limits_query(db, year=year, user_id=user_id)
+
+    return pagination_service.get_page_with_total(query, page=page, limit=limit)
+
 # dodać zwracane typy
 def get_limit_by_uuid(db: Session, uuid: str, user_id: int):# -> limitsModel.LimitModel:
     return db.query(limits_model.LimitModel).filter(limits_model.LimitModel.uuid == uuid).filter(limits_model.LimitModel.owner_id == user_id).first()
@@ -29,10 +45,11 @@ def get_limit_by_id(db: Session, id: int, user_id: int):# -> limitsModel.LimitMo
     return db.query(limits_model.LimitModel).filter(limits_model.LimitModel.id == id).filter(limits_model.LimitModel.owner_id == user_id).first() 
 
 def get_limit_by_month_and_year(db: Session, user_id: int, year: int, month: int):# -> limitsModel.LimitModel:
-    return db.query(limits_model.LimitModel).filter(limits_model.LimitModel.year == year).filter(limits_model.LimitModel.month == month).first() 
+    return db.query(limits_model.LimitModel).filter(limits_model.LimitModel.owner_id == user_id).filter(limits_model.LimitModel.year == year).filter(limits_model.LimitModel.month == month).first() 
 
 def update_limit(db: Session, limitDb: limits_model.LimitModel, limit: limit_schemas.LimitCreate) -> bool:
-    db.query(limits_model.LimitModel).filter(limits_model.LimitModel.id == limitDb.id).update(limit.dict())
+    versions = version_service.bump_data_versions(db, [limitDb.owner_id])
+    db.query(limits_model.LimitModel).filter(limits_model.LimitModel.id == limitDb.id).update({**limit.dict(), "change_seq": versions[limitDb.owner_id]})
     db.commit()
     db.refresh(limitDb)
 
@@ -41,7 +58,9 @@ def update_limit(db: Session, limitDb: limits_model.LimitModel, limit: limit_sch
 def create_limit(db: Session, limit: limit_schemas.LimitCreate, user_id: int):
     uuid = str(uuid4())
 
-    db_limit = limits_model.LimitModel(**limit.dict(), owner_id=user_id, uuid=uuid)
+    versions = version_service.bump_data_versions(db, [user_id])
+
+    db_limit = limits_model.LimitModel(**limit.dict(), owner_id=user_id, uuid=uuid, change_seq=versions[user_id])
 
     db.add(db_limit)
     db.commit()
@@ -55,15 +74,28 @@ def delete_limit(db: Session, uuid: str) -> bool:
     if limit == None:
         return None
 
+    versions = version_service.bump_data_versions(db, [limit.owner_id])
+
     db.delete(limit)
+    sync_service.add_tombstones(db, tombstone_model.TombstoneEntities.limit, [{"uuid": limit.uuid, "owner_id": limit.owner_id, "change_seq": versions[limit.owner_id]}])
     db.commit()
 
     return uuid
 
-def get_limits_amount(db: Session, user_id: int = None) -> int:
-    query = db.query(limits_model.LimitModel)
+def get_limits_amount(db: Session, user_id: int = None, year: int = None) -> int:
+    query = __get_limits_query(db, year=year).order_by(None)
 
     if user_id is not None:
         query = query.filter(limits_model.LimitModel.owner_id == user_id) 
 
-    return query.with_entities(func.count()).scalar()
\ No newline at end of file
+    return query.with_entities(func.count()).scalar()
+
+# async
+async def get_limit_by_month_and_year_async(db: AsyncSession, user_id: int, year: int, month: int):
+    return await db.run_sync(get_limit_by_month_and_year, user_id, year, month)
+
+async def create_limit_async(db: AsyncSession, limit: limit_schemas.LimitCreate, user_id: int):
+    return await db.run_sync(create_limit, limit, user_id)
+
+async def update_limit_async(db: AsyncSession, limitDb: limits_model.LimitModel, limit: limit_schemas.LimitCreate):
+    return await db.run_sync(update_limit, limitDb, limit)
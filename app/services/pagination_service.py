@@ -0,0 +1,87 @@
+from typing import Union, Callable
+from sqlalchemy import tuple_, func
+import base64
+import json
+import threading
+import time
+
+from ..exceptions import http_exceptions
+from ..dependencies import get_settings
+
+# keyset (cursor) pagination
+# the cursor is an opaque, url safe encoding of the sort key of the last row of the previous page
+def encode_cursor(*values) -> str:
+    raw = json.dumps(values, default=str, separators=(",", ":"))
+
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types) -> Union[list, None]:
+    # an empty cursor starts the listing from the first row
+    if not cursor:
+        return None
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError()
+
+        return [cast(value) for cast, value in zip(types, values)]
+    except (ValueError, TypeError):
+        raise http_exceptions.invalid_cursor_error
+
+def apply_keyset(query, columns: list, values: Union[list, None], descending: bool = False):
+    if values is None:
+        return query
+
+    if descending:
+        return query.filter(tuple_(*columns) < tuple_(*values))
+
+    return query.filter(tuple_(*columns) > tuple_(*values))
+
+def get_next_cursor(items: list, limit: int, *attributes) -> Union[str, None]:
+    if len(items) < limit:
+        return None
+
+    last = items[-1]
+
+    return encode_cursor(*[getattr(last, attribute) for attribute in attributes])
+
+# page with total
+def get_page_with_total(query, page: int, limit: int, as_rows: bool = False) -> tuple:
+    # the window count is evaluated over the whole filtered result before LIMIT/OFFSET,
+    # so the page and the total come back in a single round trip
+    rows = query.add_columns(func.count().over().label("total_count")).offset((page - 1) * limit).limit(limit).all()
+
+    if rows:
+        return rows if as_rows else [row[0] for row in rows], rows[0].total_count
+
+    # past the last page there is no row to carry the window count
+    if as_rows:
+        return [], query.order_by(None).count()
+
+    return [], query.order_by(None).with_entities(func.count()).scalar()
+
+# approximate totals
+__total_cache = {}
+__total_cache_lock = threading.Lock()
+
+def get_cached_total(key: tuple, count: Callable[[], int]) -> int:
+    now = time.monotonic()
+
+    with __total_cache_lock:
+        cached = __total_cache.get(key)
+
+    if cached is not None and cached[1] > now:
+        return cached[0]
+
+    total = count()
+
+    with __total_cache_lock:
+        if len(__total_cache) >= get_settings().count_cache_size:
+            __total_cache.clear()
+
+        __total_cache[key] = (total, now + get_settings().count_cache_ttl_seconds)
+
+    return total
@@ -0,0 +1,151 @@
+from sqlalchemy.orm import Session, Query
+from sqlalchemy import and_, case, cast, extract, func, insert, literal, select, type_coerce, update, Date, Integer, String
+from uuid import uuid4
+from datetime import date
+
+from ..models import expenditure_model
+from . import expenditures_day_stat_service, version_service
+
+model = expenditure_model.ExpenditureModel
+units = expenditure_model.RecurrenceUnits
+
+# date arithmetic, on sqlite dates are text and computed with date()
+def __add_days(db: Session, column, days):
+    if db.get_bind().dialect.name == "sqlite":
+        return func.date(column, "+" + cast(days, String) + " days")
+
+    return column + days
+
+def __add_months(db: Session, column, months):
+    if db.get_bind().dialect.name == "sqlite":
+        # the day is clamped to the end of shorter months like on postgresql, jan 31 + 1 month is feb 28/29
+        day = cast(func.strftime("%d", column), Integer)
+        sameDay = func.date(column, "start of month", "+" + cast(months, String) + " months", "+" + cast(day - 1, String) + " days")
+        lastDay = func.date(column, "start of month", "+" + cast(months + 1, String) + " months", "-1 day")
+
+        return func.min(sameDay, lastDay)
+
+    return cast(column + func.make_interval(0, months), Date)
+
+def __days_between(db: Session, start, end):
+    if db.get_bind().dialect.name == "sqlite":
+        return cast(func.julianday(end) - func.julianday(start), Integer)
+
+    return end - start
+
+def __get_occurrence_date(db: Session, start, unit, interval, k):
+    # the k-th occurrence is computed from the start, so clamped month ends do not drift
+    return type_coerce(case(
+        (unit == units.month, __add_months(db, start, interval * k)),
+        (unit == units.week, __add_days(db, start, interval * k * 7)),
+        else_=__add_days(db, start, interval * k),
+    ), Date)
+
+def __get_first_step(db: Session, start, unit, interval, date_from):
+    # the last occurrence on or before date_from, the recursion starts there instead of at the first occurrence
+    months = (cast(extract("year", date_from), Integer) - cast(extract("year", start), Integer)) * 12 \
+        + cast(extract("month", date_from), Integer) - cast(extract("month", start), Integer)
+    step = case(
+        (unit == units.month, months // interval),
+        (unit == units.week, __days_between(db, start, date_from) // (interval * 7)),
+        else_=__days_between(db, start, date_from) // interval,
+    )
+
+    return case((step < 1, 1), else_=step)
+
+def get_occurrences(db: Session, rules: Query, date_from: date = None, date_to: date = None):
+    # occurrences of the recurrence rules selected by `rules` (a query on ExpenditureModel), expanded by a
+    # recursive CTE. Only the occurrences after materialized_until are expanded, the rule row itself and
+    # the materialized occurrences are stored rows. Open ended rules are expanded up to today
+    if date_to is None:
+        date_to = date.today()
+
+    bound = case((and_(model.recurrence_end.isnot(None), model.recurrence_end < date_to), model.recurrence_end), else_=literal(date_to, Date))
+    start = model.materialized_until if date_from is None else \
+        case((model.materialized_until > date_from, model.materialized_until), else_=literal(date_from, Date))
+
+    ruleRows = rules.filter(model.recurrence_unit.isnot(None)).filter(model.date <= date_to).with_entities(
+        model.id.label("id"),
+        model.date.label("start"),
+        model.recurrence_unit,
+        model.recurrence_interval,
+        bound.label("bound"),
+        __get_first_step(db, model.date, model.recurrence_unit, model.recurrence_interval, start).label("k"),
+    ).order_by(None).subquery()
+
+    anchor = select(
+        *ruleRows.c,
+        __get_occurrence_date(db, ruleRows.c.start, ruleRows.c.recurrence_unit, ruleRows.c.recurrence_interval, ruleRows.c.k).label("date"),
+    ).cte("occurrences", recursive=True)
+
+    steps = anchor.union_all(select(
+        anchor.c.id,
+        anchor.c.start,
+        anchor.c.recurrence_unit,
+        anchor.c.recurrence_interval,
+        anchor.c.bound,
+        anchor.c.k + 1,
+        __get_occurrence_date(db, anchor.c.start, anchor.c.recurrence_unit, anchor.c.recurrence_interval, anchor.c.k + 1),
+    ).where(anchor.c.date <= anchor.c.bound))
+
+    query = select(
+        model.id,
+        model.uuid,
+        model.name,
+        model.cost,
+        steps.c.date.label("date"),
+        model.place,
+        model.type,
+        model.owner_id,
+        model.recurrence_unit,
+        model.recurrence_interval,
+        model.recurrence_end,
+        literal(True).label("occurrence"),
+    ).join_from(steps, model, model.id == steps.c.id)\
+        .where(steps.c.date > model.materialized_until)\
+        .where(steps.c.date <= steps.c.bound)
+
+    if date_from:
+        query = query.where(steps.c.date >= date_from)
+
+    return query
+
+def get_user_occurrences(db: Session, user_id: int, date_from: date = None, date_to: date = None):
+    return get_occurrences(db, db.query(model).filter(model.owner_id == user_id), date_from=date_from, date_to=date_to)
+
+# materialization
+def materialize_occurrences(db: Session, user_id: int = None, until: date = None) -> int:
+    # the expanded occurrences up to `until` become stored expenditures, with their day stats,
+    # and the rules are marked as materialized up to that day, all in one transaction
+    if until is None:
+        until = date.today()
+
+    rules = db.query(model)
+    if user_id is not None:
+        rules = rules.filter(model.owner_id == user_id)
+
+    occurrences = get_occurrences(db, rules, date_to=until).subquery()
+    rows = db.execute(select(occurrences.c.name, occurrences.c.cost, occurrences.c.date, occurrences.c.place, occurrences.c.type, occurrences.c.owner_id)).all()
+
+    versions = version_service.bump_data_versions(db, [row.owner_id for row in rows])
+
+    days = set()
+    expenditures = []
+    for row in rows:
+        expenditures.append({"name": row.name, "cost": row.cost, "date": row.date, "place": row.place, "type": row.type, "owner_id": row.owner_id, "uuid": str(uuid4()), "change_seq": versions[row.owner_id]})
+        days.add((row.owner_id, row.date))
+
+    if expenditures:
+        db.execute(insert(model), expenditures)
+
+    for owner_id, day in sorted(days):
+        expenditures_day_stat_service.update_day_totals(db, user_id=owner_id, day=day)
+
+    statement = update(model).where(model.recurrence_unit.isnot(None)).where(model.materialized_until < until).values(materialized_until=until)
+    if user_id is not None:
+        statement = statement.where(model.owner_id == user_id)
+
+    db.execute(statement.execution_options(synchronize_session=False))
+    db.commit()
+
+    return len(expenditures)
@@ -0,0 +1,53 @@
+from sqlalchemy import Float, Integer, String, column, func, literal_column, or_, select, table
+import re
+
+from ..models import expenditure_model
+
+expenditures_fts = table("expenditures_fts", column("rowid", Integer), column("rank", Float), column("expenditures_fts", String))
+
+# the indexed document on postgresql. An expression index is only used when the query repeats its expression
+# exactly, so this is written with literals, bound parameters would not match. It has to stay identical to
+# ix_expenditures_search in alembic/versions/0003_expenditures_search.py:
+# to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(place, ''))
+POSTGRESQL_DOCUMENT = func.to_tsvector(
+    literal_column("'simple'"),
+    func.coalesce(expenditure_model.ExpenditureModel.name, literal_column("''")) + literal_column("' '") + func.coalesce(expenditure_model.ExpenditureModel.place, literal_column("''")),
+)
+
+def get_search_terms(search: str) -> list:
+    # only word characters reach the full text query, so user input cannot inject query syntax
+    return re.findall(r"\w+", search or "")
+
+# filters expenditures by name and place with prefix matching, returns the query and
+# the rank to order by (best match first), rank is None when there is no full text index
+def apply_expenditure_search(query, search: str):
+    terms = get_search_terms(search)
+
+    if not terms:
+        return query, None
+
+    dialect = query.session.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        match = " ".join('"' + term + '"*' for term in terms)
+        matches = select(expenditures_fts.c.rowid, expenditures_fts.c.rank)\
+            .where(expenditures_fts.c.expenditures_fts.op("MATCH")(match))\
+            .subquery()
+
+        query = query.join(matches, matches.c.rowid == expenditure_model.ExpenditureModel.id)
+
+        # fts5 rank is bm25, lower is better
+        return query, matches.c.rank
+
+    if dialect == "postgresql":
+        document = POSTGRESQL_DOCUMENT
+        match = func.to_tsquery(literal_column("'simple'"), " & ".join(term + ":*" for term in terms))
+
+        query = query.filter(document.op("@@")(match))
+
+        return query, -func.ts_rank(document, match)
+
+    for term in terms:
+        query = query.filter(or_(expenditure_model.ExpenditureModel.name.contains(term), expenditure_model.ExpenditureModel.place.contains(term)))
+
+    return query, None
@@ -0,0 +1,61 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import insert, literal, select, union_all
+
+from ..models import expenditure_model, expenditures_day_stat_model, limits_model, tombstone_model
+from ..exceptions import http_exceptions
+from . import version_service
+
+tombstone = tombstone_model.TombstoneModel
+entities = tombstone_model.TombstoneEntities
+
+CHANGED_MODELS = {
+    "expenditures": expenditure_model.ExpenditureModel,
+    "limits": limits_model.LimitModel,
+    "expenditures_day_stats": expenditures_day_stat_model.ExpendituresDayStat,
+}
+
+# tombstones, written in the transaction of the deletion
+def add_tombstones(db: Session, entity: str, rows: list):
+    # rows of uuid, owner_id and change_seq
+    if rows:
+        db.execute(insert(tombstone), [{**row, "entity": entity} for row in rows])
+
+def add_tombstones_from_select(db: Session, entity: str, query):
+    # query of uuid, owner_id and change_seq, run before the delete of the same rows
+    db.execute(insert(tombstone).from_select([tombstone.entity, tombstone.uuid, tombstone.owner_id, tombstone.change_seq], select(
+        literal(entity), *query.subquery().c
+    )))
+
+def __filter_changes(query, model, user_id: int, since: int, until: int):
+    query = query.where(model.owner_id == user_id).where(model.change_seq <= until)
+
+    if since is not None:
+        query = query.where(model.change_seq > since)
+
+    return query
+
+def get_changes(db: Session, user_id: int, since: int = None, limit: int = 1000) -> dict:
+    # the rows written and deleted after the `since` data version, without `since` every row (a first sync).
+    # A page ends at a data version, so a write is never split between pages, and the version it ends at
+    # is the cursor of the next page. Writes committed after the version was read are left to the next sync
+    version = version_service.get_data_version(db, user_id)
+
+    if since is not None and (since < 0 or since > version):
+        raise http_exceptions.invalid_cursor_error
+
+    models = [*CHANGED_MODELS.values()] if since is None else [*CHANGED_MODELS.values(), tombstone]
+    seqs = union_all(*[__filter_changes(select(model.change_seq), model, user_id, since, version) for model in models]).subquery()
+    until = db.execute(select(seqs.c.change_seq).order_by(seqs.c.change_seq).offset(limit - 1).limit(1)).scalar()
+
+    if until is None:
+        until = version
+
+    changes = {}
+    for name, model in CHANGED_MODELS.items():
+        changes[name] = db.execute(__filter_changes(select(model), model, user_id, since, until).order_by(model.change_seq, model.id)).scalars().all()
+
+    # deletions only matter to a client that synced before
+    changes["deleted"] = [] if since is None else \
+        db.execute(__filter_changes(select(tombstone), tombstone, user_id, since, until).order_by(tombstone.change_seq, tombstone.id)).scalars().all()
+
+    return {**changes, "next_cursor": until, "has_more": until < version}
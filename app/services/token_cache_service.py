@@ -0,0 +1,71 @@
+from collections import OrderedDict
+from typing import Hashable, Union
+from jose import jwt, JWTError
+import threading
+import time
+
+from ..models import user_model
+from ..schemas import user_schemas
+from ..dependencies import get_settings
+
+# process wide user snapshot cache, so authenticated requests do not have to look the user up
+# keyed by token (stored tokens) or by user id (stateless tokens, see auth_service.decode_token)
+# entries live until they expire or token_cache_ttl_seconds pass, whichever comes first,
+# and are dropped as soon as the user's token, password or account changes in this process
+__token_cache = OrderedDict()
+__token_cache_lock = threading.Lock()
+
+def get_token_expire(token: str) -> Union[float, None]:
+    # the signature is checked elsewhere, here the exp claim only bounds the cache entry
+    try:
+        expire = jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        return None
+
+    if not isinstance(expire, (int, float)):
+        return None
+
+    return float(expire)
+
+def get_user(key: Hashable) -> Union[user_schemas.UserSnapshot, None]:
+    now = time.time()
+
+    with __token_cache_lock:
+        cached = __token_cache.get(key)
+
+        if cached is None:
+            return None
+
+        if cached[1] <= now:
+            del __token_cache[key]
+
+            return None
+
+        __token_cache.move_to_end(key)
+
+    return cached[0]
+
+def set_user(key: Hashable, user: user_model.UserModel, expire: Union[float, None] = None) -> user_schemas.UserSnapshot:
+    snapshot = user_schemas.UserSnapshot.from_orm(user)
+    ttl_expire = time.time() + get_settings().token_cache_ttl_seconds
+
+    if expire is None or expire > ttl_expire:
+        expire = ttl_expire
+
+    with __token_cache_lock:
+        __token_cache[key] = (snapshot, expire)
+        __token_cache.move_to_end(key)
+
+        while len(__token_cache) > get_settings().token_cache_size:
+            __token_cache.popitem(last=False)
+
+    return snapshot
+
+def invalidate_user(user_id: int):
+    with __token_cache_lock:
+        for key in [key for key, cached in __token_cache.items() if cached[0].id == user_id]:
+            del __token_cache[key]
+
+def clear():
+    with __token_cache_lock:
+        __token_cache.clear()
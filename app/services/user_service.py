@@ -1,4 +1,5 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import uuid4
 from fastapi import HTTPException, status
 from jose import jwt
@@ -7,12 +8,16 @@ from sqlalchemy import func, desc
 from ..models import user_model
 from ..schemas import user_schemas
 from ..dependencies import get_settings
+from . import pagination_service, token_cache_service
 
 from . import auth_service
 
 def get_user(db: Session, uuid: str):
     return db.query(user_model.UserModel).filter(user_model.UserModel.uuid == uuid).first()
     
+def get_user_by_id(db: Session, id: int):
+    return db.query(user_model.UserModel).filter(user_model.UserModel.id == id).first()
+
 def get_user_by_name(db: Session, name: str):
     return db.query(user_model.UserModel).filter(user_model.UserModel.name == name).first()
 
@@ -23,18 +28,37 @@ def get_user_by_token(db: Session, token: str):
     return db.query(user_model.UserModel).filter(user_model.UserModel.token == token).first()
 
 
-def get_users(db: Session, page: int = 1, limit: int = 100, search: str = None):
+def __get_users_query(db: Session, search: str = None):
     query = db.query(user_model.UserModel)
 
-    query = query.order_by(desc(user_model.UserModel.email))
-
     if search:
         query = query.filter(user_model.UserModel.email.contains(search))
 
+    return query
+
+def get_users(db: Session, page: int = 1, limit: int = 100, search: str = None, cursor: str = None):
+    query = __get_users_query(db, search=search)
+
+    query = query.order_by(desc(user_model.UserModel.email), desc(user_model.UserModel.id))
+
+    if cursor is not None:
+        after = pagination_service.decode_cursor(cursor, str, int)
+        query = pagination_service.apply_keyset(query, [user_model.UserModel.email, user_model.UserModel.id], after, descending=True)
+
+        return query.limit(limit).all()
+
     return query.offset((page - 1) * limit).limit(limit).all()
 
-def create_user(db: Session, user: user_schemas.User):
-    hashed_password = auth_service.get_hashed_password(user.password)
+def get_users_page(db: Session, page: int = 1, limit: int = 100, search: str = None):
+    query = __get_users_query(db, search=search)
+
+    query = query.order_by(desc(user_model.UserModel.email), desc(user_model.UserModel.id))
+
+    return pagination_service.get_page_with_total(query, page=page, limit=limit)
+
+def create_user(db: Session, user: user_schemas.User, hashed_password: str = None):
+    if hashed_password is None:
+        hashed_password = auth_service.get_hashed_password(user.password)
     user_uuid = str(uuid4())
     
     db_user = user_model.UserModel(email=user.email, password=hashed_password, uuid=user_uuid)
@@ -43,27 +67,30 @@ def create_user(db: Session, user: user_schemas.User):
     db.commit()
     db.refresh(db_user)
     
-    db.query(user_model.UserModel).filter(user_model.UserModel.id == db_user.id).update({"token": auth_service.generate_user_token(db=db, user=db_user)})
-
-    db.commit()
-    db.refresh(db_user)
+    # generate_user_token stores the token, stateless tokens are not stored and the user logs in for one
+    auth_service.generate_user_token(db=db, user=db_user)
 
     return db_user
 
-def change_user_password(db:Session, user: user_schemas.User, new_password: str):
-    hashed_password = auth_service.get_hashed_password(new_password)
-    db.query(user_model.UserModel).filter(user_model.UserModel.id == user.id).update({"password": hashed_password})
+def change_user_password(db:Session, user: user_schemas.User, new_password: str, hashed_password: str = None):
+    if hashed_password is None:
+        hashed_password = auth_service.get_hashed_password(new_password)
+    db.query(user_model.UserModel).filter(user_model.UserModel.id == user.id).update({"password": hashed_password, "token_version": user_model.UserModel.token_version + 1})
 
     db.commit()
     db.refresh(user)
 
+    token_cache_service.invalidate_user(user.id)
+
     return user
 
 def remove_user_token(db:Session, user: user_schemas.User):
-    db.query(user_model.UserModel).filter(user_model.UserModel.id == user.id).update({"token": None})
+    db.query(user_model.UserModel).filter(user_model.UserModel.id == user.id).update({"token": None, "token_version": user_model.UserModel.token_version + 1})
 
     db.commit()
 
+    token_cache_service.invalidate_user(user.id)
+
     return user
 
 def delete_user(db: Session, uuid: str):
@@ -75,6 +102,8 @@ def delete_user(db: Session, uuid: str):
     db.delete(user)
     db.commit()
 
+    token_cache_service.invalidate_user(user.id)
+
     return None
 
 def get_current_user(db: Session, token: str):
@@ -102,7 +131,7 @@ def get_current_user(db: Session, token: str):
     except:
         raise credentials_exception
 
-    user = auth_service.decode_token(db=db, token=token)
+    user = auth_service.decode_token(db=db, token=token, payload=payload)
 
     if user:
         user = auth_service.check_is_user_active(user=user)
@@ -124,7 +153,18 @@ def send_password_reset_email(email: str):
 
     return True
 
-def get_users_amount(db: Session) -> int:
-    query = db.query(user_model.UserModel)
+def get_users_amount(db: Session, search: str = None) -> int:
+    query = __get_users_query(db, search=search)
+
+    return query.with_entities(func.count()).scalar()
+
+# async
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    return await db.run_sync(get_user_by_email, email)
+
+# hash the password with auth_service.get_hashed_password_async before, not on the event loop
+async def create_user_async(db: AsyncSession, user: user_schemas.User, hashed_password: str):
+    return await db.run_sync(create_user, user, hashed_password)
 
-    return query.with_entities(func.count()).scalar()
\ No newline at end of file
+async def change_user_password_async(db: AsyncSession, user: user_schemas.User, new_password: str, hashed_password: str):
+    return await db.run_sync(change_user_password, user, new_password, hashed_password)
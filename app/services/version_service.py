@@ -0,0 +1,75 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from fastapi import Depends, HTTPException, Request, status
+from datetime import date
+import hashlib
+
+from ..models import user_model
+from ..dependencies import get_db
+from . import auth_service
+
+model = user_model.UserModel
+
+# data versions, bumped in the transaction of every write of the user's expenditures, limits and day stats,
+# before the rows are written. The written rows are stamped with the new version as their change_seq, the
+# bump locks the user row until the commit so the versions of a user are committed in order
+def bump_data_versions(db: Session, user_ids) -> dict:
+    user_ids = set(user_ids)
+
+    if not user_ids:
+        return {}
+
+    statement = update(model).where(model.id.in_(user_ids)).values(data_version=model.data_version + 1)
+    db.execute(statement.execution_options(synchronize_session=False))
+
+    return dict(db.execute(select(model.id, model.data_version).where(model.id.in_(user_ids))).all())
+
+# the current data version of the owner (an id or an owner_id column) in sql, for rows written by the database itself
+def get_change_seq(owner_id):
+    return select(model.data_version).where(model.id == owner_id).scalar_subquery()
+
+def get_data_version(db: Session, user_id: int) -> int:
+    return db.query(model.data_version).filter(model.id == user_id).scalar()
+
+# etags
+def get_etag(request: Request, user_id: int, version: int) -> str:
+    # the url with its query and the day are hashed in, the expanded occurrences and the current year depend on the day
+    key = "|".join([str(user_id), request.url.path, str(sorted(request.query_params.multi_items())), date.today().isoformat()])
+
+    return 'W/"' + str(version) + "-" + hashlib.sha1(key.encode()).hexdigest()[:16] + '"'
+
+def __strip_weak(tag: str) -> str:
+    tag = tag.strip()
+
+    return tag[2:] if tag.startswith("W/") else tag
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+
+    # weak comparison, the same data is the same response whatever its encoding
+    return __strip_weak(etag) in [__strip_weak(tag) for tag in header.split(",")]
+
+def __check_version(db: Session, request: Request, user_id: int):
+    etag = get_etag(request, user_id, get_data_version(db, user_id))
+
+    if is_not_modified(request, etag):
+        raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    # the etag header is put on the response by the middleware in main
+    request.state.etag = etag
+
+# request dependencies of the read routes, a matching If-None-Match is answered with 304
+# from the user's data version without reading the data tables
+def check_user_version(request: Request, loggedUser = Depends(auth_service.get_current_active_user), db: Session = Depends(get_db)):
+    __check_version(db, request, loggedUser.id)
+
+def check_path_user_version(request: Request, userPath = Depends(auth_service.get_path_user), db: Session = Depends(get_db)):
+    __check_version(db, request, userPath.id)
+
+def check_path_owner_version(request: Request, userPath = Depends(auth_service.get_path_owner), db: Session = Depends(get_db)):
+    __check_version(db, request, userPath.id)
@@ -1,21 +1,30 @@
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, update
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from pytest import fixture
 from uuid import uuid4
 
-from ..models import user_model
+from datetime import date, datetime, timedelta
+
+from ..models import expenditures_day_stat_model, expenditures_month_stat_model, expenditures_year_stat_model, job_model, user_model
 from ..database import Base
 from ..main import app, get_db
-from ..services import auth_service, user_service
+from ..dependencies import get_async_db, get_settings
+from ..jobs import worker
+from ..services import auth_service, job_service, user_service
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+SQLALCHEMY_ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL)
+TestingAsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession)
+
 Base.metadata.create_all(bind=engine)
 
 @fixture()
@@ -31,10 +40,14 @@ def override_get_db():
         db = TestingSessionLocal()
         yield db
     finally:
-        print("should close db")
-        # db.close()
+        db.close()
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 client = TestClient(app)
 
@@ -306,3 +319,649 @@ def test_index_expenditures_day_stats_limit(test_db):
     assert response['month_costs'][1]["2"] == 100
     assert response['month_costs'][1]["limit"] == 21.37
     
+
+def test_expenditures_day_stats_follow_updates_and_deletes(test_db):
+    expenditures = []
+    for cost in [1.5, 2.5]:
+        expenditures.append(client.post(
+            version + "/expenditures/",
+            json={
+                "name":"name",
+                "cost":cost,
+                "date":"2008-09-15",
+                "place":"place",
+                "type":"normal"
+            },
+            headers=authHeadersAdmin
+        ).json())
+
+    # move the second expenditure to another day
+    response = client.put(
+        version + "/expenditures/" + expenditures[1]['uuid'],
+        json={
+            "name":"name",
+            "cost":3.5,
+            "date":"2008-09-16",
+            "place":"place",
+            "type":"normal"
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 204
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats",
+        headers=authHeadersAdmin
+    )
+
+    assert [(day['date'], day['total_cost']) for day in response.json()['data']] == [("2008-09-15", 1.5), ("2008-09-16", 3.5)]
+
+    response = client.delete(
+        version + "/expenditures/" + expenditures[0]['uuid'],
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 204
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats",
+        headers=authHeadersAdmin
+    )
+
+    assert [(day['date'], day['total_cost']) for day in response.json()['data']] == [("2008-09-16", 3.5)]
+
+def test_rebuild_expenditures_day_stats(test_db):
+    for day, cost in [("2008-09-15", 1.5), ("2008-09-15", 2.5), ("2008-09-16", 3.5)]:
+        client.post(
+            version + "/expenditures/",
+            json={
+                "name":"name",
+                "cost":cost,
+                "date":day,
+                "place":"place",
+                "type":"normal"
+            },
+            headers=authHeadersAdmin
+        )
+
+    db = next(override_get_db())
+    db.query(expenditures_day_stat_model.ExpendituresDayStat).update({"total_cost": 0})
+    db.query(expenditures_month_stat_model.ExpendituresMonthStat).delete()
+    db.commit()
+
+    response = client.post(
+        version + "/expenditures-day-stats/rebuild",
+        headers=authHeaders
+    )
+
+    assert response.status_code == 403
+
+    response = client.post(
+        version + "/expenditures-day-stats/rebuild",
+        params={
+            "user_uuid": testUserAdmin.uuid
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 200
+    assert response.json()['rebuilt'] == 2
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats",
+        headers=authHeadersAdmin
+    )
+
+    data = response.json()['data']
+    assert [(day['date'], day['total_cost']) for day in data] == [("2008-09-15", 4.0), ("2008-09-16", 3.5)]
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/month-limit",
+        params={
+            "year": 2008
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.json()['month_costs'] == [{"9": 7.5, "limit": 0}]
+
+    response = client.get(
+        version + "/expenditures-day-stats/" + data[0]['uuid'],
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 200
+
+def test_jobs_of_one_day_coalesce(test_db, monkeypatch):
+    runs = []
+    monkeypatch.setitem(worker.JOB_HANDLERS, "day", lambda db, job: runs.append((job.owner_id, job.date)))
+
+    db = next(override_get_db())
+    for _ in range(3):
+        job_service.enqueue_job(db, "day", owner_id=testUserAdmin.id, day=date(2008, 9, 15))
+    db.commit()
+
+    assert db.query(job_model.JobModel).count() == 1
+    assert worker.run_pending_jobs(db) == 1
+    assert db.query(job_model.JobModel).count() == 0
+    assert runs == [(testUserAdmin.id, date(2008, 9, 15))]
+
+def test_claim_job_retries_after_a_lost_claim(test_db):
+    db = next(override_get_db())
+    first = job_service.enqueue_job(db, "first")
+    second = job_service.enqueue_job(db, "second")
+    db.commit()
+
+    raced = []
+
+    # another worker claims the first job between the select and the update
+    def claim_first(conn, cursor, statement, parameters, context, executemany):
+        if raced or not statement.startswith("UPDATE jobs"):
+            return
+
+        raced.append(first)
+        with engine.begin() as otherWorker:
+            otherWorker.execute(update(job_model.JobModel).where(job_model.JobModel.uuid == first).values(status=job_model.JobStatus.running, attempts=1))
+
+    event.listen(engine, "before_cursor_execute", claim_first)
+    try:
+        job = job_service.claim_job(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", claim_first)
+
+    assert raced == [first]
+    assert job.uuid == second
+
+def test_rebuild_expenditures_day_stats_background(test_db):
+    client.post(
+        version + "/expenditures/",
+        json={
+            "name":"name",
+            "cost":1.5,
+            "date":"2008-09-15",
+            "place":"place",
+            "type":"normal"
+        },
+        headers=authHeadersAdmin
+    )
+
+    db = next(override_get_db())
+    db.query(expenditures_day_stat_model.ExpendituresDayStat).delete()
+    db.commit()
+
+    response = client.post(
+        version + "/expenditures-day-stats/rebuild",
+        params={
+            "background": True
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 202
+    assert job_service.get_job(db, uuid=response.json()['job']) is not None
+    assert worker.run_pending_jobs(db) == 1
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats",
+        headers=authHeadersAdmin
+    )
+
+    assert [(day['date'], day['total_cost']) for day in response.json()['data']] == [("2008-09-15", 1.5)]
+
+def test_failing_job_is_retried_and_dead_lettered(test_db, monkeypatch):
+    def fail(db, job):
+        raise ValueError("broken")
+
+    monkeypatch.setitem(worker.JOB_HANDLERS, "failing", fail)
+    monkeypatch.setattr(get_settings(), "job_max_attempts", 2)
+    monkeypatch.setattr(get_settings(), "job_retry_backoff_seconds", 0)
+
+    db = next(override_get_db())
+    uuid = job_service.enqueue_job(db, "failing")
+    db.commit()
+
+    assert worker.run_pending_jobs(db) == 2
+
+    job = job_service.get_job(db, uuid=uuid)
+    assert job.status == job_model.JobStatus.dead
+    assert job.attempts == 2
+    assert "broken" in job.last_error
+    assert worker.run_pending_jobs(db) == 0
+
+def test_expired_job_lease_is_reclaimed_and_dead_lettered(test_db, monkeypatch):
+    monkeypatch.setattr(get_settings(), "job_max_attempts", 2)
+
+    db = next(override_get_db())
+    uuid = job_service.enqueue_job(db, "failing")
+    db.commit()
+
+    expired = datetime.utcnow() - timedelta(seconds=1)
+    staleDb = next(override_get_db())
+    staleJob = job_service.claim_job(staleDb)
+    db.query(job_model.JobModel).filter(job_model.JobModel.uuid == uuid).update({"locked_until": expired})
+    db.commit()
+
+    job = job_service.claim_job(db)
+    assert job.attempts == 2
+
+    # the worker whose lease expired can no longer finish the job
+    job_service.complete_job(staleDb, staleJob)
+    assert job_service.get_job(db, uuid=uuid).status == job_model.JobStatus.running
+
+    db.query(job_model.JobModel).filter(job_model.JobModel.uuid == uuid).update({"locked_until": expired})
+    db.commit()
+
+    assert job_service.claim_job(db) is None
+
+    job = job_service.get_job(db, uuid=uuid)
+    assert job.status == job_model.JobStatus.dead
+    assert job.attempts == 2
+    assert job.last_error == "Lease expired"
+
+def test_month_limit_follows_updates_and_deletes(test_db):
+    expenditures = []
+    for day, cost in [("2008-01-15", 1.5), ("2008-02-15", 2.5), ("2009-02-15", 4.0)]:
+        expenditures.append(client.post(
+            version + "/expenditures/",
+            json={
+                "name":"name",
+                "cost":cost,
+                "date":day,
+                "place":"place",
+                "type":"normal"
+            },
+            headers=authHeadersAdmin
+        ).json())
+
+    client.post(
+        version + "/limits/",
+        json={
+            "year": 2008,
+            "month": 1,
+            "limit": 10
+        },
+        headers=authHeadersAdmin
+    )
+
+    # move the february expenditure to january
+    client.put(
+        version + "/expenditures/" + expenditures[1]['uuid'],
+        json={
+            "name":"name",
+            "cost":2.5,
+            "date":"2008-01-20",
+            "place":"place",
+            "type":"normal"
+        },
+        headers=authHeadersAdmin
+    )
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/month-limit",
+        params={
+            "year": 2008
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "year": 2008,
+        "total_cost": 4.0,
+        "total_limit": 10.0,
+        "month_costs": [{"1": 4.0, "limit": 10.0}]
+    }
+
+    for expenditure in expenditures[:2]:
+        client.delete(
+            version + "/expenditures/" + expenditure['uuid'],
+            headers=authHeadersAdmin
+        )
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/month-limit",
+        params={
+            "year": 2008
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.json()['month_costs'] == []
+    assert response.json()['total_cost'] == 0
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/month-limit",
+        params={
+            "year": 2009
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.json()['month_costs'] == [{"2": 4.0, "limit": 0}]
+
+def test_totals_are_not_running_float_sums(test_db):
+    expenditures = []
+    for cost in [10.2, 1.2, 0.1]:
+        expenditures.append(client.post(
+            version + "/expenditures/",
+            json={
+                "name":"name",
+                "cost":cost,
+                "date":"2008-01-15",
+                "place":"place",
+                "type":"normal"
+            },
+            headers=authHeadersAdmin
+        ).json())
+
+    client.put(
+        version + "/expenditures/" + expenditures[2]['uuid'],
+        json={
+            "name":"name",
+            "cost":0.3,
+            "date":"2008-01-15",
+            "place":"place",
+            "type":"normal"
+        },
+        headers=authHeadersAdmin
+    )
+
+    for expenditure in [expenditures[0], expenditures[2]]:
+        client.delete(
+            version + "/expenditures/" + expenditure['uuid'],
+            headers=authHeadersAdmin
+        )
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/",
+        headers=authHeadersAdmin
+    )
+
+    assert [stat['total_cost'] for stat in response.json()['data']] == [1.2]
+
+    for group_by in ["month", "year"]:
+        response = client.get(
+            version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/",
+            params={
+                "group_by": group_by
+            },
+            headers=authHeadersAdmin
+        )
+
+        assert [period['total_cost'] for period in response.json()['data']] == [1.2]
+
+    db = next(override_get_db())
+    assert db.query(expenditures_month_stat_model.ExpendituresMonthStat).filter_by(owner_id=testUserAdmin.id).one().total_cost == 1.2
+    assert db.query(expenditures_year_stat_model.ExpendituresYearStat).filter_by(owner_id=testUserAdmin.id).one().total_cost == 1.2
+
+def test_month_limit_total_limit(test_db):
+    client.post(
+        version + "/expenditures/",
+        json={
+            "name":"name",
+            "cost":4.0,
+            "date":"2008-01-15",
+            "place":"place",
+            "type":"normal"
+        },
+        headers=authHeadersAdmin
+    )
+
+    for year, month, limit in [(2008, 1, 8), (2008, 2, 10.5), (2009, 3, 20)]:
+        client.post(
+            version + "/limits/",
+            json={
+                "year": year,
+                "month": month,
+                "limit": limit
+            },
+            headers=authHeadersAdmin
+        )
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/month-limit",
+        params={
+            "year": 2008
+        },
+        headers=authHeadersAdmin
+    )
+
+    # the limits of the months without expenditures count too
+    assert response.json() == {
+        "year": 2008,
+        "total_cost": 4.0,
+        "total_limit": 18.5,
+        "month_costs": [{"1": 4.0, "limit": 8.0}]
+    }
+
+    # a year without expenditures has no total limit
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/month-limit",
+        params={
+            "year": 2009
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.json() == {
+        "year": 2009,
+        "total_cost": 0,
+        "total_limit": 0,
+        "month_costs": []
+    }
+
+def test_index_expenditures_day_stats_group_by(test_db):
+    for day, cost in [("2008-01-05", 1.0), ("2008-01-07", 2.0), ("2008-03-31", 4.0), ("2008-04-01", 8.0), ("2009-12-31", 16.0)]:
+        client.post(
+            version + "/expenditures/",
+            json={
+                "name":"name",
+                "cost":cost,
+                "date":day,
+                "place":"place",
+                "type":"normal"
+            },
+            headers=authHeadersAdmin
+        )
+
+    def get_periods(group_by, **params):
+        response = client.get(
+            version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/",
+            params={
+                "group_by": group_by,
+                **params
+            },
+            headers=authHeadersAdmin
+        )
+
+        assert response.status_code == 200
+        assert response.json()['group_by'] == group_by
+
+        return [(period['period'], period['date'], period['total_cost']) for period in response.json()['data']]
+
+    assert get_periods("day", date_to="2008-01-31") == [("2008-01-05", "2008-01-05", 1.0), ("2008-01-07", "2008-01-07", 2.0)]
+    # 2008-01-05 is a saturday, 2008-01-07 the next monday
+    assert get_periods("week", date_to="2008-01-31") == [("2008-W01", "2007-12-31", 1.0), ("2008-W02", "2008-01-07", 2.0)]
+    assert get_periods("month") == [("2008-01", "2008-01-01", 3.0), ("2008-03", "2008-03-01", 4.0), ("2008-04", "2008-04-01", 8.0), ("2009-12", "2009-12-01", 16.0)]
+    assert get_periods("quarter") == [("2008-Q1", "2008-01-01", 7.0), ("2008-Q2", "2008-04-01", 8.0), ("2009-Q4", "2009-10-01", 16.0)]
+    assert get_periods("year") == [("2008", "2008-01-01", 15.0), ("2009", "2009-01-01", 16.0)]
+    # a range starting mid-month is summed from the days
+    assert get_periods("month", date_from="2008-01-06", date_to="2008-03-31") == [("2008-01", "2008-01-01", 2.0), ("2008-03", "2008-03-01", 4.0)]
+    assert get_periods("year", limit=1, page=2) == [("2009", "2009-01-01", 16.0)]
+    assert get_periods("year", date_from="2008-01-01", date_to="2008-12-31") == [("2008", "2008-01-01", 15.0)]
+    assert get_periods("year", date_from="2008-01-06", date_to="2009-12-31") == [("2008", "2008-01-01", 14.0), ("2009", "2009-01-01", 16.0)]
+
+    # whole years are read from the year rollup
+    db = next(override_get_db())
+    db.query(expenditures_year_stat_model.ExpendituresYearStat).filter_by(owner_id=testUserAdmin.id, year=2009).update({"total_cost": 32.0})
+    db.commit()
+
+    assert get_periods("year", date_from="2009-01-01") == [("2009", "2009-01-01", 32.0)]
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/",
+        params={
+            "group_by": "decade"
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 422
+
+def test_budget_summary(test_db):
+    for day, cost in [("2008-01-15", 4.0), ("2008-01-20", 2.0), ("2009-03-01", 30.0)]:
+        client.post(
+            version + "/expenditures/",
+            json={
+                "name":"name",
+                "cost":cost,
+                "date":day,
+                "place":"place",
+                "type":"normal"
+            },
+            headers=authHeadersAdmin
+        )
+
+    for year, month, limit in [(2008, 1, 8), (2008, 2, 10), (2009, 3, 20)]:
+        client.post(
+            version + "/limits/",
+            json={
+                "year": year,
+                "month": month,
+                "limit": limit
+            },
+            headers=authHeadersAdmin
+        )
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/budget-summary",
+        params={
+            "years": "2007-2009"
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 200
+    assert response.json()['data'] == [
+        {"year": 2007, "total_cost": 0, "limit": 0, "remaining": 0, "utilisation": None, "months": []},
+        {"year": 2008, "total_cost": 6.0, "limit": 18.0, "remaining": 12.0, "utilisation": 0.3333, "months": [
+            {"month": 1, "total_cost": 6.0, "limit": 8.0, "remaining": 2.0, "utilisation": 0.75},
+            {"month": 2, "total_cost": 0, "limit": 10.0, "remaining": 10.0, "utilisation": 0.0},
+        ]},
+        {"year": 2009, "total_cost": 30.0, "limit": 20.0, "remaining": -10.0, "utilisation": 1.5, "months": [
+            {"month": 3, "total_cost": 30.0, "limit": 20.0, "remaining": -10.0, "utilisation": 1.5},
+        ]},
+    ]
+
+    for years in ["2009-2008", "twenty", "2008-2009-2010"]:
+        response = client.get(
+            version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/budget-summary",
+            params={
+                "years": years
+            },
+            headers=authHeadersAdmin
+        )
+
+        assert response.status_code == 422
+
+def test_recurring_expenditures_stats(test_db):
+    client.post(
+        version + "/expenditures/",
+        json={
+            "name":"gym",
+            "cost":10,
+            "date":"2008-01-07",
+            "place":"place",
+            "type":"cyclical",
+            "recurrence": {
+                "unit": "week",
+                "interval": 2,
+                "end_date": "2008-02-29"
+            }
+        },
+        headers=authHeadersAdmin
+    )
+
+    def get_months():
+        response = client.get(
+            version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/",
+            params={
+                "group_by": "month"
+            },
+            headers=authHeadersAdmin
+        )
+
+        return [(period['period'], period['total_cost']) for period in response.json()['data']]
+
+    # 2008-01-07, 01-21, 02-04 and 02-18, only the first one is stored
+    assert get_months() == [("2008-01", 20.0), ("2008-02", 20.0)]
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/budget-summary",
+        params={
+            "years": "2008"
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.json()['data'][0]['total_cost'] == 40.0
+
+    db = next(override_get_db())
+    job_service.enqueue_job(db, worker.MATERIALIZE_RECURRENCES, owner_id=testUserAdmin.id, payload={"until": "2008-01-31"})
+    db.commit()
+
+    assert worker.run_pending_jobs(db) == 1
+    assert db.query(expenditures_day_stat_model.ExpendituresDayStat).filter_by(owner_id=testUserAdmin.id, date=date(2008, 1, 21)).one().total_cost == 10.0
+    # the materialized occurrences are not expanded again
+    assert get_months() == [("2008-01", 20.0), ("2008-02", 20.0)]
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/",
+        headers=authHeadersAdmin
+    )
+
+    assert [stat['date'] for stat in response.json()['data']] == ["2008-01-07", "2008-01-21"]
+
+def test_recurring_expenditures_expanded_to_the_requested_end(test_db):
+    # a rule in the future, its occurrences are all after today
+    year = date.today().year + 1
+
+    client.post(
+        version + "/expenditures/",
+        json={
+            "name":"rent",
+            "cost":10,
+            "date":"%d-01-01" % year,
+            "place":"place",
+            "type":"cyclical",
+            "recurrence": {
+                "unit": "month",
+                "interval": 1,
+                "end_date": "%d-03-01" % year
+            }
+        },
+        headers=authHeadersAdmin
+    )
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/",
+        params={
+            "group_by": "year",
+            "date_from": "%d-01-01" % year,
+            "date_to": "%d-12-31" % year
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.json()['data'][0]['total_cost'] == 30.0
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures-day-stats/budget-summary",
+        params={
+            "years": str(year)
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.json()['data'][0]['total_cost'] == 30.0
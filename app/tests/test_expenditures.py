@@ -1,21 +1,32 @@
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.dialects import postgresql
 from pytest import fixture
 from uuid import uuid4
+import importlib.util
+import json
+from pathlib import Path
 
 from ..models import user_model
 from ..database import Base
 from ..main import app, get_db
-from ..services import auth_service, user_service
+from ..dependencies import get_async_db
+from ..services import auth_service, search_service, user_service
+from ..schemas import expenditure_schemas
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+SQLALCHEMY_ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL)
+TestingAsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession)
+
 Base.metadata.create_all(bind=engine)
 
 @fixture()
@@ -31,10 +42,14 @@ def override_get_db():
         db = TestingSessionLocal()
         yield db
     finally:
-        print("should close db")
-        # db.close()
+        db.close()
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 client = TestClient(app)
 
@@ -219,7 +234,8 @@ def test_get_expenditures(test_db):
         ],
         'page': 1,
         'last_page': 1,
-        'limit': 100
+        'limit': 100,
+        'next_cursor': None
     }
 
 def test_get_expenditures_filter_by_user(test_db):
@@ -270,7 +286,8 @@ def test_get_expenditures_filter_by_user(test_db):
         ],
         'page': 1,
         'last_page': 1,
-        'limit': 100
+        'limit': 100,
+        'next_cursor': None
     }
 
 def test_get_expenditures_filter_by_user_not_found(test_db):
@@ -439,3 +456,696 @@ def test_delete_expenditure_not_found(test_db):
         headers=authHeadersAdmin
     )
     assert response.status_code == 404
+
+def test_get_expenditures_cursor(test_db):
+    user = testUserAdmin
+
+    expenditures = []
+    for day in ["2008-09-17", "2008-09-15", "2008-09-16"]:
+        expenditures.append(client.post(
+            version + "/expenditures/",
+            json={
+                "name":"name",
+                "cost":1.2,
+                "date":day,
+                "place":"place",
+                "type":"cyclical"
+            },
+            headers=authHeadersAdmin
+        ).json())
+
+    response = client.get(
+        version + "/users/" + user.uuid + "/expenditures/",
+        params={
+            "limit": 2,
+            "cursor": ""
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 200
+    firstPage = response.json()
+    assert [expenditure['date'] for expenditure in firstPage['data']] == ["2008-09-15", "2008-09-16"]
+    assert firstPage['page'] is None
+    assert firstPage['next_cursor'] is not None
+
+    response = client.get(
+        version + "/users/" + user.uuid + "/expenditures/",
+        params={
+            "limit": 2,
+            "cursor": firstPage['next_cursor']
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 200
+    secondPage = response.json()
+    assert [expenditure['date'] for expenditure in secondPage['data']] == ["2008-09-17"]
+    assert secondPage['next_cursor'] is None
+
+def test_get_expenditures_invalid_cursor(test_db):
+    response = client.get(
+        version + "/expenditures/",
+        params={
+            "cursor": "not-a-cursor"
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 400
+
+def test_get_expenditures_last_page(test_db):
+    for day in ["2008-09-15", "2008-09-16", "2008-09-17"]:
+        client.post(
+            version + "/expenditures/",
+            json={
+                "name":"name",
+                "cost":1.2,
+                "date":day,
+                "place":"place",
+                "type":"cyclical"
+            },
+            headers=authHeadersAdmin
+        )
+
+    response = client.get(
+        version + "/expenditures/",
+        params={
+            "limit": 2,
+            "page": 2
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 200
+    assert len(response.json()['data']) == 1
+    assert response.json()['last_page'] == 2
+
+    response = client.get(
+        version + "/expenditures/",
+        params={
+            "limit": 2,
+            "date_from": "2008-09-16",
+            "approximate_total": True
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 200
+    assert len(response.json()['data']) == 2
+    assert response.json()['last_page'] == 1
+
+def test_get_expenditures_search(test_db):
+    user = testUserAdmin
+
+    for name, place in [("groceries", "market"), ("cinema", "mall"), ("coffee", "supermarket")]:
+        client.post(
+            version + "/expenditures/",
+            json={
+                "name":name,
+                "cost":1.2,
+                "date":"2008-09-15",
+                "place":place,
+                "type":"normal"
+            },
+            headers=authHeadersAdmin
+        )
+
+    response = client.get(
+        version + "/users/" + user.uuid + "/expenditures/",
+        params={
+            "search": "groc"
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 200
+    assert [expenditure['name'] for expenditure in response.json()['data']] == ["groceries"]
+    assert response.json()['last_page'] == 1
+
+    response = client.get(
+        version + "/expenditures/",
+        params={
+            "search": "mar"
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 200
+    assert [expenditure['name'] for expenditure in response.json()['data']] == ["groceries"]
+
+def test_postgresql_search_matches_the_index():
+    # postgresql only uses ix_expenditures_search when the query repeats its expression, bound parameters do not match
+    migration = importlib.util.spec_from_file_location("expenditures_search", Path(__file__).parents[2] / "alembic" / "versions" / "0003_expenditures_search.py")
+    module = importlib.util.module_from_spec(migration)
+    migration.loader.exec_module(module)
+
+    document = search_service.POSTGRESQL_DOCUMENT.compile(dialect=postgresql.dialect())
+
+    assert document.params == {}
+    assert "(" + str(document).replace("expenditures.", "") + ")" in module.POSTGRESQL_UPGRADE[0]
+
+def test_get_expenditures_invalid_token(test_db):
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/",
+        headers={
+            "Authorization": "Bearer invalid"
+        }
+    )
+
+    assert response.status_code == 401
+
+def test_get_expenditures_other_user(test_db):
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures/",
+        headers=authHeaders
+    )
+
+    assert response.status_code == 403
+
+def test_export_expenditures(test_db):
+    for day, name in [("2008-01-02", "bread, butter"), ("2008-01-01", "milk"), ("2009-01-01", "tea")]:
+        client.post(
+            version + "/expenditures/",
+            json={
+                "name":name,
+                "cost":1.5,
+                "date":day,
+                "place":"shop",
+                "type":"normal"
+            },
+            headers=authHeaders
+        )
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/export",
+        params={
+            "date_to": "2008-12-31"
+        },
+        headers=authHeaders
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0] == "uuid,date,name,place,cost,type"
+    assert [line.split(",", 1)[1] for line in lines[1:]] == ['2008-01-01,milk,shop,1.5,normal', '2008-01-02,"bread, butter",shop,1.5,normal']
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/export",
+        params={
+            "format": "ndjson"
+        },
+        headers=authHeaders
+    )
+
+    assert response.status_code == 200
+    assert [(row["date"], row["name"], row["type"]) for row in map(json.loads, response.text.splitlines())] == [
+        ("2008-01-01", "milk", "normal"),
+        ("2008-01-02", "bread, butter", "normal"),
+        ("2009-01-01", "tea", "normal"),
+    ]
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/export",
+        params={
+            "format": "xml"
+        },
+        headers=authHeaders
+    )
+
+    assert response.status_code == 422
+
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures/export",
+        headers=authHeaders
+    )
+
+    assert response.status_code == 403
+
+def test_batch_expenditures(test_db):
+    expenditures = []
+    for day in ["2008-01-01", "2008-01-02"]:
+        expenditures.append(client.post(
+            version + "/expenditures/",
+            json={
+                "name":"name",
+                "cost":1.5,
+                "date":day,
+                "place":"place",
+                "type":"normal"
+            },
+            headers=authHeaders
+        ).json())
+
+    def get_expenditure(day, cost):
+        return {
+            "name":"name",
+            "cost":cost,
+            "date":day,
+            "place":"place",
+            "type":"normal"
+        }
+
+    response = client.post(
+        version + "/expenditures/batch",
+        json={
+            "operations": [
+                {"op": "create", "expenditure": get_expenditure("2008-01-01", 2.0)},
+                {"op": "create", "expenditure": get_expenditure("2008-01-03", 4.0)},
+                {"op": "update", "uuid": expenditures[0]['uuid'], "expenditure": get_expenditure("2008-01-03", 8.0)},
+                {"op": "delete", "uuid": expenditures[1]['uuid']},
+            ]
+        },
+        headers=authHeaders
+    )
+
+    assert response.status_code == 200
+    assert [result['op'] for result in response.json()['data']] == ["create", "create", "update", "delete"]
+    assert response.json()['data'][2]['uuid'] == expenditures[0]['uuid']
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/",
+        headers=authHeaders
+    )
+
+    assert [(expenditure['date'], expenditure['cost']) for expenditure in response.json()['data']] == [("2008-01-01", 2.0), ("2008-01-03", 8.0), ("2008-01-03", 4.0)]
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures-day-stats/",
+        headers=authHeaders
+    )
+
+    assert [(stat['date'], stat['total_cost']) for stat in response.json()['data']] == [("2008-01-01", 2.0), ("2008-01-03", 12.0)]
+
+    # nothing is applied when one of the operations is invalid
+    for operations, status_code in [
+        ([{"op": "delete", "uuid": expenditures[1]['uuid']}], 404),
+        ([{"op": "update", "uuid": expenditures[0]['uuid']}], 422),
+        ([{"op": "delete", "uuid": expenditures[0]['uuid']}, {"op": "delete", "uuid": expenditures[0]['uuid']}], 422),
+        ([], 422),
+    ]:
+        response = client.post(
+            version + "/expenditures/batch",
+            json={
+                "operations": [{"op": "create", "expenditure": get_expenditure("2008-01-05", 1.0)}] + operations
+            } if operations else {"operations": []},
+            headers=authHeaders
+        )
+
+        assert response.status_code == status_code
+
+    response = client.post(
+        version + "/expenditures/batch",
+        json={
+            "operations": [{"op": "delete", "uuid": expenditures[0]['uuid']}]
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 403
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/",
+        headers=authHeaders
+    )
+
+    assert len(response.json()['data']) == 3
+
+def test_import_expenditures(test_db):
+    content = "name,cost,date,place\nbread,1.5,2008-01-02,shop\nmilk,abc,2008-01-03,shop\ntea,2.5,2008-01-02,shop\n"
+
+    response = client.post(
+        version + "/users/" + testUser.uuid + "/expenditures/import",
+        files={"file": ("statement.csv", content.encode(), "text/csv")},
+        headers=authHeaders
+    )
+
+    assert response.status_code == 200
+    progress = [json.loads(line) for line in response.text.splitlines()]
+    assert progress[0]['errors'][0]['row'] == 3
+    assert progress[0]['errors'][0]['errors'][0]['field'] == "cost"
+    assert progress[-1] == {"rows": 3, "imported": 2, "failed": 1, "done": True}
+
+    content = """OFXHEADER:100
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20080105120000
+<TRNAMT>-12.50
+<NAME>Grocery store
+<MEMO>Card payment
+</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20080106<TRNAMT>1000.00<NAME>Salary</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+    response = client.post(
+        version + "/users/" + testUser.uuid + "/expenditures/import",
+        files={"file": ("statement.ofx", content.encode(), "application/x-ofx")},
+        headers=authHeaders
+    )
+
+    assert response.status_code == 200
+    assert json.loads(response.text.splitlines()[-1]) == {"rows": 1, "imported": 1, "failed": 0, "done": True}
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/",
+        headers=authHeaders
+    )
+
+    assert [(expenditure['date'], expenditure['name'], expenditure['cost']) for expenditure in response.json()['data']] == [
+        ("2008-01-02", "bread", 1.5),
+        ("2008-01-02", "tea", 2.5),
+        ("2008-01-05", "Grocery store", 12.5),
+    ]
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures-day-stats/",
+        headers=authHeaders
+    )
+
+    assert [(stat['date'], stat['total_cost']) for stat in response.json()['data']] == [("2008-01-02", 4.0), ("2008-01-05", 12.5)]
+
+    response = client.post(
+        version + "/users/" + testUserAdmin.uuid + "/expenditures/import",
+        files={"file": ("statement.csv", b"name,cost,date,place\n", "text/csv")},
+        headers=authHeaders
+    )
+
+    assert response.status_code == 403
+
+def test_recurring_expenditures(test_db):
+    rent = {
+        "name":"rent",
+        "cost":100,
+        "date":"2008-01-31",
+        "place":"home",
+        "type":"cyclical",
+        "recurrence": {
+            "unit": "month",
+            "interval": 1,
+            "end_date": "2008-04-30"
+        }
+    }
+
+    response = client.post(
+        version + "/expenditures/",
+        json={**rent, "type": "normal"},
+        headers=authHeaders
+    )
+
+    assert response.status_code == 422
+
+    response = client.post(
+        version + "/expenditures/",
+        json=rent,
+        headers=authHeaders
+    )
+
+    assert response.status_code == 201
+    assert response.json()['recurrence'] == {"unit": "month", "interval": 1, "end_date": "2008-04-30"}
+    rentUuid = response.json()['uuid']
+
+    client.post(
+        version + "/expenditures/",
+        json={
+            "name":"bread",
+            "cost":1.5,
+            "date":"2008-02-29",
+            "place":"shop",
+            "type":"normal"
+        },
+        headers=authHeaders
+    )
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/",
+        headers=authHeaders
+    )
+
+    assert len(response.json()['data']) == 2
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/",
+        params={
+            "expand": True
+        },
+        headers=authHeaders
+    )
+
+    # the rule is stored once, the month ends are clamped
+    expenditures = [(expenditure['date'], expenditure['name'], expenditure['occurrence']) for expenditure in response.json()['data']]
+    assert expenditures == [
+        ("2008-01-31", "rent", False),
+        ("2008-02-29", "rent", True),
+        ("2008-02-29", "bread", False),
+        ("2008-03-31", "rent", True),
+        ("2008-04-30", "rent", True),
+    ]
+    assert response.json()['data'][1]['uuid'] == rentUuid
+    assert response.json()['last_page'] == 1
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/",
+        params={
+            "expand": True,
+            "date_from": "2008-03-01",
+            "limit": 1,
+            "cursor": ""
+        },
+        headers=authHeaders
+    )
+
+    assert [expenditure['date'] for expenditure in response.json()['data']] == ["2008-03-31"]
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/",
+        params={
+            "expand": True,
+            "date_from": "2008-03-01",
+            "limit": 1,
+            "cursor": response.json()['next_cursor']
+        },
+        headers=authHeaders
+    )
+
+    assert [expenditure['date'] for expenditure in response.json()['data']] == ["2008-04-30"]
+
+def test_get_expenditures_fields(test_db):
+    for day in ["2008-01-02", "2008-01-01"]:
+        client.post(
+            version + "/expenditures/",
+            json={
+                "name":"name",
+                "cost":1.5,
+                "date":day,
+                "place":"place",
+                "type":"normal"
+            },
+            headers=authHeaders
+        )
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/",
+        params={
+            "fields": "date,cost,type"
+        },
+        headers=authHeaders
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "data": [
+            {"date": "2008-01-01", "cost": 1.5, "type": "normal"},
+            {"date": "2008-01-02", "cost": 1.5, "type": "normal"},
+        ],
+        "page": 1,
+        "last_page": 1,
+        "limit": 100,
+        "next_cursor": None
+    }
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/",
+        params={
+            "fields": "uuid",
+            "limit": 1,
+            "cursor": ""
+        },
+        headers=authHeaders
+    )
+
+    assert list(response.json()['data'][0]) == ["uuid"]
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/",
+        params={
+            "fields": "uuid",
+            "limit": 1,
+            "cursor": response.json()['next_cursor']
+        },
+        headers=authHeaders
+    )
+
+    assert len(response.json()['data']) == 1
+
+    response = client.get(
+        version + "/expenditures/",
+        params={
+            "fields": "name,owner_id"
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 422
+
+def test_get_expenditures_trusted_response(test_db):
+    client.post(
+        version + "/expenditures/",
+        json={
+            "name":"rent",
+            "cost":100,
+            "date":"2008-01-31",
+            "place":"home",
+            "type":"cyclical",
+            "recurrence": {
+                "unit": "month",
+                "interval": 2
+            }
+        },
+        headers=authHeaders
+    )
+
+    response = client.get(
+        version + "/users/" + testUser.uuid + "/expenditures/",
+        headers=authHeaders
+    )
+
+    assert response.status_code == 200
+
+    # the listing is built without validation, it has to match the validated schema
+    pagination = expenditure_schemas.Pagination(**response.json())
+    assert response.json() == json.loads(pagination.json())
+    assert response.json()['data'][0]['recurrence'] == {"unit": "month", "interval": 2, "end_date": None}
+    assert "owner_id" not in response.json()['data'][0]
+
+def test_get_expenditures_not_modified(test_db):
+    url = version + "/users/" + testUser.uuid + "/expenditures/"
+
+    response = client.get(url, headers=authHeaders)
+
+    assert response.status_code == 200
+    etag = response.headers['etag']
+    assert etag.startswith('W/"')
+
+    response = client.get(url, headers={**authHeaders, "If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+    assert response.content == b""
+
+    # another query of the same data has its own etag
+    response = client.get(url, params={"limit": 1}, headers={**authHeaders, "If-None-Match": etag})
+
+    assert response.status_code == 200
+
+    client.post(
+        version + "/expenditures/",
+        json={
+            "name":"name",
+            "cost":1.5,
+            "date":"2008-01-01",
+            "place":"place",
+            "type":"normal"
+        },
+        headers=authHeaders
+    )
+
+    response = client.get(url, headers={**authHeaders, "If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert len(response.json()['data']) == 1
+
+def test_get_changes(test_db):
+    uuids = []
+    for day in ["2008-01-01", "2008-01-02"]:
+        response = client.post(
+            version + "/expenditures/",
+            json={
+                "name":"name",
+                "cost":1.5,
+                "date":day,
+                "place":"place",
+                "type":"normal"
+            },
+            headers=authHeaders
+        )
+        uuids.append(response.json()['uuid'])
+
+    client.post(
+        version + "/limits/",
+        json={
+            "year":2008,
+            "month":1,
+            "limit":100
+        },
+        headers=authHeaders
+    )
+
+    url = version + "/users/" + testUser.uuid + "/changes"
+
+    response = client.get(url, headers=authHeaders)
+
+    assert response.status_code == 200
+    changes = response.json()
+    assert [expenditure['uuid'] for expenditure in changes['expenditures']] == uuids
+    assert len(changes['limits']) == 1
+    assert [stat['date'] for stat in changes['expenditures_day_stats']] == ["2008-01-01", "2008-01-02"]
+    assert changes['deleted'] == []
+    assert changes['has_more'] == False
+    cursor = changes['next_cursor']
+    # the cursor is a data version, like `since`
+    assert isinstance(cursor, int)
+
+    # a page ends after whole writes
+    response = client.get(url, params={"limit": 1}, headers=authHeaders)
+
+    assert len(response.json()['expenditures']) == 1
+    assert response.json()['has_more'] == True
+
+    response = client.get(url, params={"limit": 1, "since": response.json()['next_cursor']}, headers=authHeaders)
+
+    assert [expenditure['uuid'] for expenditure in response.json()['expenditures']] == uuids[1:]
+
+    client.put(
+        version + "/expenditures/" + uuids[0],
+        json={
+            "name":"renamed",
+            "cost":1.5,
+            "date":"2008-01-01",
+            "place":"place",
+            "type":"normal"
+        },
+        headers=authHeaders
+    )
+    client.delete(version + "/expenditures/" + uuids[1], headers=authHeaders)
+
+    response = client.get(url, params={"since": cursor}, headers=authHeaders)
+
+    changes = response.json()
+    assert [expenditure['name'] for expenditure in changes['expenditures']] == ["renamed"]
+    assert changes['limits'] == []
+    assert {"entity": "expenditure", "uuid": uuids[1]} in changes['deleted']
+    assert [tombstone['entity'] for tombstone in changes['deleted']].count("expenditures_day_stat") == 1
+
+    response = client.get(url, params={"since": changes['next_cursor']}, headers=authHeaders)
+
+    assert response.json()['expenditures'] == []
+    assert response.json()['deleted'] == []
+    assert response.json()['next_cursor'] == changes['next_cursor']
+
+    response = client.get(url, params={"since": 1000}, headers=authHeaders)
+
+    assert response.status_code == 400
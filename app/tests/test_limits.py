@@ -1,21 +1,27 @@
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from pytest import fixture
 from uuid import uuid4
 
 from ..models import user_model
 from ..database import Base
 from ..main import app, get_db
+from ..dependencies import get_async_db
 from ..services import auth_service, user_service
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+SQLALCHEMY_ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL)
+TestingAsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession)
+
 Base.metadata.create_all(bind=engine)
 
 @fixture()
@@ -31,10 +37,14 @@ def override_get_db():
         db = TestingSessionLocal()
         yield db
     finally:
-        print("should close db")
-        # db.close()
+        db.close()
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 client = TestClient(app)
 
@@ -201,7 +211,8 @@ def test_get_limits(test_db):
         ],
         'page': 1,
         'last_page': 1,
-        'limit': 100
+        'limit': 100,
+        'next_cursor': None
     }
 
 def test_get_limits_filter_by_user(test_db):
@@ -257,7 +268,8 @@ def test_get_limits_filter_by_user(test_db):
         ],
         'page': 1,
         'last_page': 1,
-        'limit': 100
+        'limit': 100,
+        'next_cursor': None
     }
 
 def test_get_limits_filter_by_user_not_found(test_db):
@@ -401,3 +413,36 @@ def test_delete_limit_not_found(test_db):
         headers=authHeadersAdmin
     )
     assert response.status_code == 404
+
+def test_post_limit_same_month_different_users(test_db):
+    limitAdmin = client.post(
+        version + "/limits/",
+        params={
+        },
+        json={
+            "month": 1,
+            "year": 2023,
+            "limit": 21.37
+        },
+        headers=authHeadersAdmin
+    ).json()
+    limitUser = client.post(
+        version + "/limits/",
+        params={
+        },
+        json={
+            "month": 1,
+            "year": 2023,
+            "limit": 10.00
+        },
+        headers=authHeaders
+    ).json()
+
+    assert not limitAdmin['uuid'] == limitUser['uuid']
+
+    response = client.get(
+        version + "/limits/"+ limitAdmin['uuid'],
+        headers=authHeadersAdmin
+    )
+    assert response.status_code == 200
+    assert response.json()['limit'] == 21.37
@@ -1,21 +1,28 @@
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from pytest import fixture
 from uuid import uuid4
 
+from .. import compression
 from ..models import user_model
 from ..database import Base
 from ..main import app, get_db
+from ..dependencies import get_async_db
 from ..services import auth_service, user_service
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+SQLALCHEMY_ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL)
+TestingAsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession)
+
 Base.metadata.create_all(bind=engine)
 
 @fixture()
@@ -31,10 +38,14 @@ def override_get_db():
         db = TestingSessionLocal()
         yield db
     finally:
-        print("should close db")
-        # db.close()
+        db.close()
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 client = TestClient(app)
 
@@ -88,4 +99,55 @@ def preper_to_test(db):
 
 def test_read_main(test_db):
     response = client.get("/")
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+def test_compression(test_db):
+    for day in range(1, 29):
+        client.post(
+            version + "/expenditures/",
+            json={
+                "name":"name",
+                "cost":1.5,
+                "date":"2008-02-%02d" % day,
+                "place":"place",
+                "type":"normal"
+            },
+            headers=authHeaders
+        )
+
+    url = version + "/users/" + testUser.uuid + "/expenditures/"
+
+    response = client.get(url, headers={**authHeaders, "Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert len(response.json()["data"]) == 28
+
+    # under the minimum size
+    response = client.get(url, params={"limit": 1}, headers={**authHeaders, "Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in response.headers
+
+    response = client.get(url, headers={**authHeaders, "Accept-Encoding": "gzip;q=0, identity"})
+
+    assert "content-encoding" not in response.headers
+    assert len(response.json()["data"]) == 28
+
+    # streamed
+    response = client.get(url + "export", params={"format": "ndjson"}, headers={**authHeaders, "Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert len(response.text.splitlines()) == 28
+
+def test_get_encoding_follows_weights(monkeypatch):
+    # the brotli package is optional, the choice only depends on the registered names
+    monkeypatch.setitem(compression.COMPRESSORS, "br", compression.COMPRESSORS["gzip"])
+
+    assert compression.get_encoding("gzip, br") == "br"
+    assert compression.get_encoding("br;q=0.5, gzip") == "gzip"
+    assert compression.get_encoding("br;q=0.5, gzip;q=0.8") == "gzip"
+    assert compression.get_encoding("*;q=0.1, gzip;q=0.05") == "br"
+    assert compression.get_encoding("br;q=0, gzip;q=0") is None
+    assert compression.get_encoding("identity") is None
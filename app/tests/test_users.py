@@ -1,6 +1,7 @@
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from pytest import fixture
 from uuid import uuid4
 from fastapi.encoders import jsonable_encoder
@@ -8,15 +9,20 @@ from fastapi.encoders import jsonable_encoder
 from ..models import user_model
 from ..database import Base
 from ..main import app, get_db
+from ..dependencies import get_async_db, get_settings
 from ..services import auth_service, user_service
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+SQLALCHEMY_ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL)
+TestingAsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession)
+
 Base.metadata.create_all(bind=engine)
 
 @fixture()
@@ -32,10 +38,14 @@ def override_get_db():
         db = TestingSessionLocal()
         yield db
     finally:
-        print("should close db")
-        # db.close()
+        db.close()
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 client = TestClient(app)
 
@@ -155,10 +165,14 @@ def test_get_users(test_db):
     del user1Dict['is_admin']
     del user1Dict['id']
     del user1Dict['password']
+    del user1Dict['token_version']
+    del user1Dict['data_version']
     del user2Dict['token']
     del user2Dict['is_admin']
     del user2Dict['id']
     del user2Dict['password']
+    del user2Dict['token_version']
+    del user2Dict['data_version']
 
     assert response.status_code == 200
     assert response.json() == {
@@ -168,7 +182,8 @@ def test_get_users(test_db):
         ],
         'page': 1,
         'last_page': 1,
-        'limit': 100
+        'limit': 100,
+        'next_cursor': None
     }
 
 def test_get_user(test_db):
@@ -244,4 +259,166 @@ def test_get_user_me(test_db):
         headers=authHeadersAdmin
     )
     
-    assert response.status_code == 401
\ No newline at end of file
+    assert response.status_code == 200
+    assert response.json()['email'] == testUserAdmin.email
+
+def test_logout_invalidates_token(test_db):
+    response = client.get(
+        "auth/users/me",
+        headers=authHeaders
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "auth/logout",
+        headers=authHeaders
+    )
+
+    assert response.status_code == 200
+
+    response = client.get(
+        "auth/users/me",
+        headers=authHeaders
+    )
+
+    assert response.status_code == 401
+
+def test_stateless_token_not_stored_for_new_user(test_db, monkeypatch):
+    monkeypatch.setattr(get_settings(), "stateless_tokens", True)
+
+    response = client.post(
+        version + "/users/",
+        json={
+            "email":"email@w.x",
+            "is_active":True,
+            "is_admin":False,
+            "password":"password"
+        },
+        headers=authHeadersAdmin
+    )
+
+    assert response.status_code == 201
+    assert response.json()["token"] is None
+    assert user_service.get_user(next(override_get_db()), uuid=response.json()["uuid"]).token is None
+
+def test_stateless_token_revoked_on_logout(test_db, monkeypatch):
+    monkeypatch.setattr(get_settings(), "stateless_tokens", True)
+
+    token = auth_service.generate_user_token(db=next(override_get_db()), user=testUser)
+    headers = {
+        "Authorization": "Bearer " + token
+    }
+
+    response = client.get(
+        "auth/users/me",
+        headers=headers
+    )
+
+    assert response.status_code == 200
+    assert response.json()['email'] == testUser.email
+
+    response = client.post(
+        "auth/logout",
+        headers=headers
+    )
+
+    assert response.status_code == 200
+
+    response = client.get(
+        "auth/users/me",
+        headers=headers
+    )
+
+    assert response.status_code == 401
+
+def test_get_user_access_denied(test_db):
+    response = client.get(
+        version + "/users/" + testUserAdmin.uuid,
+        headers=authHeaders
+    )
+
+    assert response.status_code == 403
+
+def test_register_and_login(test_db):
+    response = client.post(
+        "auth/register",
+        json={
+            "email":"register@w.x",
+            "password":"password"
+        }
+    )
+
+    assert response.status_code == 201
+
+    response = client.post(
+        "auth/login",
+        data={
+            "username":"register@w.x",
+            "password":"wrong"
+        }
+    )
+
+    assert response.status_code == 401
+
+    response = client.post(
+        "auth/login",
+        data={
+            "username":"register@w.x",
+            "password":"password"
+        }
+    )
+
+    assert response.status_code == 200
+    assert response.json()['token_type'] == "bearer"
+
+def test_password_hashing_does_not_hold_a_connection(test_db, monkeypatch):
+    checkedOut = []
+    hashPassword = auth_service.__hash_password
+    verifyPassword = auth_service.__verify_password
+
+    def hash_password(password):
+        checkedOut.append(async_engine.sync_engine.pool.checkedout())
+
+        return hashPassword(password)
+
+    def verify_password(password, hashed_password):
+        checkedOut.append(async_engine.sync_engine.pool.checkedout())
+
+        return verifyPassword(password, hashed_password)
+
+    monkeypatch.setattr(auth_service, "__hash_password", hash_password)
+    monkeypatch.setattr(auth_service, "__verify_password", verify_password)
+
+    response = client.post(
+        "auth/register",
+        json={
+            "email":"register@w.x",
+            "password":"password"
+        }
+    )
+
+    assert response.status_code == 201
+
+    response = client.post(
+        "auth/login",
+        data={
+            "username":"register@w.x",
+            "password":"password"
+        }
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "auth/change-password",
+        json={
+            "email":"register@w.x",
+            "password":"password",
+            "new_password":"new_password"
+        }
+    )
+
+    assert response.status_code == 200
+    # register hashes, login verifies, change-password verifies and hashes, none of them with a connection checked out
+    assert checkedOut == [0, 0, 0, 0]